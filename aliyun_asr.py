@@ -1,6 +1,11 @@
-import time
 import nls
 import os
+import json
+import asyncio
+import tracing
+from pcm_sender import send_pcm
+from asr_completion import Completion
+from asr_pool import get_pool
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -14,12 +19,16 @@ class AliyunASR:
         self.transcribed_text = ""
         self.is_completed = False
         self.error_msg = None
+        # Set by on_completed / on_error / on_close; transcribe() waits on it
+        self.completion = Completion()
 
     def on_sentence_begin(self, message, *args):
         pass
 
     def on_sentence_end(self, message, *args):
         # Result is in message['payload']['result']
+        if isinstance(message, str):
+            message = json.loads(message)
         if 'payload' in message and 'result' in message['payload']:
             self.transcribed_text += message['payload']['result']
 
@@ -29,22 +38,145 @@ class AliyunASR:
     def on_error(self, message, *args):
         self.error_msg = message
         self.is_completed = True # Stop waiting on error
+        self.completion.set()
 
     def on_close(self, *args):
-        pass
+        # Nothing more will arrive on this connection
+        self.completion.set()
 
     def on_result_chg(self, message, *args):
         pass
 
     def on_completed(self, message, *args):
         self.is_completed = True
+        self.completion.set()
+
+    def _begin(self, audio_data):
+        """Connects and sends the audio; returns (transcriber, None) or (None, error string)."""
+        if not TOKEN or not APPKEY:
+            return None, "Error: ALIYUN_TOKEN or ALIYUN_APPKEY not set in .env"
+
+        sr = nls.NlsSpeechTranscriber(
+            url=URL,
+            token=TOKEN,
+            appkey=APPKEY,
+            on_sentence_begin=self.on_sentence_begin,
+            on_sentence_end=self.on_sentence_end,
+            on_start=self.on_start,
+            on_result_changed=self.on_result_chg,
+            on_completed=self.on_completed,
+            on_error=self.on_error,
+            on_close=self.on_close,
+            pool=get_pool(URL, TOKEN)
+        )
+
+        # Start recognition
+        # aformat="pcm" implies 16000Hz, 16bit, mono usually.
+        with tracing.span("asr.connect", mode="stream"):
+            sr.start(aformat="pcm",
+                     enable_intermediate_result=False,
+                     enable_punctuation_prediction=True,
+                     enable_inverse_text_normalization=True)
+
+        # Send audio data (PCM) in chunks, paced by pcm_sender's token bucket
+        with tracing.span("asr.stream", mode="stream"):
+            try:
+                send_pcm(sr.send_audio, audio_data)
+            except Exception:
+                sr.shutdown()
+                raise
+        return sr, None
+
+    def _close(self, sr):
+        # TranscriptionCompleted hands the connection back to the pool; any other ending (timeout,
+        # error, exception) must discard it or the pool slot stays leased
+        if not self.is_completed or self.error_msg:
+            sr.shutdown()
+
+    def _result(self, span, completed):
+        if self.error_msg:
+            span.set("error", str(self.error_msg))
+            return f"ASR Error: {self.error_msg}"
+
+        if not completed or not self.is_completed:
+            span.set("error", "timeout")
+            return "ASR Timeout: No response from server."
+
+        span.set("text_chars", len(self.transcribed_text))
+        return self.transcribed_text
 
     def transcribe(self, audio_data):
+        sr = None
+        try:
+            sr, error = self._begin(audio_data)
+            if error:
+                return error
+
+            with tracing.span("asr.finalize", mode="stream") as span:
+                sr.stop()
+                # Returns the moment a callback signals the end, not on the next poll
+                completed = self.completion.wait()
+                return self._result(span, completed)
+        except Exception as e:
+            return f"ASR Exception: {e}"
+        finally:
+            if sr is not None:
+                self._close(sr)
+
+    async def atranscribe(self, audio_data):
+        """transcribe() for asyncio code: the SDK's blocking calls run in a worker thread."""
+        sr = None
+        try:
+            sr, error = await asyncio.to_thread(self._begin, audio_data)
+            if error:
+                return error
+
+            with tracing.span("asr.finalize", mode="stream") as span:
+                # stop() blocks until the server answers; the loop only awaits the completion
+                stopping = asyncio.ensure_future(asyncio.to_thread(sr.stop))
+                completed = await self.completion.async_wait()
+                await asyncio.wait({stopping})
+                return self._result(span, completed)
+        except Exception as e:
+            return f"ASR Exception: {e}"
+        finally:
+            if sr is not None:
+                self._close(sr)
+
+class LiveTranscription(AliyunASR):
+    """
+    Recognition fed while the elder is still speaking: start() when the talk button goes
+    down, feed() every PCM chunk (16k 16bit mono) as it is captured, finish() on release.
+    By then the server has recognized everything but the last moments of speech, so the
+    text is back a fraction of a second after release instead of after upload + recognition.
+    on_partial(text), if given, is called from the SDK thread with the running transcript.
+    """
+    def __init__(self, on_partial=None):
+        super().__init__()
+        self.on_partial = on_partial
+        self.sr = None
+        self.bytes = 0
+        self.chunks = 0
+
+    def on_sentence_end(self, message, *args):
+        super().on_sentence_end(message, *args)
+        if self.on_partial:
+            self.on_partial(self.transcribed_text)
+
+    def on_result_chg(self, message, *args):
+        if not self.on_partial:
+            return
+        if isinstance(message, str):
+            message = json.loads(message)
+        partial = message.get('payload', {}).get('result', '')
+        self.on_partial(self.transcribed_text + partial)
+
+    def start(self):
+        """Opens the recognition session; returns an error string or None."""
         if not TOKEN or not APPKEY:
             return "Error: ALIYUN_TOKEN or ALIYUN_APPKEY not set in .env"
-
         try:
-            sr = nls.NlsSpeechTranscriber(
+            self.sr = nls.NlsSpeechTranscriber(
                 url=URL,
                 token=TOKEN,
                 appkey=APPKEY,
@@ -54,40 +186,46 @@ class AliyunASR:
                 on_result_changed=self.on_result_chg,
                 on_completed=self.on_completed,
                 on_error=self.on_error,
-                on_close=self.on_close
+                on_close=self.on_close,
+                pool=get_pool(URL, TOKEN)
             )
-
-            # Start recognition
-            # aformat="pcm" implies 16000Hz, 16bit, mono usually.
-            r = sr.start(aformat="pcm",
-                        enable_intermediate_result=False,
-                        enable_punctuation_prediction=True,
-                        enable_inverse_text_normalization=True)
-            
-            # Send audio data in chunks
-            # audio_data should be bytes (PCM)
-            chunk_size = 640
-            slices = [audio_data[i:i+chunk_size] for i in range(0, len(audio_data), chunk_size)]
-            
-            for s in slices:
-                sr.send_audio(bytes(s))
-                time.sleep(0.001) # Small delay to simulate stream
-
-            sr.stop()
-            
-            # Wait for completion
-            start_time = time.time()
-            while not self.is_completed and time.time() - start_time < 10:
-                if self.error_msg:
-                    return f"ASR Error: {self.error_msg}"
-                time.sleep(0.1)
-                
-            if self.error_msg:
-                 return f"ASR Error: {self.error_msg}"
-
-            return self.transcribed_text
+            with tracing.span("asr.connect", mode="live"):
+                self.sr.start(aformat="pcm",
+                              enable_intermediate_result=self.on_partial is not None,
+                              enable_punctuation_prediction=True,
+                              enable_inverse_text_normalization=True)
         except Exception as e:
-            return f"ASR Exception: {e}"
+            self.sr = None
+            return f"ASR Start Failed: {e}"
+        return None
+
+    def feed(self, pcm):
+        if self.sr is None or self.error_msg:
+            return
+        self.sr.send_audio(bytes(pcm))
+        self.bytes += len(pcm)
+        self.chunks += 1
+
+    def finish(self):
+        """Flushes the session and returns the transcript (or an error string)."""
+        if self.sr is None:
+            return "ASR Error: not started"
+        tracing.current().set("bytes", self.bytes)
+        tracing.current().set("chunks", self.chunks)
+        with tracing.span("asr.finalize", mode="live") as span:
+            try:
+                self.sr.stop()
+                return self._result(span, self.completion.wait())
+            except Exception as e:
+                span.set("error", str(e))
+                return f"ASR Exception: {e}"
+            finally:
+                self._close(self.sr)
+
+    def cancel(self):
+        if self.sr is not None:
+            self.sr.shutdown()
+            self.sr = None
 
 def recognize_speech(audio_bytes):
     """
@@ -95,12 +233,21 @@ def recognize_speech(audio_bytes):
     If WAV, header should be stripped before calling, or handled here.
     Simple header stripping (44 bytes) for standard WAV.
     """
+    pcm_data = _strip_wav_header(audio_bytes)
+    with tracing.span("asr", mode="stream", bytes=len(pcm_data)):
+        asr = AliyunASR()
+        return asr.transcribe(pcm_data)
+
+async def arecognize_speech(audio_bytes):
+    """Awaitable recognize_speech()."""
+    pcm_data = _strip_wav_header(audio_bytes)
+    with tracing.span("asr", mode="stream", bytes=len(pcm_data)):
+        asr = AliyunASR()
+        return await asr.atranscribe(pcm_data)
+
+def _strip_wav_header(audio_bytes):
     # Simple check for WAV header (RIFF)
     if audio_bytes.startswith(b'RIFF'):
         # Strip 44 bytes header
-        pcm_data = audio_bytes[44:]
-    else:
-        pcm_data = audio_bytes
-        
-    asr = AliyunASR()
-    return asr.transcribe(pcm_data)
+        return memoryview(audio_bytes)[44:]
+    return audio_bytes
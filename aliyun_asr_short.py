@@ -1,7 +1,11 @@
-import time
 import nls
 import os
 import json
+import asyncio
+import tracing
+from pcm_sender import send_pcm
+from asr_completion import Completion
+from asr_pool import get_pool
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -15,6 +19,8 @@ class AliyunASRShort:
         self.transcribed_text = ""
         self.is_completed = False
         self.error_msg = None
+        # Set by on_completed / on_error / on_close; transcribe() waits on it
+        self.completion = Completion()
 
     def on_start(self, message, *args):
         # print("test_on_start:{}".format(message))
@@ -24,10 +30,12 @@ class AliyunASRShort:
         # print("on_error args=>{}".format(args))
         self.error_msg = message
         self.is_completed = True
+        self.completion.set()
 
     def on_close(self, *args):
         # print("on_close: args=>{}".format(args))
-        pass
+        # Nothing more will arrive on this connection
+        self.completion.set()
 
     def on_result_chg(self, message, *args):
         # print("test_on_chg:{}".format(message))
@@ -46,84 +54,120 @@ class AliyunASRShort:
             self.error_msg = f"Parse Error: {e}"
             
         self.is_completed = True
+        self.completion.set()
 
-    def transcribe(self, audio_data):
+    def _begin(self, audio_data):
+        """Connects and sends the audio; returns (recognizer, None) or (None, error string)."""
         if not TOKEN or not APPKEY:
-            return "Configuration Error: ALIYUN_TOKEN or ALIYUN_APPKEY is missing in .env. Please check your credentials."
+            return None, "Configuration Error: ALIYUN_TOKEN or ALIYUN_APPKEY is missing in .env. Please check your credentials."
 
-        try:
-            sr = nls.NlsSpeechRecognizer(
-                url=URL,
-                token=TOKEN,
-                appkey=APPKEY,
-                on_start=self.on_start,
-                on_result_changed=self.on_result_chg,
-                on_completed=self.on_completed,
-                on_error=self.on_error,
-                on_close=self.on_close,
-            )
-
-            # Start recognition
-            print(f"DEBUG: Starting ASR with Token={TOKEN[:5]}... AppKey={APPKEY}")
+        sr = nls.NlsSpeechRecognizer(
+            url=URL,
+            token=TOKEN,
+            appkey=APPKEY,
+            on_start=self.on_start,
+            on_result_changed=self.on_result_chg,
+            on_completed=self.on_completed,
+            on_error=self.on_error,
+            on_close=self.on_close,
+            pool=get_pool(URL, TOKEN)
+        )
+
+        # Start recognition
+        with tracing.span("asr.connect", mode="short"):
             try:
-                r = sr.start(aformat="pcm",
-                            enable_intermediate_result=False,
-                            enable_punctuation_prediction=True,
-                            enable_inverse_text_normalization=True)
+                sr.start(aformat="pcm",
+                         enable_intermediate_result=False,
+                         enable_punctuation_prediction=True,
+                         enable_inverse_text_normalization=True)
             except Exception as start_e:
-                return f"ASR Start Failed: {start_e}"
-            
-            print(f"DEBUG: ASR Start Result: {r}")
+                return None, f"ASR Start Failed: {start_e}"
 
-            # Send audio data in chunks
-            # audio_data should be bytes (PCM)
-            chunk_size = 640
-            slices = [audio_data[i:i+chunk_size] for i in range(0, len(audio_data), chunk_size)]
-            
-            print(f"DEBUG: Sending {len(slices)} chunks of audio data...")
-            for i, s in enumerate(slices):
-                sr.send_audio(bytes(s))
-                if i % 100 == 0:
-                    print(f"DEBUG: Sent chunk {i}/{len(slices)}")
-                time.sleep(0.001)
-
-            print("DEBUG: Stopping ASR...")
-            sr.stop()
-            print("DEBUG: ASR Stopped. Waiting for completion...")
-            
-            # Wait for completion
-            start_time = time.time()
-            while not self.is_completed and time.time() - start_time < 10:
-                if self.error_msg:
-                    print(f"DEBUG: Error detected: {self.error_msg}")
-                    return f"ASR Error: {self.error_msg}"
-                time.sleep(0.1)
-                if int(time.time() - start_time) % 2 == 0:
-                     print(f"DEBUG: Waiting... {int(time.time() - start_time)}s")
-                
-            if self.error_msg:
-                 return f"ASR Error: {self.error_msg}"
-            
-            if not self.is_completed:
-                print("DEBUG: ASR Timeout")
-                return "ASR Timeout: No response from server."
+        # Send audio data (PCM) in chunks, paced by pcm_sender's token bucket
+        with tracing.span("asr.stream", mode="short"):
+            try:
+                send_pcm(sr.send_audio, audio_data)
+            except Exception:
+                sr.shutdown()
+                raise
+        return sr, None
+
+    def _close(self, sr):
+        # RecognitionCompleted hands the connection back to the pool; any other ending (timeout,
+        # error, exception) must discard it or the pool slot stays leased
+        if not self.is_completed or self.error_msg:
+            sr.shutdown()
+
+    def _result(self, span, completed):
+        if self.error_msg:
+            span.set("error", str(self.error_msg))
+            return f"ASR Error: {self.error_msg}"
+
+        if not completed or not self.is_completed:
+            span.set("error", "timeout")
+            return "ASR Timeout: No response from server."
 
-            print(f"DEBUG: Transcribed text: {self.transcribed_text}")
-            return self.transcribed_text
+        span.set("text_chars", len(self.transcribed_text))
+        return self.transcribed_text
+
+    def transcribe(self, audio_data):
+        sr = None
+        try:
+            sr, error = self._begin(audio_data)
+            if error:
+                return error
+
+            with tracing.span("asr.finalize", mode="short") as span:
+                sr.stop()
+                # Returns the moment a callback signals the end, not on the next poll
+                completed = self.completion.wait()
+                return self._result(span, completed)
         except Exception as e:
             return f"ASR Exception: {e}"
+        finally:
+            if sr is not None:
+                self._close(sr)
+
+    async def atranscribe(self, audio_data):
+        """transcribe() for asyncio code: the SDK's blocking calls run in a worker thread."""
+        sr = None
+        try:
+            sr, error = await asyncio.to_thread(self._begin, audio_data)
+            if error:
+                return error
+
+            with tracing.span("asr.finalize", mode="short") as span:
+                # stop() blocks until the server answers; the loop only awaits the completion
+                stopping = asyncio.ensure_future(asyncio.to_thread(sr.stop))
+                completed = await self.completion.async_wait()
+                await asyncio.wait({stopping})
+                return self._result(span, completed)
+        except Exception as e:
+            return f"ASR Exception: {e}"
+        finally:
+            if sr is not None:
+                self._close(sr)
 
 def recognize_short_speech(audio_bytes):
     """
     Transcribes audio bytes using Aliyun Short Sentence Recognition.
     Expected: PCM 16k 16bit mono.
     """
+    pcm_data = _strip_wav_header(audio_bytes)
+    with tracing.span("asr", mode="short", bytes=len(pcm_data)):
+        asr = AliyunASRShort()
+        return asr.transcribe(pcm_data)
+
+async def arecognize_short_speech(audio_bytes):
+    """Awaitable recognize_short_speech()."""
+    pcm_data = _strip_wav_header(audio_bytes)
+    with tracing.span("asr", mode="short", bytes=len(pcm_data)):
+        asr = AliyunASRShort()
+        return await asr.atranscribe(pcm_data)
+
+def _strip_wav_header(audio_bytes):
     # Simple check for WAV header (RIFF)
     if audio_bytes.startswith(b'RIFF'):
         # Strip 44 bytes header
-        pcm_data = audio_bytes[44:]
-    else:
-        pcm_data = audio_bytes
-        
-    asr = AliyunASRShort()
-    return asr.transcribe(pcm_data)
+        return memoryview(audio_bytes)[44:]
+    return audio_bytes
@@ -0,0 +1,247 @@
+"""
+Headless API for app_router, for front ends other than the Streamlit page (kiosks, phone apps).
+
+    python api_server.py --port 8000
+    curl -N localhost:8000/v1/turn/stream -H 'Content-Type: application/json' \\
+         -d '{"user_name": "张伯伯", "text": "我昨天梦见老家的院子了"}'
+
+Endpoints (thread_id is "Router:{user_name}", the same memory as main.py and web_app.py):
+    POST /v1/turn           {"user_name", "text", "submission_id"?} -> {"agent", "content", "thought", "analysis"}
+    POST /v1/turn/stream    same body, Server-Sent Events: router / token / final, then done
+    WS   /v1/ws?user_name=  send {"text", "submission_id"?} per turn, receive the same events as JSON
+    WS   /v1/asr?partial=0  live speech recognition while the talk button is held: binary
+                            PCM frames (16k 16bit mono) in, {"type": "final", "text"} out
+                            after {"type": "stop"} is sent on release; partial=1 also
+                            streams {"type": "partial", "text"} while speaking
+    GET  /healthz           liveness and current load
+
+Runs on the async graphs (graph.open_async_apps), one event loop for all connections.
+At most API_MAX_TURNS turns run at once; a turn that cannot start within
+API_QUEUE_TIMEOUT seconds is answered with 503 (an "error" event on streams).
+Turns of one elder run one after another in arrival order.
+A turn may carry a "submission_id" chosen by the client once per submission; a resend with
+the same id (a retry after a dropped connection) joins the turn in flight or gets its result
+instead of running it again (see idempotency.py). Without one, the same text sent again
+while it runs or within IDEMPOTENCY_TEXT_WINDOW seconds is treated as the same submission.
+"""
+import os
+import json
+import asyncio
+import argparse
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from langchain_core.messages import HumanMessage
+from dotenv import load_dotenv
+from graph import open_async_apps
+from streaming import astream_turn
+from compaction import amaybe_compact
+import idempotency
+import metrics
+import tracing
+
+load_dotenv()
+
+API_MAX_TURNS = int(os.getenv("API_MAX_TURNS", "32"))
+API_QUEUE_TIMEOUT = float(os.getenv("API_QUEUE_TIMEOUT", "5"))
+API_KEEPALIVE = int(os.getenv("API_KEEPALIVE", "30"))
+
+class TurnRequest(BaseModel):
+    user_name: str
+    text: str
+    submission_id: str = ""
+
+class Busy(Exception):
+    pass
+
+class TurnGate:
+    """Global concurrency limit plus one lock per elder, so an elder's turns never interleave."""
+    def __init__(self, limit=API_MAX_TURNS, timeout=API_QUEUE_TIMEOUT):
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(limit)
+        self._locks = {}
+        self._users = {}
+        self.running = 0
+
+    @asynccontextmanager
+    async def turn(self, thread_id):
+        lock = self._locks.setdefault(thread_id, asyncio.Lock())
+        self._users[thread_id] = self._users.get(thread_id, 0) + 1
+        try:
+            try:
+                await asyncio.wait_for(self._acquire(lock), self.timeout)
+            except asyncio.TimeoutError:
+                metrics.incr("api.rejected")
+                raise Busy(f"{self.running} turns running")
+            self.running += 1
+            try:
+                yield
+            finally:
+                self.running -= 1
+                self._slots.release()
+                lock.release()
+        finally:
+            self._users[thread_id] -= 1
+            if not self._users[thread_id]:
+                # Nobody else waits on this elder, drop the lock
+                del self._users[thread_id]
+                del self._locks[thread_id]
+
+    async def _acquire(self, lock):
+        await lock.acquire()
+        try:
+            await self._slots.acquire()
+        except BaseException:
+            lock.release()
+            raise
+
+@asynccontextmanager
+async def lifespan(app):
+    async with open_async_apps() as apps:
+        app.state.router = apps["router"]
+        app.state.gate = TurnGate()
+        yield
+
+app = FastAPI(title="Elderly care agents", lifespan=lifespan)
+
+def thread_id_for(user_name):
+    return f"Router:{user_name}"
+
+async def run_turn(user_name, text, submission_id=""):
+    """Yields the UI events of one turn (see streaming.stream_turn); duplicates share one execution."""
+    thread_id = thread_id_for(user_name)
+    async for event in idempotency.astream(thread_id, text, lambda: _execute_turn(thread_id, text), submission_id):
+        yield event
+
+async def _execute_turn(thread_id, text):
+    """Runs the turn under the turn gate."""
+    router = app.state.router
+    config = {"configurable": {"thread_id": thread_id}}
+    inputs = {"messages": [HumanMessage(content=text)]}
+    async with app.state.gate.turn(thread_id):
+        with tracing.span("turn", thread_id=thread_id, input_chars=len(text), source="api"):
+            metrics.incr("api.turns")
+            async for event in astream_turn(router, inputs, config):
+                yield event
+        await amaybe_compact(router, config)
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok", "running": app.state.gate.running, "max_turns": API_MAX_TURNS}
+
+@app.post("/v1/turn")
+async def turn(request: TurnRequest):
+    result = {"agent": None, "content": "", "thought": None, "analysis": None}
+    try:
+        async for event in run_turn(request.user_name, request.text, request.submission_id):
+            if event["type"] == "router":
+                result["analysis"] = event["analysis"]
+            elif event["type"] == "final":
+                result.update(agent=event["agent"], content=event["content"], thought=event["thought"])
+    except Busy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    return result
+
+def sse(event_type, data):
+    return f"event: {event_type}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/v1/turn/stream")
+async def turn_stream(request: TurnRequest):
+    async def events():
+        try:
+            async for event in run_turn(request.user_name, request.text, request.submission_id):
+                yield sse(event["type"], event)
+            yield sse("done", {})
+        except Busy as e:
+            yield sse("error", {"status": 503, "detail": str(e)})
+        except Exception as e:
+            print(f"API turn error: {e}")
+            yield sse("error", {"status": 500, "detail": str(e)})
+
+    # X-Accel-Buffering: proxies (nginx) must pass tokens through as they come
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.websocket("/v1/ws")
+async def turn_ws(websocket: WebSocket, user_name: str):
+    await websocket.accept()
+    try:
+        while True:
+            message = await websocket.receive_json()
+            text = str(message.get("text") or "").strip()
+            if not text:
+                continue
+            try:
+                async for event in run_turn(user_name, text, str(message.get("submission_id") or "")):
+                    await websocket.send_json(event)
+                await websocket.send_json({"type": "done"})
+            except Busy as e:
+                await websocket.send_json({"type": "error", "status": 503, "detail": str(e)})
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                # As on the SSE stream: report the failed turn and keep serving the socket
+                print(f"API turn error: {e}")
+                await websocket.send_json({"type": "error", "status": 500, "detail": str(e)})
+    except WebSocketDisconnect:
+        pass
+
+@app.websocket("/v1/asr")
+async def asr_ws(websocket: WebSocket, partial: bool = False):
+    """One recording per connection, opened when the talk button goes down."""
+    # Imported here: text-only deployments don't need the NLS SDK
+    from aliyun_asr import LiveTranscription
+    await websocket.accept()
+    loop = asyncio.get_running_loop()
+
+    def on_partial(text):
+        # Called on the NLS SDK thread
+        asyncio.run_coroutine_threadsafe(_send_partial(websocket, text), loop)
+
+    with tracing.span("asr", mode="live"):
+        session = LiveTranscription(on_partial=on_partial if partial else None)
+        # The connection to NLS is set up while the elder starts speaking; frames wait
+        # in the socket meanwhile
+        error = await asyncio.to_thread(session.start)
+        if error:
+            await websocket.send_json({"type": "final", "text": error, "error": True})
+            await websocket.close()
+            return
+        try:
+            with tracing.span("asr.stream", mode="live"):
+                while True:
+                    message = await websocket.receive()
+                    if message["type"] == "websocket.disconnect":
+                        raise WebSocketDisconnect(message.get("code", 1000))
+                    if message.get("bytes"):
+                        await asyncio.to_thread(session.feed, message["bytes"])
+                    elif message.get("text") and json.loads(message["text"]).get("type") == "stop":
+                        break
+            text = await asyncio.to_thread(session.finish)
+            metrics.incr("api.asr")
+            await websocket.send_json({"type": "final", "text": text})
+            await websocket.close()
+        except WebSocketDisconnect:
+            # Released without waiting for the text (page closed, recording discarded)
+            session.cancel()
+        except BaseException:
+            session.cancel()
+            raise
+
+async def _send_partial(websocket, text):
+    try:
+        await websocket.send_json({"type": "partial", "text": text})
+    except Exception:
+        pass
+
+def main():
+    import uvicorn
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port, timeout_keep_alive=API_KEEPALIVE)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import os
+import asyncio
+from concurrent.futures import Future, InvalidStateError
+from concurrent.futures import TimeoutError as FutureTimeout
+
+# Seconds to wait for the server's final result after the audio is sent
+ASR_TIMEOUT = float(os.getenv("ASR_TIMEOUT", "10"))
+
+class Completion:
+    """
+    One-shot "the ASR task is over" signal, set from the NLS SDK's callback thread
+    (on_completed, on_error, on_close). Waiters wake up as soon as it is set: wait() from
+    a thread, await async_wait() from an event loop. Both return False on timeout.
+    """
+    def __init__(self):
+        self._future = Future()
+
+    def set(self):
+        try:
+            self._future.set_result(None)
+        except InvalidStateError:
+            # Already set, e.g. on_close after on_completed
+            pass
+
+    def is_set(self):
+        return self._future.done()
+
+    def wait(self, timeout=ASR_TIMEOUT):
+        try:
+            self._future.result(timeout)
+            return True
+        except FutureTimeout:
+            return False
+
+    async def async_wait(self, timeout=ASR_TIMEOUT):
+        try:
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(self._future)), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
@@ -0,0 +1,33 @@
+import os
+import threading
+import nls
+
+# Warm NLS websocket connections shared by all ASR requests of the process (nls.pool).
+# A voice turn leases an open, authenticated connection instead of doing its own
+# TCP + TLS + websocket handshake, and at most ASR_POOL_SIZE connections (and reader
+# threads) exist however many elders talk at once.
+# Off by default (ASR_POOL_SIZE=0 connects per request, as before): reuse of a connection
+# for a second task and the gateway's idle timeout are not yet verified against the real
+# NLS service. Try ASR_POOL_SIZE=4 in staging first.
+ASR_POOL_SIZE = int(os.getenv("ASR_POOL_SIZE", "0"))
+ASR_POOL_MIN_IDLE = int(os.getenv("ASR_POOL_MIN_IDLE", "1"))
+ASR_POOL_MAX_IDLE_SECONDS = float(os.getenv("ASR_POOL_MAX_IDLE_SECONDS", "60"))
+
+_pools = {}
+_lock = threading.Lock()
+
+def get_pool(url, token):
+    """The process-wide pool for (url, token), or None if pooling is off."""
+    if ASR_POOL_SIZE <= 0 or not token:
+        return None
+    with _lock:
+        if (url, token) not in _pools:
+            _pools[(url, token)] = nls.NlsConnectionPool(
+                url=url, token=token, max_size=ASR_POOL_SIZE,
+                min_idle=min(ASR_POOL_MIN_IDLE, ASR_POOL_SIZE),
+                max_idle_time=ASR_POOL_MAX_IDLE_SECONDS)
+        return _pools[(url, token)]
+
+def stats():
+    with _lock:
+        return {f"{url}": pool.stats() for (url, _), pool in _pools.items()}
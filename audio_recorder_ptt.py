@@ -2,7 +2,13 @@ import streamlit as st
 from bokeh.models import Div
 from streamlit_bokeh_events import streamlit_bokeh_events
 import base64
+import json
 import uuid
+from collections import namedtuple
+
+# Result of a recording streamed to the live ASR endpoint: recognized during capture,
+# so no audio comes back to Python. recording_id tells two identical sentences apart.
+Transcript = namedtuple("Transcript", ["recording_id", "text"])
 
 def audio_recorder_ptt(
     text="",
@@ -10,13 +16,18 @@ def audio_recorder_ptt(
     neutral_color="#07C160",
     icon_name="microphone",
     icon_size="2x",
-    key="ptt_recorder_component_v5"
+    key="ptt_recorder_component_v5",
+    stream_url=None
 ):
     """
     WeChat-style Hold-to-Talk audio recorder component.
     Supports both Mouse Click/Hold and Spacebar.
+    stream_url: WebSocket URL of the live ASR endpoint (api_server.py /v1/asr). If set, PCM
+        is streamed there while the button is held and only the text comes back; if the
+        socket fails the recording falls back to the WAV upload.
     Returns:
-        bytes: Audio data in WAV format (16k 16bit mono).
+        bytes: Audio data in WAV format (16k 16bit mono), or
+        Transcript: when recognized through stream_url.
     """
     
     # Use fixed IDs to avoid re-mounting issues, but allow multiple instances if needed
@@ -65,6 +76,48 @@ def audio_recorder_ptt(
             let audioBuffers = [];
             let isRecording = false;
             let stream = null;
+            const streamUrl = {json.dumps(stream_url)};
+            let socket = null;
+            let socketFailed = false;
+            let srcPos = 0;
+            const targetRate = 16000;
+            
+            // Nearest-sample downsampling of one captured block to 16k Int16,
+            // carrying the fractional position over to the next block
+            function toPCM16(input, sampleRate) {{
+                const step = sampleRate / targetRate;
+                const out = new Int16Array(Math.max(0, Math.ceil((input.length - srcPos) / step)));
+                let n = 0;
+                for (; srcPos < input.length && n < out.length; srcPos += step) {{
+                    const s = Math.max(-1, Math.min(1, input[Math.floor(srcPos)]));
+                    out[n++] = s < 0 ? s * 0x8000 : s * 0x7FFF;
+                }}
+                srcPos -= input.length;
+                return out.slice(0, n);
+            }}
+            
+            function dispatchAudio(detail) {{
+                document.dispatchEvent(new CustomEvent("GET_AUDIO", {{detail: detail}}));
+            }}
+            
+            function openSocket() {{
+                socketFailed = false;
+                const ws = new WebSocket(streamUrl);
+                ws.binaryType = "arraybuffer";
+                ws.pending = [];
+                ws.onopen = () => {{
+                    ws.pending.forEach(chunk => ws.send(chunk));
+                    ws.pending = [];
+                }};
+                ws.onerror = () => {{ socketFailed = true; }};
+                return ws;
+            }}
+            
+            function sendChunk(chunk) {{
+                if (!socket || socketFailed) return;
+                if (socket.readyState === WebSocket.OPEN) socket.send(chunk);
+                else if (socket.readyState === WebSocket.CONNECTING) socket.pending.push(chunk);
+            }}
             
             // Helper function to encode WAV
             function encodeWAV(samples, sampleRate) {{
@@ -111,6 +164,9 @@ def audio_recorder_ptt(
                         
                         isRecording = true;
                         audioBuffers = [];
+                        srcPos = 0;
+                        // Connect at press time, the handshake overlaps the first words
+                        if (streamUrl) socket = openSocket();
                         
                         audioContext = new (window.AudioContext || window.webkitAudioContext)();
                         mediaStreamSource = audioContext.createMediaStreamSource(stream);
@@ -122,6 +178,7 @@ def audio_recorder_ptt(
                             const input = event.inputBuffer.getChannelData(0);
                             // Clone data because input buffer is reused
                             audioBuffers.push(new Float32Array(input));
+                            if (socket) sendChunk(toPCM16(input, audioContext.sampleRate).buffer);
                         }};
                         
                         mediaStreamSource.connect(scriptProcessor);
@@ -142,6 +199,7 @@ def audio_recorder_ptt(
                         if (mediaStreamSource) mediaStreamSource.disconnect();
                         if (scriptProcessor) scriptProcessor.disconnect();
                         if (audioContext) audioContext.close();
+                        const sampleRate = audioContext ? audioContext.sampleRate : 44100;
                         
                         btn.innerText = "🎤";
                         btn.style.backgroundColor = "{neutral_color}";
@@ -151,9 +209,44 @@ def audio_recorder_ptt(
                         // Process Audio
                         if (audioBuffers.length === 0) {{
                             // status.innerText = "❌";
+                            if (socket) socket.close();
+                            socket = null;
                             return;
                         }}
                         
+                        if (socket && !socketFailed) {{
+                            // Recognition already ran during capture, only the text is left
+                            const ws = socket;
+                            const buffers = audioBuffers;
+                            const recordingId = Date.now() + "-" + Math.random().toString(36).slice(2);
+                            let done = false;
+                            const fallback = () => {{
+                                if (done) return;
+                                done = true;
+                                ws.close();
+                                uploadWAV(buffers, sampleRate);
+                            }};
+                            ws.onmessage = (e) => {{
+                                const msg = JSON.parse(e.data);
+                                if (msg.type !== "final" || done) return;
+                                done = true;
+                                if (msg.error) {{ uploadWAV(buffers, sampleRate); return; }}
+                                dispatchAudio({{transcript: msg.text, recording_id: recordingId}});
+                            }};
+                            ws.onerror = fallback;
+                            ws.onclose = fallback;
+                            setTimeout(fallback, 10000);
+                            if (ws.readyState === WebSocket.OPEN) ws.send(JSON.stringify({{type: "stop"}}));
+                            else ws.addEventListener("open", () => ws.send(JSON.stringify({{type: "stop"}})));
+                            socket = null;
+                            return;
+                        }}
+                        if (socket) socket.close();
+                        socket = null;
+                        uploadWAV(audioBuffers, sampleRate);
+                    }};
+                    
+                    const uploadWAV = (audioBuffers, originalRate) => {{
                         // Flatten
                         let totalLength = audioBuffers.reduce((acc, val) => acc + val.length, 0);
                         let rawData = new Float32Array(totalLength);
@@ -164,8 +257,6 @@ def audio_recorder_ptt(
                         }}
                         
                         // Downsample to 16000Hz
-                        const targetRate = 16000;
-                        const originalRate = audioContext ? audioContext.sampleRate : 44100; // Default or captured
                         const compression = originalRate / targetRate;
                         const length = Math.floor(rawData.length / compression);
                         const result = new Int16Array(length);
@@ -184,7 +275,7 @@ def audio_recorder_ptt(
                         reader.readAsDataURL(blob);
                         reader.onloadend = () => {{
                             const base64data = reader.result;
-                            document.dispatchEvent(new CustomEvent("GET_AUDIO", {{detail: {{audio_data: base64data}}}}));
+                            dispatchAudio({{audio_data: base64data}});
                         }};
                         
                         // setTimeout(() => status.innerText = "✅", 1500);
@@ -249,6 +340,8 @@ def audio_recorder_ptt(
     
     if result and "GET_AUDIO" in result:
         data = result.get("GET_AUDIO")
+        if data and "transcript" in data:
+            return Transcript(data.get("recording_id"), data["transcript"])
         if data and "audio_data" in data:
             b64_str = data["audio_data"]
             if "," in b64_str:
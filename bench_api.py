@@ -0,0 +1,117 @@
+"""
+Load test of api_server.py: N concurrent users, each streaming its turns over SSE on one
+keep-alive connection. By default the API server and fake_llm_server.py run in this
+process, so the numbers are the backend's own overhead at a fixed model speed.
+
+    python bench_api.py --users 1 8 32 --turns 5
+    python bench_api.py --url http://kiosk-backend:8000 --users 16   # an already running server
+
+Reports turns/s, turn latency p50/p95/p99, first-token p50/p95 and rejected (503) turns.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import httpx
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_local_server(ttft_ms, tokens_per_sec):
+    """Fake LLM + api_server on background threads; returns the API base URL."""
+    from fake_llm_server import start_server
+    _, base_url = start_server(ttft_ms=ttft_ms, tokens_per_sec=tokens_per_sec)
+    workdir = tempfile.mkdtemp(prefix="bench_api_")
+    # Everything below reads its configuration at import time
+    os.environ["OPENAI_API_BASE"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    os.environ["CHECKPOINT_DB"] = os.path.join(workdir, "memories.db")
+    os.environ["RETRIEVAL_DIR"] = os.path.join(workdir, "retrieval_index")
+    os.environ["TRACE_FILE"] = os.path.join(workdir, "traces.jsonl")
+
+    import uvicorn
+    import api_server
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(api_server.app, host="127.0.0.1", port=port, log_level="warning",
+                                           timeout_keep_alive=api_server.API_KEEPALIVE))
+    threading.Thread(target=server.run, daemon=True, name="api-server").start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+async def one_turn(client, url, user_name, text):
+    """Returns (seconds, first_token_seconds or None, status)."""
+    start = time.perf_counter()
+    first = None
+    status = "ok"
+    async with client.stream("POST", f"{url}/v1/turn/stream", json={"user_name": user_name, "text": text}) as response:
+        if response.status_code != 200:
+            return time.perf_counter() - start, None, str(response.status_code)
+        event_type = None
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                event_type = line[7:]
+            elif line.startswith("data: "):
+                if event_type in ["token", "final"] and first is None:
+                    first = time.perf_counter() - start
+                elif event_type == "error":
+                    status = str(json.loads(line[6:]).get("status"))
+    return time.perf_counter() - start, first, status
+
+async def run(url, users, turns, utterances, run_id):
+    results = []
+    limits = httpx.Limits(max_connections=users, max_keepalive_connections=users)
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        async def user(idx):
+            for turn in range(turns):
+                text = utterances[(idx * 7 + turn) % len(utterances)]
+                results.append(await one_turn(client, url, f"bench_{run_id}_{users}_{idx}", text))
+        start = time.perf_counter()
+        await asyncio.gather(*(user(i) for i in range(users)))
+        elapsed = time.perf_counter() - start
+    return elapsed, results
+
+def fmt(value):
+    return "-" if value is None else f"{value:.2f}"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="benchmark this server instead of starting one locally")
+    parser.add_argument("--users", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--turns", type=int, default=5, help="turns per simulated user")
+    parser.add_argument("--ttft-ms", type=float, default=200, help="fake LLM first-token delay (local server only)")
+    parser.add_argument("--tokens-per-sec", type=float, default=80, help="fake LLM token rate (local server only)")
+    args = parser.parse_args()
+
+    url = args.url.rstrip("/") if args.url else start_local_server(args.ttft_ms, args.tokens_per_sec)
+    from bench_router_prompt import TRANSCRIPTS
+    utterances = [text for text, _ in TRANSCRIPTS]
+
+    print(f"{url}: {args.turns} turns per user")
+    print(f"{'users':>5} {'turns':>6} {'turns/s':>8} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} "
+          f"{'1st p50':>8} {'1st p95':>8} {'errors':>7}")
+    for run_id, users in enumerate(args.users):
+        elapsed, results = asyncio.run(run(url, users, args.turns, utterances, run_id))
+        ok = [r for r in results if r[2] == "ok"]
+        latencies = [r[0] for r in ok]
+        firsts = [r[1] for r in ok if r[1] is not None]
+        print(f"{users:>5} {len(results):>6} {len(ok) / elapsed:>8.2f} "
+              f"{fmt(percentile(latencies, 50)):>7} {fmt(percentile(latencies, 95)):>7} {fmt(percentile(latencies, 99)):>7} "
+              f"{fmt(percentile(firsts, 50)):>8} {fmt(percentile(firsts, 95)):>8} {len(results) - len(ok):>7}")
+        sys.stdout.flush()
+
+if __name__ == "__main__":
+    main()
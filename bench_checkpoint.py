@@ -0,0 +1,87 @@
+"""
+Checkpoint write throughput under N concurrent threads.
+
+Every thread plays one elder (its own thread_id) and writes checkpoints whose
+message list grows like a real conversation, followed by a read of the latest state,
+which is what one graph turn does against the checkpointer.
+
+    python bench_checkpoint.py --backends sqlite sqlite_pool --threads 1 4 16 --writes 200
+    CHECKPOINT_POSTGRES_URL=postgresql://... python bench_checkpoint.py --backends postgres
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+from langchain_core.messages import HumanMessage, AIMessage
+from langgraph.checkpoint.base import empty_checkpoint
+from checkpointer import create_checkpointer
+
+def make_messages(turns):
+    messages = []
+    for i in range(turns):
+        messages.append(HumanMessage(content=f"我今天又想起了老家的院子，第{i}次和你说。"))
+        messages.append(AIMessage(content="<inner_thought>情绪平稳，适合继续回忆。</inner_thought>您说的院子里是不是种着一棵大槐树？" * 2))
+    return messages
+
+def write_turn(saver, thread_id, step, messages):
+    config = {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}
+    checkpoint = empty_checkpoint()
+    checkpoint["channel_values"] = {"messages": messages, "next": "wan_qing"}
+    versions = {"messages": saver.get_next_version(None, None), "next": saver.get_next_version(None, None)}
+    checkpoint["channel_versions"] = versions
+    saver.put(config, checkpoint, {"source": "loop", "step": step}, versions)
+    saver.get_tuple(config)
+
+def run(backend, threads, writes, history_turns):
+    tmpdir = tempfile.mkdtemp(prefix="bench_ckpt_")
+    saver = create_checkpointer(backend, path=os.path.join(tmpdir, "bench.db"))
+    messages = make_messages(history_turns)
+    errors = []
+
+    def worker(idx):
+        try:
+            for step in range(writes):
+                write_turn(saver, f"Router:bench_{backend}_{threads}_{idx}", step, messages)
+        except Exception as e:
+            errors.append(e)
+
+    # Warm up table creation outside the timed section
+    write_turn(saver, "Router:warmup", 0, messages)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    total = threads * writes
+    return {
+        "backend": backend,
+        "threads": threads,
+        "writes": total,
+        "seconds": elapsed,
+        "writes_per_sec": total / elapsed if elapsed else 0,
+        "errors": len(errors)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=["sqlite", "sqlite_pool"])
+    parser.add_argument("--threads", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument("--writes", type=int, default=100, help="checkpoint writes per thread")
+    parser.add_argument("--history-turns", type=int, default=10, help="conversation turns stored in each checkpoint")
+    args = parser.parse_args()
+
+    print(f"{'backend':<12} {'threads':>7} {'writes':>7} {'seconds':>8} {'writes/s':>9} {'errors':>6}")
+    for backend in args.backends:
+        for threads in args.threads:
+            r = run(backend, threads, args.writes, args.history_turns)
+            print(f"{r['backend']:<12} {r['threads']:>7} {r['writes']:>7} {r['seconds']:>8.2f} {r['writes_per_sec']:>9.1f} {r['errors']:>6}")
+            sys.stdout.flush()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+End-to-end benchmark of app_router against a local fake LLM (fake_llm_server.py).
+
+N threads each play one elder (own thread_id) and send scripted utterances turn by
+turn through the full graph: router, agent, checkpoints, history cleaning, memory.
+Nothing leaves the machine, so graph regressions show up offline.
+
+    python bench_e2e.py --threads 1 4 16 --turns 20
+    python bench_e2e.py --ttft-ms 50 --tokens-per-sec 200 --stream
+    python bench_e2e.py --corpus requests.jsonl    # JSONL ("body"/"text"/"content") or plain lines
+
+Reports turn latency p50/p95/p99, router and agent time, checkpoint time per turn,
+clean_history time and throughput.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+def load_corpus(path):
+    utterances = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                entry = json.loads(line)
+                text = entry.get("body") or entry.get("text") or entry.get("content") or ""
+                # Long documents make poor utterances; keep the first sentence or so
+                line = text.strip().split("\n")[0][:200]
+            if line:
+                utterances.append(line)
+    return utterances
+
+def run(app, utterances, threads, turns, stream, run_id, metrics):
+    from langchain_core.messages import HumanMessage
+    from streaming import stream_turn
+    import tracing
+
+    def user(idx):
+        config = {"configurable": {"thread_id": f"Router:bench_{run_id}_{threads}_{idx}"}}
+        for turn in range(turns):
+            text = utterances[(idx * 7 + turn) % len(utterances)]
+            inputs = {"messages": [HumanMessage(content=text)]}
+            start = time.perf_counter()
+            with tracing.span("turn", thread_id=config["configurable"]["thread_id"]):
+                if stream:
+                    first = None
+                    for event in stream_turn(app, inputs, config):
+                        if first is None and event["type"] == "token":
+                            first = time.perf_counter() - start
+                    if first is not None:
+                        metrics.observe("turn.first_token.seconds", first)
+                else:
+                    app.invoke(inputs, config)
+
+    metrics.reset()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for future in [pool.submit(user, i) for i in range(threads)]:
+            future.result()
+    elapsed = time.perf_counter() - start
+    return elapsed, metrics.timers_snapshot()
+
+def fmt(stats, key, scale=1.0, digits=2):
+    if not stats or stats.get(key) is None:
+        return "-"
+    return f"{stats[key] * scale:.{digits}f}"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument("--turns", type=int, default=10, help="turns per simulated elder")
+    parser.add_argument("--ttft-ms", type=float, default=200)
+    parser.add_argument("--tokens-per-sec", type=float, default=80)
+    parser.add_argument("--replay", help="recorded replies for the fake server (see fake_llm_server.py)")
+    parser.add_argument("--corpus", help="utterances to send instead of the built-in transcript set")
+    parser.add_argument("--stream", action="store_true", help="stream turns like the web UI (adds first-token latency)")
+    args = parser.parse_args()
+
+    from fake_llm_server import start_server
+    server, base_url = start_server(ttft_ms=args.ttft_ms, tokens_per_sec=args.tokens_per_sec, replay=args.replay)
+
+    # Everything below reads its configuration at import time
+    workdir = tempfile.mkdtemp(prefix="bench_e2e_")
+    os.environ["OPENAI_API_BASE"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    os.environ["CHECKPOINT_DB"] = os.path.join(workdir, "memories.db")
+    os.environ["RETRIEVAL_DIR"] = os.path.join(workdir, "retrieval_index")
+    os.environ["TRACE_FILE"] = os.path.join(workdir, "traces.jsonl")
+
+    import metrics
+    from graph import app_router
+    from bench_router_prompt import TRANSCRIPTS
+    utterances = load_corpus(args.corpus) if args.corpus else [text for text, _ in TRANSCRIPTS]
+
+    print(f"fake LLM: ttft {args.ttft_ms:.0f} ms, {args.tokens_per_sec:.0f} tok/s; "
+          f"{len(utterances)} utterances, {args.turns} turns per elder")
+    print(f"{'threads':>7} {'turns':>6} {'turns/s':>8} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} "
+          f"{'router p50':>10} {'agent p50':>9} {'ckpt ms/turn':>12} {'clean p50 us':>12} {'clean p99 us':>12}"
+          + (f" {'1st tok p50':>11}" if args.stream else ""))
+    for run_id, threads in enumerate(args.threads):
+        elapsed, timers = run(app_router, utterances, threads, args.turns, args.stream, run_id, metrics)
+        turns = threads * args.turns
+        checkpoint_total = sum(
+            (timers.get(f"checkpoint.{name}.seconds") or {"mean": 0, "count": 0})["mean"]
+            * (timers.get(f"checkpoint.{name}.seconds") or {"count": 0})["count"]
+            for name in ["read", "write"]
+        )
+        turn = timers.get("turn.seconds")
+        clean = timers.get("clean_history.seconds")
+        print(f"{threads:>7} {turns:>6} {turns / elapsed:>8.2f} {fmt(turn, 'p50'):>7} {fmt(turn, 'p95'):>7} {fmt(turn, 'p99'):>7} "
+              f"{fmt(timers.get('router.seconds'), 'p50'):>10} {fmt(timers.get('agent.seconds'), 'p50'):>9} "
+              f"{checkpoint_total / turns * 1000:>12.2f} {fmt(clean, 'p50', 1e6, 1):>12} {fmt(clean, 'p99', 1e6, 1):>12}"
+              + (f" {fmt(timers.get('turn.first_token.seconds'), 'p50'):>11}" if args.stream else ""))
+        sys.stdout.flush()
+    print(f"spans: {os.environ['TRACE_FILE']}")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Compact vs full router prompt on a fixed transcript set.
+
+Every utterance is routed once per prompt against the configured endpoint
+(OPENAI_API_BASE / MODEL_NAME / ROUTER_OUTPUT_MODE from .env). The report has
+prompt and output tokens (as reported by the API), latency, agreement with the
+full prompt and with the expected agent. The "tiered" column is what
+ROUTER_PROMPT=tiered does: compact, then the full prompt for ambiguous turns.
+The local keyword tier (intent_classifier) is checked against the labels first,
+without API calls: a confident local decision never reaches the LLM router.
+
+    python bench_router_prompt.py                 # compact, full, tiered
+    python bench_router_prompt.py --repeat 3
+    python bench_router_prompt.py --sizes-only    # prompt sizes and local tier, no API calls
+"""
+import time
+import argparse
+import statistics
+from langchain_core.messages import HumanMessage
+import nodes
+import prompt_cache
+import intent_classifier
+
+# (utterance, expected agent), following the examples and rules of ROUTER_SYSTEM_PROMPT
+TRANSCRIPTS = [
+    ("我要回家，我妈还在等我做饭呢！你们凭什么关着我！", "wan_qing"),
+    ("这是哪里啊？你是谁？我怎么在这儿？", "wan_qing"),
+    ("他们要害我，晚上总有人在门口看我。", "wan_qing"),
+    ("我钥匙呢？我钥匙呢？刚才还在的，谁拿走了！", "wan_qing"),
+    ("我要回家，我在这里没用，没人要我。", "wan_qing"),
+    ("我最近腰疼，是不是得了什么大病？怎么办怎么办？", "wan_qing"),
+    ("唉，一个人在家真没意思，孩子都忙，也没人陪我说说话。", "xin_jing"),
+    ("今天天气不好，在家也没什么意思，一个人发呆。", "xin_jing"),
+    ("我昨天梦见我们老家的院子了，槐花开得可好了。", "xin_jing"),
+    ("如果能回到二十岁，我想去海边看看。", "xin_jing"),
+    ("跟你说件事，我年轻的时候在纺织厂，那时候可热闹了。", "xin_jing"),
+    ("嗯。", "xin_jing"),
+    ("我最近腰有点疼，早上起来特别明显，晚上躺下就好一些。", "xin_jing"),
+    ("一个人在家，没人跟我说话，闷得慌。", "xin_jing"),
+    ("我老了，不中用了，活着就是给孩子添累赘。", "xing_zhe"),
+    ("我年轻时候可厉害了，现在老了不中用了，说这些也没人爱听。", "xing_zhe"),
+    ("退休以后我就什么都不是了，孩子也不需要我。", "xing_zhe"),
+    ("没人需要我了。", "xing_zhe"),
+    ("我这把老骨头不中用了，没人要我了。", "xing_zhe"),
+    ("血压一直降不下来，您说我该怎么办？", "xing_zhe"),
+    ("活着有什么意思，还不如死了算了。", "xing_zhe"),
+    ("你说我这把年纪还能做点什么有用的事吗？", "xing_zhe"),
+    ("冬天吃什么好？我想给自己调理调理身体。", "xing_zhe"),
+]
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+def route_once(variant, messages):
+    """Route one turn with a fixed prompt variant; returns (target, calls made)."""
+    clean_msgs = nodes.clean_history(messages)
+    if variant == "compact":
+        decision = nodes.route_with("router_compact", clean_msgs)
+        return (decision[1] if decision else None), 1
+    if variant == "full":
+        decision = nodes.route_with(nodes.full_router_prompt(), clean_msgs)
+        return (decision[1] if decision else None), 1
+    decision = nodes.route_with("router_compact", clean_msgs)
+    if nodes.is_ambiguous(decision, messages):
+        decision = nodes.route_with(nodes.full_router_prompt(), clean_msgs) or decision
+        return (decision[1] if decision else None), 2
+    return (decision[1] if decision else None), 1
+
+def run(variant, repeat):
+    results = []
+    for r in range(repeat):
+        for i, (text, expected) in enumerate(TRANSCRIPTS):
+            messages = [HumanMessage(content=text, id=f"bench-{r}-{i}")]
+            before = len(prompt_cache.recent_usage())
+            start = time.perf_counter()
+            target, calls = route_once(variant, messages)
+            elapsed = time.perf_counter() - start
+            usage = prompt_cache.recent_usage()[before:]
+            results.append({
+                "index": i,
+                "target": target,
+                "expected": expected,
+                "seconds": elapsed,
+                "calls": calls,
+                "prompt_tokens": sum(u["prompt_tokens"] for u in usage),
+                "output_tokens": sum(u["output_tokens"] for u in usage)
+            })
+    return results
+
+def print_sizes():
+    print(f"{'prompt':<20} {'chars':>7}")
+    for name in ["router", "router_structured", "router_compact"]:
+        print(f"{name:<20} {len(prompt_cache.prefix_message(name).content):>7}")
+
+def print_local():
+    """Confident decisions of the local keyword tier against the labels (no API calls)."""
+    confident = misrouted = 0
+    for text, expected in TRANSCRIPTS:
+        guess = intent_classifier.classify([HumanMessage(content=text)])
+        if not guess or not guess["confident"]:
+            continue
+        confident += 1
+        if guess["target"] != expected:
+            misrouted += 1
+            print(f"  local misroute: {text} -> {guess['target']} (expected {expected}, matched {guess['matched']})")
+    print(f"local tier: {confident}/{len(TRANSCRIPTS)} confident, {misrouted} misrouted")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--variants", nargs="+", default=["compact", "full", "tiered"])
+    parser.add_argument("--repeat", type=int, default=1, help="passes over the transcript set")
+    parser.add_argument("--sizes-only", action="store_true", help="only print static prompt sizes")
+    args = parser.parse_args()
+
+    print_sizes()
+    print_local()
+    if args.sizes_only:
+        return
+    print()
+
+    runs = {variant: run(variant, args.repeat) for variant in args.variants}
+    reference = runs.get("full")
+
+    print(f"{'variant':<8} {'prompt tok':>10} {'output tok':>10} {'p50 s':>7} {'p95 s':>7} {'calls':>6} {'vs full':>8} {'vs label':>9}")
+    for variant, results in runs.items():
+        latencies = [r["seconds"] for r in results]
+        agree_full = "-"
+        if reference is not None and variant != "full":
+            same = sum(1 for a, b in zip(results, reference) if a["target"] == b["target"])
+            agree_full = f"{same / len(results):.0%}"
+        correct = sum(1 for r in results if r["target"] == r["expected"])
+        print(f"{variant:<8} "
+              f"{statistics.mean(r['prompt_tokens'] for r in results):>10.0f} "
+              f"{statistics.mean(r['output_tokens'] for r in results):>10.1f} "
+              f"{percentile(latencies, 50):>7.2f} {percentile(latencies, 95):>7.2f} "
+              f"{statistics.mean(r['calls'] for r in results):>6.2f} "
+              f"{agree_full:>8} {correct / len(results):>9.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Checkpoint history compaction for long-lived threads like "Router:张伯伯".
+
+add_messages only ever appends, so without compaction every checkpoint re-serializes the
+whole conversation, including Router SystemMessages and thought blocks that clean_history
+throws away anyway. Compaction rewrites the thread state to what the agents can still see:
+- Router ROUTER_JSON_START SystemMessages are dropped
+- <inner_thought>/<inner_monologue> blocks are stripped from AIMessages
+- everything older than the last COMPACT_KEEP_MESSAGES is rolled into one summary message,
+  or, with LONG_TERM_MEMORY on, folded into the elder's long-term memory record instead
+and then prunes superseded checkpoints of the thread.
+
+    python compaction.py            # compact every thread in the checkpoint DB
+    python compaction.py 张伯伯      # only Router:张伯伯
+"""
+import os
+import sys
+import asyncio
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, RemoveMessage
+from langgraph.graph.message import REMOVE_ALL_MESSAGES
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+from nodes import clean_message, is_memory_summary, MEMORY_SUMMARY_PREFIX, HISTORY_WINDOW, llm
+import long_term_memory
+
+# Compact once a thread holds this many messages...
+COMPACT_TRIGGER = int(os.getenv("COMPACT_TRIGGER", "60"))
+# ...down to the summary plus this many recent messages (at least the clean_history window)
+COMPACT_KEEP_MESSAGES = max(int(os.getenv("COMPACT_KEEP_MESSAGES", "20")), HISTORY_WINDOW)
+COMPACT_SUMMARY_MAX_CHARS = int(os.getenv("COMPACT_SUMMARY_MAX_CHARS", "1500"))
+# Checkpoints kept per thread after pruning
+COMPACT_KEEP_CHECKPOINTS = int(os.getenv("COMPACT_KEEP_CHECKPOINTS", "2"))
+
+def extractive_summary(previous_summary, messages):
+    """
+    Default summarizer: keep what the elder said (the part worth remembering), newest last,
+    trimmed from the oldest end to COMPACT_SUMMARY_MAX_CHARS.
+    """
+    lines = previous_summary.splitlines() if previous_summary else []
+    for msg in messages:
+        if isinstance(msg, HumanMessage):
+            text = str(msg.content).strip().replace("\n", " ")
+            if text:
+                lines.append(f"- 老人说：{text[:80]}")
+    while lines and sum(len(line) + 1 for line in lines) > COMPACT_SUMMARY_MAX_CHARS:
+        lines.pop(0)
+    return "\n".join(lines)
+
+def long_term_summarizer(thread_id):
+    """
+    Summarizer that folds the dropped turns into long_term_memory (see nodes.agent_context)
+    and leaves no summary message in the thread. An extractive summary left by an earlier
+    compaction is folded in once as well.
+    """
+    def summarize(previous_summary, messages):
+        long_term_memory.summarize(llm, thread_id, [(msg.id, msg) for msg in messages if msg.id],
+                                   extra_summary=previous_summary)
+        return ""
+    return summarize
+
+def compact_messages(messages, keep=COMPACT_KEEP_MESSAGES, summarize=extractive_summary):
+    """Return the compacted message list for a thread (summary first, then recent messages)."""
+    previous_summary = ""
+    kept = []
+    for msg in messages:
+        if is_memory_summary(msg):
+            previous_summary = str(msg.content)[len(MEMORY_SUMMARY_PREFIX):].strip()
+            continue
+        cleaned = clean_message(msg)
+        if cleaned is None:
+            continue
+        if isinstance(msg, AIMessage):
+            # Keep the original id so clean_history's cache stays valid
+            cleaned = AIMessage(content=cleaned.content, id=msg.id)
+        kept.append(cleaned)
+
+    older, recent = kept[:-keep], kept[-keep:]
+    summary = summarize(previous_summary, older) if older else previous_summary
+    if summary:
+        recent = [SystemMessage(content=f"{MEMORY_SUMMARY_PREFIX}\n{summary}")] + recent
+    return recent
+
+_STALE_SQL = ("SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = '' "
+              "ORDER BY checkpoint_id DESC LIMIT -1 OFFSET ?")
+
+def _delete_statements(thread_id, stale):
+    for start in range(0, len(stale), 500):
+        batch = stale[start:start + 500]
+        marks = ",".join("?" * len(batch))
+        yield f"DELETE FROM writes WHERE thread_id = ? AND checkpoint_id IN ({marks})", [thread_id] + batch
+        yield f"DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_id IN ({marks})", [thread_id] + batch
+
+def prune_checkpoints(saver, thread_id, keep=COMPACT_KEEP_CHECKPOINTS):
+    """Delete all but the newest `keep` checkpoints (and their pending writes) of a thread."""
+    if isinstance(saver, SqliteSaver):
+        # Checkpoint ids are time-ordered uuid6 strings
+        with saver.cursor() as cur:
+            cur.execute(_STALE_SQL, (thread_id, keep))
+            stale = [row[0] for row in cur.fetchall()]
+            for sql, params in _delete_statements(thread_id, stale):
+                cur.execute(sql, params)
+        return len(stale)
+    try:
+        saver.prune([thread_id], strategy="keep_latest")
+    except NotImplementedError:
+        print(f"Checkpoint pruning not supported by {type(saver).__name__}")
+    return 0
+
+async def aprune_checkpoints(saver, thread_id, keep=COMPACT_KEEP_CHECKPOINTS):
+    if isinstance(saver, AsyncSqliteSaver):
+        async with saver.lock:
+            async with saver.conn.execute(_STALE_SQL, (thread_id, keep)) as cur:
+                stale = [row[0] for row in await cur.fetchall()]
+            for sql, params in _delete_statements(thread_id, stale):
+                await saver.conn.execute(sql, params)
+            await saver.conn.commit()
+        return len(stale)
+    try:
+        await saver.aprune([thread_id], strategy="keep_latest")
+    except (NotImplementedError, AttributeError):
+        print(f"Checkpoint pruning not supported by {type(saver).__name__}")
+    return 0
+
+def _compaction_update(state, thread_id):
+    if long_term_memory.LONG_TERM_MEMORY:
+        compacted = compact_messages(state.values.get("messages", []), summarize=long_term_summarizer(thread_id))
+    else:
+        compacted = compact_messages(state.values.get("messages", []))
+    # Attribute the update to the agent that answered last: its only edge goes to END,
+    # so the update leaves no pending task behind
+    as_node = state.values.get("next") or "wan_qing"
+    return {"messages": [RemoveMessage(id=REMOVE_ALL_MESSAGES)] + compacted}, as_node, len(compacted)
+
+def compact_thread(app, config, force=False):
+    """
+    Compact one thread if it has grown past COMPACT_TRIGGER messages.
+    Must not run while a turn of the same thread is in flight.
+    Returns True if the thread was compacted.
+    """
+    state = app.get_state(config)
+    count = len(state.values.get("messages", []))
+    if not force and count <= COMPACT_TRIGGER:
+        return False
+
+    update, as_node, new_count = _compaction_update(state, config["configurable"]["thread_id"])
+    app.update_state(config, update, as_node=as_node)
+
+    pruned = prune_checkpoints(app.checkpointer, config["configurable"]["thread_id"])
+    print(f"[Compaction] {config['configurable']['thread_id']}: {count} -> {new_count} messages, {pruned} checkpoints pruned")
+    return True
+
+async def acompact_thread(app, config, force=False):
+    """Async variant of compact_thread() for graphs from graph.open_async_apps()."""
+    state = await app.aget_state(config)
+    count = len(state.values.get("messages", []))
+    if not force and count <= COMPACT_TRIGGER:
+        return False
+
+    # The long-term memory summarizer makes a blocking LLM call, keep it off the event loop
+    update, as_node, new_count = await asyncio.to_thread(_compaction_update, state, config["configurable"]["thread_id"])
+    await app.aupdate_state(config, update, as_node=as_node)
+
+    pruned = await aprune_checkpoints(app.checkpointer, config["configurable"]["thread_id"])
+    print(f"[Compaction] {config['configurable']['thread_id']}: {count} -> {new_count} messages, {pruned} checkpoints pruned")
+    return True
+
+def maybe_compact(app, config):
+    try:
+        return compact_thread(app, config)
+    except Exception as e:
+        # Compaction is housekeeping, never fail a turn because of it
+        print(f"Compaction error: {e}")
+        return False
+
+async def amaybe_compact(app, config):
+    try:
+        return await acompact_thread(app, config)
+    except Exception as e:
+        print(f"Compaction error: {e}")
+        return False
+
+def main():
+    from graph import app_router, memory
+    if len(sys.argv) > 1:
+        thread_ids = [f"Router:{sys.argv[1]}"]
+    else:
+        with memory.cursor(transaction=False) as cur:
+            cur.execute("SELECT DISTINCT thread_id FROM checkpoints")
+            thread_ids = [row[0] for row in cur.fetchall()]
+    for thread_id in thread_ids:
+        compact_thread(app_router, {"configurable": {"thread_id": thread_id}}, force=True)
+    if isinstance(memory, SqliteSaver):
+        # Give the freed pages back to the file system
+        memory.conn.execute("VACUUM")
+
+if __name__ == "__main__":
+    main()
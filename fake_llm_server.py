@@ -0,0 +1,214 @@
+"""
+Local stand-in for the OpenAI-compatible chat completions API, for offline benchmarks.
+
+Answers /chat/completions (plain JSON or SSE streaming, tool calls for the structured
+router) with recorded or generated replies, after a configurable time-to-first-token
+and at a configurable token rate. Usage is reported like a provider with an implicit
+prefix cache: a system prompt that was seen before counts as cached prompt tokens.
+
+    python fake_llm_server.py --port 8399 --ttft-ms 300 --tokens-per-sec 40
+    OPENAI_API_BASE=http://127.0.0.1:8399/v1 OPENAI_API_KEY=x python main.py
+
+    --replay recordings.jsonl   one {"kind": "router"|"agent"|"summary", "content": "..."}
+                                per line; replies of a kind are replayed round-robin
+"""
+import json
+import time
+import uuid
+import argparse
+import itertools
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from intent_classifier import classify
+from langchain_core.messages import HumanMessage
+
+AGENT_REPLIES = [
+    "<inner_thought>情绪平稳，先接住他的话，再用一个开放的问题延展。</inner_thought>您说的这些我都记着呢。那时候院子里是不是特别热闹？您最喜欢在哪个角落待着？",
+    "<inner_thought>他在分享往事，适合顺着感官细节往下聊。</inner_thought>听您这么一说，我好像也闻到了槐花的香味。那会儿谁最爱爬树摘槐花呀？",
+    "<inner_thought>有一点低落，需要先认可感受。</inner_thought>一个人待着的时候，心里难免空落落的。我在这儿陪着您，您想从哪儿说起都行。",
+]
+SUMMARY_REPLY = "- 称呼：张伯伯\n- 老家院子里有槐树，喜欢回忆年轻时的事\n- 独居，孩子工作忙"
+AGENT_NAMES = {"wan_qing": "晚晴", "xin_jing": "心镜", "xing_zhe": "行者"}
+
+def estimate_tokens(text):
+    # Roughly 1.5 characters per token for mixed Chinese text
+    return max(1, int(len(text) / 1.5))
+
+def split_tokens(text, size=2):
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+class ReplayBook:
+    """Round-robin replies per kind, from --replay recordings or the built-in defaults."""
+    def __init__(self, path=None):
+        recorded = {}
+        if path:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        recorded.setdefault(entry["kind"], []).append(entry["content"])
+        self._cycles = {kind: itertools.cycle(replies) for kind, replies in recorded.items()}
+        self._lock = threading.Lock()
+
+    def next(self, kind):
+        with self._lock:
+            cycle = self._cycles.get(kind)
+            return next(cycle) if cycle else None
+
+class FakeLLM:
+    def __init__(self, ttft_ms=300, tokens_per_sec=40, replay=None):
+        self.ttft = ttft_ms / 1000
+        self.tokens_per_sec = tokens_per_sec
+        self.book = ReplayBook(replay)
+        self._agent_replies = itertools.cycle(AGENT_REPLIES)
+        self._seen_prefixes = set()
+        self._lock = threading.Lock()
+        self.requests = 0
+
+    def reply(self, body):
+        """Returns (content, tool_call or None) for a chat completion request."""
+        messages = body.get("messages", [])
+        system = "".join(m["content"] for m in messages if m.get("role") == "system" and isinstance(m.get("content"), str))
+        user = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+
+        if "长期记忆档案" in system:
+            return self.book.next("summary") or SUMMARY_REPLY, None
+        if "路由助手" in system:
+            decision = self._route(user)
+            recorded = self.book.next("router")
+            if recorded:
+                decision = json.loads(recorded)
+            if body.get("tools"):
+                tool = body["tools"][0]["function"]["name"]
+                return "", {"name": tool, "arguments": json.dumps(decision, ensure_ascii=False)}
+            return json.dumps(decision, ensure_ascii=False), None
+        with self._lock:
+            default = next(self._agent_replies)
+        return self.book.next("agent") or default, None
+
+    def _route(self, user):
+        guess = classify([HumanMessage(content=user)])
+        target = guess["target"] if guess and guess["target"] else "xin_jing"
+        return {"分发目标": AGENT_NAMES[target], "建议话术": "顺着老人的话往下聊", "置信度": "高"}
+
+    def usage(self, body, completion_tokens):
+        messages = body.get("messages", [])
+        prompt_text = "".join(str(m.get("content") or "") for m in messages)
+        prefix = str(messages[0].get("content") or "") if messages and messages[0].get("role") == "system" else ""
+        with self._lock:
+            cached = estimate_tokens(prefix) if prefix and prefix in self._seen_prefixes else 0
+            if prefix:
+                self._seen_prefixes.add(prefix)
+            self.requests += 1
+        return {
+            "prompt_tokens": estimate_tokens(prompt_text),
+            "completion_tokens": completion_tokens,
+            "total_tokens": estimate_tokens(prompt_text) + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached}
+        }
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self.send_error(404)
+                return
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            content, tool_call = fake.reply(body)
+            text = tool_call["arguments"] if tool_call else content
+            tokens = split_tokens(text)
+            try:
+                if body.get("stream"):
+                    self._stream(body, content, tool_call, tokens)
+                else:
+                    self._complete(body, content, tool_call, len(tokens))
+            except (BrokenPipeError, ConnectionResetError):
+                # Client gave up (cancelled hedge, timeout); nothing to answer
+                self.close_connection = True
+
+        def _complete(self, body, content, tool_call, n_tokens):
+            time.sleep(fake.ttft + n_tokens / fake.tokens_per_sec)
+            message = {"role": "assistant", "content": content}
+            if tool_call:
+                message["tool_calls"] = [{"id": f"call_{uuid.uuid4().hex[:12]}", "type": "function", "function": tool_call}]
+            payload = json.dumps({
+                "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_call else "stop"}],
+                "usage": fake.usage(body, n_tokens)
+            }, ensure_ascii=False).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _stream(self, body, content, tool_call, tokens):
+            chunk_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+            base = {"id": chunk_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": body.get("model", "fake")}
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+
+            def send(choices, **extra):
+                data = json.dumps(dict(base, choices=choices, **extra), ensure_ascii=False)
+                self.wfile.write(f"data: {data}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+            time.sleep(fake.ttft)
+            for i, token in enumerate(tokens):
+                if tool_call:
+                    call = {"index": 0, "function": {"arguments": token}}
+                    if i == 0:
+                        call.update(id=f"call_{uuid.uuid4().hex[:12]}", type="function")
+                        call["function"]["name"] = tool_call["name"]
+                    delta = {"role": "assistant", "tool_calls": [call]} if i == 0 else {"tool_calls": [call]}
+                else:
+                    delta = {"role": "assistant", "content": token} if i == 0 else {"content": token}
+                send([{"index": 0, "delta": delta, "finish_reason": None}])
+                time.sleep(1 / fake.tokens_per_sec)
+            send([{"index": 0, "delta": {}, "finish_reason": "tool_calls" if tool_call else "stop"}])
+            if (body.get("stream_options") or {}).get("include_usage"):
+                send([], usage=fake.usage(body, len(tokens)))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+    return Handler
+
+def start_server(host="127.0.0.1", port=0, ttft_ms=300, tokens_per_sec=40, replay=None):
+    """Start the fake API on a background thread; returns (server, base_url)."""
+    fake = FakeLLM(ttft_ms, tokens_per_sec, replay)
+    server = ThreadingHTTPServer((host, port), make_handler(fake))
+    server.daemon_threads = True
+    server.fake = fake
+    threading.Thread(target=server.serve_forever, daemon=True, name="fake-llm-server").start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8399)
+    parser.add_argument("--ttft-ms", type=float, default=300, help="delay before the first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=40)
+    parser.add_argument("--replay", help="JSONL file with recorded replies")
+    args = parser.parse_args()
+
+    server, base_url = start_server(args.host, args.port, args.ttft_ms, args.tokens_per_sec, args.replay)
+    print(f"Fake OpenAI-compatible API on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -1,54 +1,96 @@
+import os
+from contextlib import asynccontextmanager
 from langgraph.graph import StateGraph, END
-from langgraph.checkpoint.sqlite import SqliteSaver
-import sqlite3
+from langchain_core.messages import AIMessage
 from state import AgentState
-from nodes import wan_qing_node, xin_jing_node, xing_zhe_node, router_node
-
-conn = sqlite3.connect("memories.db", check_same_thread=False)
-memory = SqliteSaver(conn)
-
-workflow_wq = StateGraph(AgentState)
-workflow_wq.add_node("wan_qing", wan_qing_node)
-workflow_wq.set_entry_point("wan_qing")
-workflow_wq.add_edge("wan_qing", END)
-app_wanqing = workflow_wq.compile(checkpointer=memory)
-
-workflow_xj = StateGraph(AgentState)
-workflow_xj.add_node("xin_jing", xin_jing_node)
-workflow_xj.set_entry_point("xin_jing")
-workflow_xj.add_edge("xin_jing", END)
-app_xinjing = workflow_xj.compile(checkpointer=memory)
-
-workflow_xz = StateGraph(AgentState)
-workflow_xz.add_node("xing_zhe", xing_zhe_node)
-workflow_xz.set_entry_point("xing_zhe")
-workflow_xz.add_edge("xing_zhe", END)
-app_xingzhe = workflow_xz.compile(checkpointer=memory)
-
-# Router Workflow
-workflow_router = StateGraph(AgentState)
-workflow_router.add_node("router", router_node)
-workflow_router.add_node("wan_qing", wan_qing_node)
-workflow_router.add_node("xin_jing", xin_jing_node)
-workflow_router.add_node("xing_zhe", xing_zhe_node)
-
-workflow_router.set_entry_point("router")
+import tracing
+from checkpointer import create_checkpointer, open_async_checkpointer, CHECKPOINT_DB
+from nodes import (wan_qing_node, xin_jing_node, xing_zhe_node, router_node, speculative_router_node,
+                   awan_qing_node, axin_jing_node, axing_zhe_node, arouter_node, aspeculative_router_node)
+
+# Run the router and the previously used agent at the same time (see nodes.speculative_router_node)
+SPECULATIVE_ROUTING = os.getenv("SPECULATIVE_ROUTING", "0") == "1"
+
+SYNC_NODES = {
+    "router": speculative_router_node if SPECULATIVE_ROUTING else router_node,
+    "wan_qing": wan_qing_node,
+    "xin_jing": xin_jing_node,
+    "xing_zhe": xing_zhe_node
+}
+
+ASYNC_NODES = {
+    "router": aspeculative_router_node if SPECULATIVE_ROUTING else arouter_node,
+    "wan_qing": awan_qing_node,
+    "xin_jing": axin_jing_node,
+    "xing_zhe": axing_zhe_node
+}
+
+def build_agent_workflow(name, node):
+    workflow = StateGraph(AgentState)
+    workflow.add_node(name, node)
+    workflow.set_entry_point(name)
+    workflow.add_edge(name, END)
+    return workflow
 
 def route_next(state: AgentState):
+    # A speculative hit means the router node already added the agent's reply
+    if state["messages"] and isinstance(state["messages"][-1], AIMessage):
+        return END
     return state["next"]
 
-workflow_router.add_conditional_edges(
-    "router",
-    route_next,
-    {
-        "wan_qing": "wan_qing",
-        "xin_jing": "xin_jing",
-        "xing_zhe": "xing_zhe"
+def build_router_workflow(nodes):
+    workflow = StateGraph(AgentState)
+    workflow.add_node("router", nodes["router"])
+    workflow.add_node("wan_qing", nodes["wan_qing"])
+    workflow.add_node("xin_jing", nodes["xin_jing"])
+    workflow.add_node("xing_zhe", nodes["xing_zhe"])
+
+    workflow.set_entry_point("router")
+
+    workflow.add_conditional_edges(
+        "router",
+        route_next,
+        {
+            "wan_qing": "wan_qing",
+            "xin_jing": "xin_jing",
+            "xing_zhe": "xing_zhe",
+            END: END
+        }
+    )
+
+    workflow.add_edge("wan_qing", END)
+    workflow.add_edge("xin_jing", END)
+    workflow.add_edge("xing_zhe", END)
+    return workflow
+
+def compile_apps(nodes, checkpointer):
+    # Checkpoint reads and writes show up as checkpoint.read / checkpoint.write spans
+    tracing.instrument_checkpointer(checkpointer)
+    return {
+        "wan_qing": build_agent_workflow("wan_qing", nodes["wan_qing"]).compile(checkpointer=checkpointer),
+        "xin_jing": build_agent_workflow("xin_jing", nodes["xin_jing"]).compile(checkpointer=checkpointer),
+        "xing_zhe": build_agent_workflow("xing_zhe", nodes["xing_zhe"]).compile(checkpointer=checkpointer),
+        "router": build_router_workflow(nodes).compile(checkpointer=checkpointer)
     }
-)
 
-workflow_router.add_edge("wan_qing", END)
-workflow_router.add_edge("xin_jing", END)
-workflow_router.add_edge("xing_zhe", END)
+# Backend is picked by CHECKPOINT_BACKEND (see checkpointer.py)
+memory = create_checkpointer()
+
+_apps = compile_apps(SYNC_NODES, memory)
+app_wanqing = _apps["wan_qing"]
+app_xinjing = _apps["xin_jing"]
+app_xingzhe = _apps["xing_zhe"]
+app_router = _apps["router"]
+
+@asynccontextmanager
+async def open_async_apps(db_path=CHECKPOINT_DB):
+    """
+    Async variant of the four graphs for event-loop front ends (main.py --async, API servers):
+    nodes use llm.ainvoke and checkpoints go through an async saver, so one process can
+    serve many concurrent turns without a thread per request.
 
-app_router = workflow_router.compile(checkpointer=memory)
+        async with open_async_apps() as apps:
+            await apps["router"].ainvoke(inputs, config)
+    """
+    async with open_async_checkpointer(path=db_path) as checkpointer:
+        yield compile_apps(ASYNC_NODES, checkpointer)
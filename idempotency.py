@@ -0,0 +1,200 @@
+import os
+import time
+import asyncio
+import hashlib
+import threading
+import metrics
+
+# Single-flight for turns: duplicate submissions for the same elder (a double click, a
+# second tab, a client resending after a flaky connection) join the execution already in
+# flight and get its events instead of starting another graph run with its own LLM calls
+# and checkpoint writes. Streamlit reruns never get here, the page re-attaches to its
+# turn handle first.
+# A submission is identified by the id its client assigns once per submission (API
+# "submission_id") and, without one, by a hash of its normalized text or audio. An id keeps
+# answering duplicates for IDEMPOTENCY_WINDOW seconds after the turn finished; a text hash
+# only for IDEMPOTENCY_TEXT_WINDOW seconds, so the same sentence said again after the reply
+# is a new turn, and a repeated question is exactly what the router has to see.
+IDEMPOTENCY = os.getenv("IDEMPOTENCY", "1") == "1"
+IDEMPOTENCY_WINDOW = float(os.getenv("IDEMPOTENCY_WINDOW", "10"))
+IDEMPOTENCY_TEXT_WINDOW = float(os.getenv("IDEMPOTENCY_TEXT_WINDOW", "3"))
+
+_flights = {}
+_lock = threading.Lock()
+# Background drains of detached async turns, referenced until they finish
+_drains = set()
+
+class EventLog:
+    """Events of one execution, replayable from the start by any number of readers."""
+    def __init__(self):
+        self.events = []
+        self.done = False
+        self.error = None
+        self.finished_at = None
+        self.cond = threading.Condition()
+
+    def publish(self, event):
+        with self.cond:
+            self.events.append(event)
+            self.cond.notify_all()
+
+    def finish(self, error=None):
+        with self.cond:
+            self.done = True
+            self.error = error
+            self.finished_at = time.time()
+            self.cond.notify_all()
+
+    def replay(self, timeout=None):
+        """Yields every event, blocking for new ones; TimeoutError after `timeout` s without one."""
+        i = 0
+        while True:
+            with self.cond:
+                if not self.cond.wait_for(lambda: i < len(self.events) or self.done, timeout):
+                    raise TimeoutError("no event within timeout")
+                pending = self.events[i:]
+                done, error = self.done, self.error
+            for event in pending:
+                yield event
+            i += len(pending)
+            if done and i >= len(self.events):
+                if error is not None:
+                    raise error
+                return
+
+    def poll(self, start=0):
+        """Non-blocking: (events from index `start` on, whether the execution is done)."""
+        with self.cond:
+            return self.events[start:], self.done
+
+def normalize(text):
+    return " ".join(text.split()).casefold()
+
+def turn_key(thread_id, submission, submission_id=None):
+    """
+    (thread_id, "id", submission_id) if the client sent an id, else (thread_id, "hash",
+    hash of the normalized text or of the audio bytes of a recording).
+    """
+    if submission_id:
+        return thread_id, "id", str(submission_id)
+    if isinstance(submission, str):
+        submission = normalize(submission).encode("utf-8")
+    return thread_id, "hash", hashlib.sha1(submission).hexdigest()
+
+def _window(key):
+    return IDEMPOTENCY_WINDOW if key[1] == "id" else IDEMPOTENCY_TEXT_WINDOW
+
+def _join(key):
+    """Returns (flight, is_leader)."""
+    now = time.time()
+    with _lock:
+        for other in [k for k, f in _flights.items() if f.done and now - f.finished_at > _window(k)]:
+            del _flights[other]
+        flight = _flights.get(key)
+        # A failed turn may be retried right away
+        if flight is not None and not (flight.done and flight.error is not None):
+            return flight, False
+        flight = _flights[key] = EventLog()
+        return flight, True
+
+def _drain(flight, events):
+    try:
+        for event in events:
+            flight.publish(event)
+    except Exception as e:
+        flight.finish(e)
+    else:
+        flight.finish()
+
+def stream(thread_id, submission, start, submission_id=None):
+    """
+    Events of the turn for `submission` (the user text). `start()` returns the event iterator
+    of a fresh execution and is only called if the same submission is not in flight or just
+    finished.
+    """
+    if not IDEMPOTENCY:
+        yield from start()
+        return
+    flight, leader = _join(turn_key(thread_id, submission, submission_id))
+    if not leader:
+        metrics.incr("idempotency.coalesced")
+        yield from flight.replay()
+        return
+
+    metrics.incr("idempotency.executed")
+    events = iter(start())
+    try:
+        for event in events:
+            flight.publish(event)
+            yield event
+    except GeneratorExit:
+        # The consumer went away (e.g. the Streamlit script was rerun): finish the turn in
+        # the background so it is checkpointed once and duplicates still get the result
+        metrics.incr("idempotency.detached")
+        threading.Thread(target=_drain, args=(flight, events), daemon=True, name="idempotent-drain").start()
+        raise
+    except BaseException as e:
+        flight.finish(e)
+        raise
+    flight.finish()
+
+async def _adrain(flight, events):
+    try:
+        async for event in events:
+            flight.publish(event)
+    except Exception as e:
+        flight.finish(e)
+    else:
+        flight.finish()
+
+async def astream(thread_id, submission, start, submission_id=None):
+    """stream() for the async graphs: `start()` returns an async event iterator."""
+    if not IDEMPOTENCY:
+        async for event in start():
+            yield event
+        return
+    flight, leader = _join(turn_key(thread_id, submission, submission_id))
+    if not leader:
+        metrics.incr("idempotency.coalesced")
+        # The event log blocks; followers wait for events off the event loop
+        replay = flight.replay()
+        end = object()
+        while (event := await asyncio.to_thread(next, replay, end)) is not end:
+            yield event
+        return
+
+    metrics.incr("idempotency.executed")
+    events = aiter(start())
+    try:
+        async for event in events:
+            flight.publish(event)
+            yield event
+    except GeneratorExit:
+        # The consumer went away: finish the turn in the background, as in stream()
+        metrics.incr("idempotency.detached")
+        task = asyncio.get_running_loop().create_task(_adrain(flight, events))
+        _drains.add(task)
+        task.add_done_callback(_drains.discard)
+        raise
+    except BaseException as e:
+        # A cancelled leader must not look like a cancellation to the followers
+        flight.finish(e if isinstance(e, Exception) else RuntimeError(f"turn interrupted: {type(e).__name__}"))
+        raise
+    flight.finish()
+
+def call(thread_id, submission, fn):
+    """Single-flight for a plain call (e.g. speech recognition of the same recording)."""
+    if not IDEMPOTENCY:
+        return fn()
+    flight, leader = _join(turn_key(thread_id, submission))
+    if not leader:
+        metrics.incr("idempotency.coalesced")
+        return next(flight.replay())
+    try:
+        result = fn()
+    except BaseException as e:
+        flight.finish(e)
+        raise
+    flight.publish(result)
+    flight.finish()
+    return result
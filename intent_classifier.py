@@ -0,0 +1,79 @@
+import os
+import re
+from langchain_core.messages import HumanMessage
+from prompts import ROUTER_AGENTS
+
+# Local routing tier that runs before the LLM router (see nodes.router_node).
+# LOCAL_ROUTER: "on" = answer confident turns locally, "shadow" = always ask the LLM
+# but record agreement, "off" = disabled.
+LOCAL_ROUTER_MODE = os.getenv("LOCAL_ROUTER", "on")
+LOCAL_ROUTER_THRESHOLD = float(os.getenv("LOCAL_ROUTER_THRESHOLD", "0.8"))
+# Minimum keyword weight (sum of matched keyword lengths) before we trust a guess at all
+LOCAL_ROUTER_MIN_SCORE = int(os.getenv("LOCAL_ROUTER_MIN_SCORE", "2"))
+
+AGENT_KEYS = {agent["name"]: agent["key"] for agent in ROUTER_AGENTS}
+
+# Priority from the router prompt: cognitive symptoms > value crisis > companionship
+AGENT_PRIORITY = ["wan_qing", "xing_zhe", "xin_jing"]
+
+def load_keywords(agents=ROUTER_AGENTS):
+    """
+    Keyword lists from the agent descriptors in prompts.py (shared with both router prompts);
+    "signals" are descriptions for the LLM and are not matched here:
+    {"wan_qing": {"混淆类": ["回家", ...], ...}, ...}
+    """
+    return {agent["key"]: agent["keywords"] for agent in agents}
+
+KEYWORDS = load_keywords()
+
+def _normalize(text):
+    return re.sub(r'[\s，。！？、,.!?~…"“”\'‘’]+', '', text)
+
+def classify(messages):
+    """
+    Score the latest user utterance against the keyword lists.
+    Returns None when there is no user message, otherwise a dict with
+    target, confidence, scores, matched keywords and whether it passes the threshold.
+    """
+    human_msgs = [m for m in messages if isinstance(m, HumanMessage)]
+    if not human_msgs:
+        return None
+    text = _normalize(str(human_msgs[-1].content))
+
+    hits = []
+    for agent, categories in KEYWORDS.items():
+        for category, words in categories.items():
+            for word in words:
+                start = text.find(word)
+                if start >= 0:
+                    hits.append((start, start + len(word), agent, category, word))
+
+    scores = {agent: 0 for agent in AGENT_PRIORITY}
+    matched = []
+    for start, end, agent, category, word in hits:
+        # A keyword inside a longer matched one ("没人" in "没人需要") is not a signal of its own
+        if any(s <= start and end <= e and e - s > end - start for s, e, *_ in hits):
+            continue
+        # Longer keywords are more specific than single characters like "闷"
+        scores[agent] += len(word)
+        matched.append(f"{category}:{word}")
+
+    # 重复类: the same utterance again is a strong cognitive signal for 晚晴
+    for previous in human_msgs[-6:-1]:
+        if text and _normalize(str(previous.content)) == text:
+            scores["wan_qing"] += 4
+            matched.append("重复类:重复上一句")
+            break
+
+    total = sum(scores.values())
+    if total == 0:
+        return {"target": None, "confidence": 0.0, "scores": scores, "matched": matched, "confident": False}
+
+    # Highest score wins, ties follow the prompt's priority order
+    target = max(AGENT_PRIORITY, key=lambda a: (scores[a], -AGENT_PRIORITY.index(a)))
+    # Share of the keyword weight, damped for long utterances where one stray keyword
+    # covers only a small part of what was said
+    coverage = min(1.0, 4 * scores[target] / max(len(text), 1))
+    confidence = scores[target] / total * coverage
+    confident = confidence >= LOCAL_ROUTER_THRESHOLD and scores[target] >= LOCAL_ROUTER_MIN_SCORE
+    return {"target": target, "confidence": confidence, "scores": scores, "matched": matched, "confident": confident}
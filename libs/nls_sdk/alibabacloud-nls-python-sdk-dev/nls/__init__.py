@@ -6,5 +6,7 @@ from .speech_transcriber import *
 from .speech_synthesizer import *
 from .stream_input_tts import *
 from .realtime_meeting import *
+from .pool import *
+from .mux import *
 from .util import *
 from .version import __version__
@@ -52,7 +52,9 @@ def core_on_open(ws, args):
         ws.close()
     nls = args[0]
     nls._NlsCore__notify_on_open()
-    nls.start(args[1], nls._NlsCore__ping_interval, nls._NlsCore__ping_timeout)
+    # None: connection opened ahead of any task (see connect())
+    if args[1] is not None:
+        nls.start(args[1], nls._NlsCore__ping_interval, nls._NlsCore__ping_timeout)
     nls._NlsCore__issue_callback('on_open')
 
 def core_on_data(ws, data, opcode, flag, args):
@@ -84,21 +86,8 @@ class NlsCore:
             raise InvalidParameter('Must provide a valid token!')
         else:
             self.__token = token
-        self.__callbacks = {}
-        if on_open:
-            self.__callbacks['on_open'] = on_open
-        if on_message:
-            self.__callbacks['on_message'] = on_message
-        if on_close:
-            self.__callbacks['on_close'] = on_close
-        if on_error:
-            self.__callbacks['on_error'] = on_error
-        if on_data:
-            self.__callbacks['on_data'] = on_data
-        if not on_open and not on_message and not on_close and not on_error:
-            raise InvalidParameter('Must provide at least one callback')
-        logging.debug('callback args:{}'.format(callback_args))
-        self.__callback_args = callback_args
+        self.rebind(on_open, on_message, on_close, on_error, on_data,
+                    callback_args)
         self.__header = __HEADER__ + ['X-NLS-Token: {}'.format(self.__token)]
         websocket.enableTrace(True)
         self.__ws = websocket.WebSocketApp(self.__url,
@@ -112,6 +101,52 @@ class NlsCore:
         self.__lock = threading.Lock()
         self.__cond = threading.Condition()
         self.__connection_status = NlsConnectionStatus.Disconnected
+        self.__daemon = False
+
+    def rebind(self, on_open=None, on_message=None, on_close=None,
+               on_error=None, on_data=None, callback_args=[]):
+        """
+        Replace the callbacks, e.g. when a pooled connection is leased to
+        the next task
+        """
+        callbacks = {}
+        if on_open:
+            callbacks['on_open'] = on_open
+        if on_message:
+            callbacks['on_message'] = on_message
+        if on_close:
+            callbacks['on_close'] = on_close
+        if on_error:
+            callbacks['on_error'] = on_error
+        if on_data:
+            callbacks['on_data'] = on_data
+        if not on_open and not on_message and not on_close and not on_error:
+            raise InvalidParameter('Must provide at least one callback')
+        logging.debug('callback args:{}'.format(callback_args))
+        self.__callbacks = callbacks
+        self.__callback_args = callback_args
+
+    def connect(self, ping_interval=8, ping_timeout=None, timeout=10):
+        """
+        Open the websocket without starting a task, so that the handshake
+        is done before the task needs it; start() then sends its request
+        on the open connection
+        """
+        with self.__lock:
+            self.__ping_interval = ping_interval
+            self.__ping_timeout = ping_timeout
+            if self.__connection_status == NlsConnectionStatus.Connected:
+                return True
+            self.__ws.update_args(self, None)
+            # An idle connection must not keep the interpreter alive
+            self.__daemon = True
+        return self.__connect_before_start(ping_interval, ping_timeout,
+                                           timeout)
+
+    def is_connected(self):
+        with self.__lock:
+            return (self.__connection_status == NlsConnectionStatus.Connected
+                    and self.__th.is_alive())
 
     def start(self, msg, ping_interval, ping_timeout):
         self.__lock.acquire()
@@ -167,15 +202,15 @@ class NlsCore:
             self.__connection_status = NlsConnectionStatus.Disconnected
         logging.debug('ws exit...')
 
-    def __connect_before_start(self, ping_interval, ping_timeout):
+    def __connect_before_start(self, ping_interval, ping_timeout, timeout=10):
         with self.__cond:
             self.__th = threading.Thread(target=self.__run,
-                    args=[ping_interval, ping_timeout])
+                    args=[ping_interval, ping_timeout], daemon=self.__daemon)
             self.__th.start()
             if self.__connection_status == NlsConnectionStatus.Disconnected:
                 logging.debug('wait cond wakeup')
                 if not self.__async:
-                    if self.__cond.wait(timeout=10):
+                    if self.__cond.wait(timeout=timeout):
                         logging.debug('wakeup without timeout')
                         return self.__connection_status == NlsConnectionStatus.Connected
                     else:
@@ -0,0 +1,140 @@
+# Copyright (c) Alibaba, Inc. and its affiliates.
+
+import json
+import threading
+
+from . import logging
+from .exception import ConnectionUnavailable
+
+__all__ = ['TaskRouter', 'TaskChannel']
+
+
+class TaskRouter:
+    """
+    Callbacks of one shared NlsCore connection
+
+    Every text message from the gateway carries header.task_id; the router
+    hands it to the channel that started that task. Messages of a task
+    whose channel is gone (a late result after the task was released) are
+    dropped instead of reaching the next task on the connection. Binary
+    frames carry no task_id and go to the channel only if it is alone on
+    the connection; connection close and errors go to every channel, and
+    each channel is then discarded, so its lease goes back to the pool even
+    if the task never calls release.
+    """
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__channels = set()
+        self.__tasks = {}
+
+    def callbacks(self):
+        return {'on_open': self.on_open,
+                'on_message': self.on_message,
+                'on_data': self.on_data,
+                'on_close': self.on_close,
+                'on_error': self.on_error,
+                'callback_args': []}
+
+    def attach(self, channel):
+        with self.__lock:
+            self.__channels.add(channel)
+
+    def bind(self, channel, task_id):
+        with self.__lock:
+            self.__tasks[task_id] = channel
+
+    def detach(self, channel):
+        with self.__lock:
+            self.__channels.discard(channel)
+            for task_id in [t for t, c in self.__tasks.items()
+                            if c is channel]:
+                del self.__tasks[task_id]
+
+    def count(self):
+        with self.__lock:
+            return len(self.__channels)
+
+    def on_open(self, *args):
+        logging.debug('shared connection open')
+
+    def on_message(self, message, *args):
+        try:
+            task_id = json.loads(message)['header'].get('task_id')
+        except (ValueError, KeyError, TypeError):
+            logging.error('cannot route message:{}'.format(message))
+            return
+        with self.__lock:
+            channel = self.__tasks.get(task_id)
+        if channel is None:
+            logging.debug('drop message of task {}'.format(task_id))
+            return
+        channel.issue('on_message', [message])
+
+    def on_data(self, data, opcode, flag, *args):
+        with self.__lock:
+            channels = list(self.__channels)
+        if len(channels) != 1:
+            logging.error('cannot route binary frame to one of {} tasks'
+                          .format(len(channels)))
+            return
+        channels[0].issue('on_data', [data, opcode, flag])
+
+    def on_close(self, *args):
+        with self.__lock:
+            channels = list(self.__channels)
+        for channel in channels:
+            channel.issue('on_close')
+            channel.shutdown()
+
+    def on_error(self, message, *args):
+        with self.__lock:
+            channels = list(self.__channels)
+        for channel in channels:
+            channel.issue('on_error', [message])
+            channel.shutdown()
+
+
+class TaskChannel:
+    """
+    One task's view of a shared connection, leased from NlsConnectionPool
+
+    Offers the NlsCore methods the recognizer and transcriber use (rebind,
+    start, send, shutdown, is_connected), so a task runs the same code on
+    its own connection or on a shared one.
+    """
+    def __init__(self, pool, conn):
+        self.pool = pool
+        self.conn = conn
+        self.released = False
+        self.__callbacks = {}
+        self.__callback_args = []
+        conn.router.attach(self)
+
+    def rebind(self, on_open=None, on_message=None, on_close=None,
+               on_error=None, on_data=None, callback_args=[]):
+        self.__callbacks = {'on_open': on_open, 'on_message': on_message,
+                            'on_close': on_close, 'on_error': on_error,
+                            'on_data': on_data}
+        self.__callback_args = callback_args
+
+    def issue(self, which, exargs=[]):
+        callback = self.__callbacks.get(which)
+        if callback:
+            callback(*(exargs + self.__callback_args))
+
+    def start(self, msg, ping_interval, ping_timeout):
+        # Bind before sending, the answer may arrive before send() returns
+        self.conn.router.bind(self, json.loads(msg)['header']['task_id'])
+        self.conn.core.start(msg, ping_interval, ping_timeout)
+
+    def send(self, msg, binary):
+        if binary and self.conn.router.count() > 1:
+            raise ConnectionUnavailable(
+                'Binary frames carry no task_id, cannot share the connection')
+        self.conn.core.send(msg, binary)
+
+    def shutdown(self):
+        self.pool.discard(self)
+
+    def is_connected(self):
+        return self.conn.core.is_connected()
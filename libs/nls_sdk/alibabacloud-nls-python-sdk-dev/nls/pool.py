@@ -0,0 +1,289 @@
+# Copyright (c) Alibaba, Inc. and its affiliates.
+
+import atexit
+import threading
+import time
+import weakref
+
+from . import logging
+from .core import NlsCore
+from .mux import TaskRouter, TaskChannel
+from .exception import InvalidParameter, ConnectionTimeout
+
+__URL__ = 'wss://nls-gateway.cn-shanghai.aliyuncs.com/ws/v1'
+
+__all__ = ['NlsConnectionPool']
+
+_pools = weakref.WeakSet()
+
+
+class _PooledConnection:
+    def __init__(self, core, router):
+        self.core = core
+        self.router = router
+        self.leases = 0
+        self.created = time.time()
+        self.idle_since = self.created
+
+
+class NlsConnectionPool:
+    """
+    Warm, authenticated websocket connections to one NLS gateway
+
+    Recognizer and transcriber tasks created with pool=... lease a channel
+    on a pooled connection in start() instead of opening their own
+    connection, and hand it back when the task completes, so a task does
+    not pay the TCP + TLS + websocket handshake. Server messages are routed
+    to the task by header.task_id (see mux.TaskRouter), so a late message of
+    a finished task never reaches the next one.
+
+    By default a connection carries one task at a time: audio frames carry
+    no task_id, so tasks that send audio cannot share a connection.
+    max_tasks_per_connection > 1 lets tasks without binary uplink run
+    concurrently on one connection. Idle connections are kept alive with
+    websocket pings; a maintenance thread drops dead or long idle ones and
+    keeps min_idle connections open.
+    """
+    def __init__(self,
+                 url=__URL__,
+                 token=None,
+                 max_size=8,
+                 min_idle=1,
+                 max_idle_time=60,
+                 ping_interval=8,
+                 ping_timeout=None,
+                 connect_timeout=10,
+                 maintain_interval=5,
+                 max_tasks_per_connection=1):
+        """
+        NlsConnectionPool initialization
+
+        Parameters:
+        -----------
+        url: str
+            websocket url.
+        token: str
+            access token, sent on every connection handshake
+        max_size: int
+            upper bound of open connections, which also bounds the
+            websocket reader threads
+        min_idle: int
+            idle connections kept open ahead of demand, 0 for none
+        max_idle_time: int
+            seconds after which an idle connection is closed
+        ping_interval: int
+            websocket ping interval of pooled connections, default is 8
+        ping_timeout: int
+            timeout after send ping and recive pong, None disables the check
+        connect_timeout: int
+            wait timeout for connection setup
+        maintain_interval: int
+            seconds between maintenance runs
+        max_tasks_per_connection: int
+            tasks running at once on one connection, default is 1; only
+            tasks without binary uplink may share a connection
+        """
+        if not token:
+            raise InvalidParameter('Must provide a valid token!')
+        if max_size < 1 or min_idle > max_size:
+            raise InvalidParameter('Need 0 <= min_idle <= max_size, max_size >= 1')
+        if max_tasks_per_connection < 1:
+            raise InvalidParameter('max_tasks_per_connection must be >= 1')
+        self.__url = url
+        self.__token = token
+        self.__max_size = max_size
+        self.__min_idle = min_idle
+        self.__max_idle_time = max_idle_time
+        self.__ping_interval = ping_interval
+        self.__ping_timeout = ping_timeout
+        self.__connect_timeout = connect_timeout
+        self.__maintain_interval = maintain_interval
+        self.__max_tasks = max_tasks_per_connection
+        self.__conns = []
+        self.__connecting = 0
+        self.__closed = False
+        self.__cond = threading.Condition()
+        self.__stats = {'created': 0, 'reused': 0, 'discarded': 0,
+                        'waited': 0}
+        self.__maintainer = threading.Thread(target=self.__maintain,
+                                             name='nls-pool', daemon=True)
+        self.__maintainer.start()
+        _pools.add(self)
+
+    def acquire(self, timeout=10):
+        """
+        Lease a TaskChannel. Uses a live connection with room for another
+        task if there is one, opens a new connection if the pool is below
+        max_size, otherwise waits up to timeout seconds for a release.
+        """
+        deadline = time.time() + timeout
+        with self.__cond:
+            waited = False
+            while True:
+                if self.__closed:
+                    raise ConnectionTimeout('Pool is closed')
+                conn = self.__pick()
+                if conn:
+                    self.__stats['reused'] += 1
+                    return self.__lease(conn)
+                if len(self.__conns) + self.__connecting < self.__max_size:
+                    self.__connecting += 1
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise ConnectionTimeout(
+                        'No pooled connection free within {}s'.format(timeout))
+                if not waited:
+                    waited = True
+                    self.__stats['waited'] += 1
+                self.__cond.wait(remaining)
+        conn = self.__open(min(self.__connect_timeout,
+                               max(deadline - time.time(), 0.1)))
+        with self.__cond:
+            self.__connecting -= 1
+            if conn is None:
+                self.__cond.notify()
+                raise ConnectionTimeout('Connecting to {} failed'.format(
+                    self.__url))
+            self.__conns.append(conn)
+            # Waiters may fit on the new connection as well
+            self.__cond.notify_all()
+            return self.__lease(conn)
+
+    def release(self, channel, reusable=True):
+        """
+        Return a leased channel. reusable=False (or a dead connection)
+        closes its connection instead, e.g. after TaskFailed.
+        """
+        with self.__cond:
+            if channel.released:
+                return
+            channel.released = True
+            conn = channel.conn
+            conn.router.detach(channel)
+            if conn not in self.__conns:
+                # Dropped as dead while leased, its leases were written off
+                self.__cond.notify()
+                return
+            conn.leases -= 1
+            if reusable and not self.__closed and conn.core.is_connected():
+                if not conn.leases:
+                    conn.idle_since = time.time()
+                close = False
+            else:
+                close = True
+                self.__conns.remove(conn)
+                conn.leases = 0
+                self.__stats['discarded'] += 1
+            self.__cond.notify()
+        if close:
+            # Tasks still on the connection get on_close
+            conn.core.shutdown()
+
+    def discard(self, channel):
+        """Close a leased channel's connection instead of returning it."""
+        self.release(channel, reusable=False)
+
+    def close(self):
+        """Close all idle connections; leased ones close on release."""
+        with self.__cond:
+            self.__closed = True
+            idle = [c for c in self.__conns if not c.leases]
+            self.__conns = [c for c in self.__conns if c.leases]
+            self.__cond.notify_all()
+        for conn in idle:
+            conn.core.shutdown()
+
+    def stats(self):
+        with self.__cond:
+            stats = dict(self.__stats)
+            stats.update(idle=sum(1 for c in self.__conns if not c.leases),
+                         busy=sum(1 for c in self.__conns if c.leases),
+                         tasks=sum(c.leases for c in self.__conns),
+                         connecting=self.__connecting,
+                         max_size=self.__max_size)
+            return stats
+
+    def __lease(self, conn):
+        conn.leases += 1
+        return TaskChannel(self, conn)
+
+    def __usable(self, conn, now):
+        if not conn.core.is_connected():
+            return False
+        return conn.leases or now - conn.idle_since < self.__max_idle_time
+
+    def __drop_unusable(self, now):
+        # Dead connections go whether leased or not: a task on a dropped
+        # connection may never release it, and its lease must not keep a
+        # slot of max_size forever
+        drop = [c for c in self.__conns if not self.__usable(c, now)]
+        for conn in drop:
+            self.__conns.remove(conn)
+            conn.leases = 0
+        self.__stats['discarded'] += len(drop)
+        return drop
+
+    def __pick(self):
+        now = time.time()
+        for conn in self.__drop_unusable(now):
+            conn.core.shutdown()
+        candidates = [c for c in self.__conns if c.leases < self.__max_tasks
+                      and self.__usable(c, now)]
+        if not candidates:
+            return None
+        # Fill shared connections first, then the most recently used idle
+        # one, the least likely to have been dropped by the gateway
+        return max(candidates, key=lambda c: (c.leases, c.idle_since))
+
+    def __open(self, timeout):
+        router = TaskRouter()
+        core = NlsCore(url=self.__url, token=self.__token,
+                       **router.callbacks())
+        try:
+            if not core.connect(self.__ping_interval, self.__ping_timeout,
+                                timeout):
+                core.shutdown()
+                return None
+        except ConnectionTimeout as e:
+            logging.error('pool connect failed: {}'.format(e))
+            core.shutdown()
+            return None
+        with self.__cond:
+            self.__stats['created'] += 1
+        return _PooledConnection(core, router)
+
+    def __maintain(self):
+        first = True
+        while True:
+            if not first:
+                time.sleep(self.__maintain_interval)
+            first = False
+            with self.__cond:
+                if self.__closed:
+                    return
+                drop = self.__drop_unusable(time.time())
+                if drop:
+                    self.__cond.notify_all()
+                idle = sum(1 for c in self.__conns if not c.leases)
+                missing = min(self.__min_idle - idle - self.__connecting,
+                              self.__max_size - len(self.__conns) - self.__connecting)
+                if missing > 0:
+                    self.__connecting += missing
+            for conn in drop:
+                conn.core.shutdown()
+            for _ in range(max(missing, 0)):
+                conn = self.__open(self.__connect_timeout)
+                with self.__cond:
+                    self.__connecting -= 1
+                    if conn is not None and not self.__closed:
+                        self.__conns.append(conn)
+                    elif conn is not None:
+                        conn.core.shutdown()
+                    self.__cond.notify_all()
+
+
+@atexit.register
+def _close_pools():
+    for pool in list(_pools):
+        pool.close()
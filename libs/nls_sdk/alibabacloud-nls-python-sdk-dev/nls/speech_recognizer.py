@@ -12,7 +12,9 @@ from . import util
 from .exception import (StartTimeoutException,
                         StopTimeoutException,
                         NotStartException,
+                        ConnectionUnavailable,
                         InvalidParameter)
+from .websocket import WebSocketConnectionClosedException
 
 __SPEECH_RECOGNIZER_NAMESPACE__ = 'SpeechRecognizer'
 
@@ -38,7 +40,8 @@ class NlsSpeechRecognizer:
                  on_result_changed=None,
                  on_completed=None,
                  on_error=None, on_close=None,
-                 callback_args=[]):
+                 callback_args=[],
+                 pool=None):
         """
         NlsSpeechRecognizer initialization
 
@@ -78,6 +81,9 @@ class NlsSpeechRecognizer:
             The 1st argument is *args which is callback_args.
         callback_args: list
             callback_args will return in callbacks above for *args.
+        pool: NlsConnectionPool
+            lease a warm connection from this pool instead of opening one
+            per task, default is None
         """
         if not token or not appkey:
             raise InvalidParameter('Must provide token and appkey')
@@ -88,6 +94,7 @@ class NlsSpeechRecognizer:
             'TaskFailed': self.__task_failed
         }
         self.__callback_args = callback_args
+        self.__pool = pool
         self.__appkey = appkey
         self.__url = url
         self.__token = token
@@ -130,6 +137,9 @@ class NlsSpeechRecognizer:
 
     def __sr_core_on_close(self):
         logging.debug('__sr_core_on_close')
+        if self.__pool:
+            # Connection lost mid-task, hand the lease back (no-op if released)
+            self.__discard()
         if self.__on_close:
             self.__on_close(*self.__callback_args)
         with self.__start_cond:
@@ -151,7 +161,7 @@ class NlsSpeechRecognizer:
 
     def __recognition_completed(self, message):
         logging.debug('__recognition_completed')
-        self.__nls.shutdown()
+        self.__release()
         logging.debug('__recognition_completed shutdown done')
         if self.__on_completed:
             self.__on_completed(message, *self.__callback_args)
@@ -161,12 +171,26 @@ class NlsSpeechRecognizer:
 
     def __task_failed(self, message):
         logging.debug('__task_failed')
+        if self.__pool:
+            self.__discard()
         with self.__start_cond:
             self.__start_flag = False
             self.__start_cond.notify()
         if self.__on_error:
             self.__on_error(message, *self.__callback_args)
 
+    def __release(self):
+        if self.__pool:
+            self.__pool.release(self.__nls)
+        else:
+            self.__nls.shutdown()
+
+    def __discard(self):
+        if self.__pool:
+            self.__pool.discard(self.__nls)
+        else:
+            self.__nls.shutdown()
+
     def start(self, aformat='pcm', sample_rate=16000, ch=1,
               enable_intermediate_result=False,
               enable_punctuation_prediction=False,
@@ -201,20 +225,29 @@ class NlsSpeechRecognizer:
         ex: dict
             dict which will merge into 'payload' field in request
         """
-        self.__nls = NlsCore(
-            url=self.__url, 
-            token=self.__token,
-            on_open=self.__sr_core_on_open,
-            on_message=self.__sr_core_on_msg,
-            on_close=self.__sr_core_on_close,
-            on_error=self.__sr_core_on_error,
-            callback_args=[])
-
         if ch != 1:
             raise InvalidParameter(f'Not support channel {ch}')
         if aformat not in self.__allow_aformat:
             raise InvalidParameter(f'Format {aformat} not support')
 
+        if self.__pool:
+            # Warm connection; start() below only sends the request
+            self.__nls = self.__pool.acquire(timeout)
+            self.__nls.rebind(on_open=self.__sr_core_on_open,
+                              on_message=self.__sr_core_on_msg,
+                              on_close=self.__sr_core_on_close,
+                              on_error=self.__sr_core_on_error,
+                              callback_args=[])
+        else:
+            self.__nls = NlsCore(
+                url=self.__url, 
+                token=self.__token,
+                on_open=self.__sr_core_on_open,
+                on_message=self.__sr_core_on_msg,
+                on_close=self.__sr_core_on_close,
+                on_error=self.__sr_core_on_error,
+                callback_args=[])
+
         __id4 = uuid.uuid4().hex
         self.__task_id = uuid.uuid4().hex
         __header = {
@@ -245,11 +278,17 @@ class NlsSpeechRecognizer:
             if self.__start_flag:
                 logging.debug('already start...')
                 return
-            self.__nls.start(__jmsg, ping_interval, ping_timeout)
+            try:
+                self.__nls.start(__jmsg, ping_interval, ping_timeout)
+            except Exception:
+                if self.__pool:
+                    self.__discard()
+                raise
             if self.__start_flag == False:
                 if self.__start_cond.wait(timeout=timeout):
                     return
                 else:
+                    self.__discard()
                     raise StartTimeoutException(f'Waiting Start over {timeout}s')
 
     def stop(self, timeout=10):
@@ -284,12 +323,14 @@ class NlsSpeechRecognizer:
                 if self.__start_cond.wait(timeout):
                     return
                 else:
+                    if self.__pool:
+                        self.__discard()
                     raise StopTimeoutException(f'Waiting stop over {timeout}s')
     def shutdown(self):
         """
         Shutdown connection immediately
         """
-        self.__nls.shutdown()
+        self.__discard()
 
     def send_audio(self, pcm_data):
         """
@@ -308,8 +349,9 @@ class NlsSpeechRecognizer:
                 raise NotStartException('Need start before send!')
         try:
             self.__nls.send(__data, True)
-        except ConnectionResetError as __e:
-            logging.error('connection reset')
+        except (ConnectionResetError, ConnectionUnavailable,
+                WebSocketConnectionClosedException) as __e:
+            logging.error('connection lost: {}'.format(__e))
             self.__start_flag = False
-            self.__nls.shutdown()
+            self.__discard()
             raise __e
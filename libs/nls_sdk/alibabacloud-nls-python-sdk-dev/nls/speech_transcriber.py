@@ -11,7 +11,9 @@ from . import util
 from nls.exception import (StartTimeoutException,
                         StopTimeoutException,
                         NotStartException,
+                        ConnectionUnavailable,
                         InvalidParameter)
+from nls.websocket import WebSocketConnectionClosedException
 
 __SPEECH_TRANSCRIBER_NAMESPACE__ = 'SpeechTranscriber'
 
@@ -41,7 +43,8 @@ class NlsSpeechTranscriber:
                  on_completed=None,
                  on_error=None,
                  on_close=None,
-                 callback_args=[]):
+                 callback_args=[],
+                 pool=None):
         '''
         NlsSpeechTranscriber initialization
 
@@ -91,6 +94,9 @@ class NlsSpeechTranscriber:
             The 1st argument is *args which is callback_args.
         callback_args: list
             callback_args will return in callbacks above for *args.
+        pool: NlsConnectionPool
+            lease a warm connection from this pool instead of opening one
+            per task, default is None
         '''
         if not token or not appkey:
             raise InvalidParameter('Must provide token and appkey')
@@ -103,6 +109,7 @@ class NlsSpeechTranscriber:
             'TaskFailed': self.__task_failed
         }
         self.__callback_args = callback_args
+        self.__pool = pool
         self.__url = url
         self.__appkey = appkey
         self.__token = token
@@ -147,6 +154,9 @@ class NlsSpeechTranscriber:
 
     def __tr_core_on_close(self):
         logging.debug('__tr_core_on_close')
+        if self.__pool:
+            # Connection lost mid-task, hand the lease back (no-op if released)
+            self.__discard()
         if self.__on_close:
             self.__on_close(*self.__callback_args)
         with self.__start_cond:
@@ -178,7 +188,7 @@ class NlsSpeechTranscriber:
 
     def __transcription_completed(self, message):
         logging.debug('__transcription_completed')
-        self.__nls.shutdown()
+        self.__release()
         logging.debug('__transcription_completed shutdown done')
         if self.__on_completed:
             self.__on_completed(message, *self.__callback_args)
@@ -188,12 +198,26 @@ class NlsSpeechTranscriber:
 
     def __task_failed(self, message):
         logging.debug('__task_failed')
+        if self.__pool:
+            self.__discard()
         with self.__start_cond:
             self.__start_flag = False
             self.__start_cond.notify()
         if self.__on_error:
             self.__on_error(message, *self.__callback_args)
 
+    def __release(self):
+        if self.__pool:
+            self.__pool.release(self.__nls)
+        else:
+            self.__nls.shutdown()
+
+    def __discard(self):
+        if self.__pool:
+            self.__pool.discard(self.__nls)
+        else:
+            self.__nls.shutdown()
+
     def start(self, aformat='pcm', sample_rate=16000, ch=1,
               enable_intermediate_result=False,
               enable_punctuation_prediction=False,
@@ -228,19 +252,28 @@ class NlsSpeechTranscriber:
         ex: dict
             dict which will merge into 'payload' field in request
         """
-        self.__nls = NlsCore(
-            url=self.__url, 
-            token=self.__token,
-            on_open=self.__tr_core_on_open,
-            on_message=self.__tr_core_on_msg,
-            on_close=self.__tr_core_on_close,
-            on_error=self.__tr_core_on_error,
-            callback_args=[])
-
         if ch != 1:
             raise ValueError('not support channel: {}'.format(ch))
         if aformat not in self.__allow_aformat:
             raise ValueError('format {} not support'.format(aformat))
+        if self.__pool:
+            # Warm connection; start() below only sends the request
+            self.__nls = self.__pool.acquire(timeout)
+            self.__nls.rebind(on_open=self.__tr_core_on_open,
+                              on_message=self.__tr_core_on_msg,
+                              on_close=self.__tr_core_on_close,
+                              on_error=self.__tr_core_on_error,
+                              callback_args=[])
+        else:
+            self.__nls = NlsCore(
+                url=self.__url, 
+                token=self.__token,
+                on_open=self.__tr_core_on_open,
+                on_message=self.__tr_core_on_msg,
+                on_close=self.__tr_core_on_close,
+                on_error=self.__tr_core_on_error,
+                callback_args=[])
+
         __id4 = uuid.uuid4().hex
         self.__task_id = uuid.uuid4().hex
         __header = {
@@ -271,11 +304,17 @@ class NlsSpeechTranscriber:
             if self.__start_flag:
                 logging.debug('already start...')
                 return
-            self.__nls.start(__jmsg, ping_interval, ping_timeout)
+            try:
+                self.__nls.start(__jmsg, ping_interval, ping_timeout)
+            except Exception:
+                if self.__pool:
+                    self.__discard()
+                raise
             if self.__start_flag == False:
                 if self.__start_cond.wait(timeout):
                     return
                 else:
+                    self.__discard()
                     raise StartTimeoutException(f'Waiting Start over {timeout}s')
 
     def stop(self, timeout=10):
@@ -310,6 +349,8 @@ class NlsSpeechTranscriber:
                 if self.__start_cond.wait(timeout):
                     return
                 else:
+                    if self.__pool:
+                        self.__discard()
                     raise StopTimeoutException(f'Waiting stop over {timeout}s')
 
     def ctrl(self, **kwargs):
@@ -349,7 +390,7 @@ class NlsSpeechTranscriber:
         """
         Shutdown connection immediately
         """
-        self.__nls.shutdown()
+        self.__discard()
 
     def send_audio(self, pcm_data):
         """
@@ -367,8 +408,9 @@ class NlsSpeechTranscriber:
                 return
         try:
             self.__nls.send(__data, True)
-        except ConnectionResetError as __e:
-            logging.error('connection reset')
+        except (ConnectionResetError, ConnectionUnavailable,
+                WebSocketConnectionClosedException) as __e:
+            logging.error('connection lost: {}'.format(__e))
             self.__start_flag = False
-            self.__nls.shutdown()
+            self.__discard()
             raise __e
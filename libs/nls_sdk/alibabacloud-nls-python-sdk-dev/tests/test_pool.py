@@ -0,0 +1,94 @@
+import json
+import threading
+
+import nls
+from nls import pool as nls_pool
+from nls.exception import ConnectionUnavailable
+
+# Pool and task routing against an in-process fake connection, no gateway
+# or credentials needed:  python -m tests.test_pool
+
+
+class FakeCore:
+    """Stands in for NlsCore: answers Start, and drop() loses the socket"""
+    cores = []
+
+    def __init__(self, url=None, token=None, on_open=None, on_message=None,
+                 on_close=None, on_error=None, on_data=None,
+                 callback_args=[]):
+        self.__on_message = on_message
+        self.__on_close = on_close
+        self.__connected = False
+        FakeCore.cores.append(self)
+
+    def connect(self, ping_interval=8, ping_timeout=None, timeout=10):
+        self.__connected = True
+        return True
+
+    def is_connected(self):
+        return self.__connected
+
+    def start(self, msg, ping_interval, ping_timeout):
+        header = json.loads(msg)['header']
+        name = header['name'].replace('Start', '') + 'Started'
+        reply = json.dumps({'header': {'name': name,
+                                       'task_id': header['task_id'],
+                                       'status': 20000000}})
+        threading.Timer(0.01, self.__on_message, [reply]).start()
+
+    def send(self, msg, binary):
+        if not self.__connected:
+            raise ConnectionUnavailable('connection closed')
+
+    def drop(self):
+        self.__connected = False
+        self.__on_close()
+
+    def shutdown(self):
+        if self.__connected:
+            self.drop()
+
+
+def test_drop_with_task_in_flight():
+    pool = nls.NlsConnectionPool(url='ws://fake', token='token', max_size=1,
+                                 min_idle=0, maintain_interval=3600)
+    closed = threading.Event()
+    tr = nls.NlsSpeechTranscriber(url='ws://fake', token='token',
+                                  appkey='appkey', pool=pool,
+                                  on_close=lambda *args: closed.set())
+    tr.start(timeout=1)
+    stats = pool.stats()
+    assert stats['busy'] == 1 and stats['tasks'] == 1, stats
+
+    # The gateway drops the socket mid-task; the task never completes
+    FakeCore.cores[-1].drop()
+    assert closed.wait(1)
+    stats = pool.stats()
+    assert stats['busy'] == 0 and stats['tasks'] == 0, stats
+
+    # The only slot is free again
+    channel = pool.acquire(timeout=1)
+    pool.release(channel)
+    pool.close()
+    print('test_drop_with_task_in_flight ok: {}'.format(pool.stats()))
+
+
+def test_drop_with_raw_channel():
+    # A channel whose task handles nothing still gets its lease back
+    pool = nls.NlsConnectionPool(url='ws://fake', token='token', max_size=1,
+                                 min_idle=0, maintain_interval=3600)
+    channel = pool.acquire(timeout=1)
+    channel.start(json.dumps({'header': {'name': 'StartTranscription',
+                                         'task_id': 'task'}}), 8, None)
+    FakeCore.cores[-1].drop()
+    assert channel.released
+    pool.release(channel)
+    assert pool.stats()['tasks'] == 0, pool.stats()
+    pool.release(pool.acquire(timeout=1))
+    pool.close()
+    print('test_drop_with_raw_channel ok: {}'.format(pool.stats()))
+
+
+nls_pool.NlsCore = FakeCore
+test_drop_with_task_in_flight()
+test_drop_with_raw_channel()
@@ -0,0 +1,208 @@
+import os
+import asyncio
+import threading
+import contextvars
+import weakref
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeout
+import httpx
+from langchain_openai import ChatOpenAI
+import metrics
+import tracing
+
+# Transport for every chat model in the process (nodes.llm, the Ark context model) and the
+# Ark context API: one pooled httpx client for sync calls and one for async calls.
+# The OpenAI SDK default keeps idle connections for 5 s only, less than the pause between
+# an elder's turns, so nearly every turn paid a new TCP + TLS handshake; here idle
+# connections live LLM_KEEPALIVE_EXPIRY seconds. Retries (LLM_MAX_RETRIES) use the SDK's
+# exponential backoff with jitter.
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "64"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "32"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "120"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+# HTTP/2 multiplexes concurrent calls over one connection; needs the h2 package
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "0") == "1"
+
+# Hedged requests for router calls (prompt_cache.CachedPromptModel.invoke), never for agent
+# replies streamed to the UI or long-term memory summaries. If the call has not returned
+# after the hedge delay a second, identical request is sent and whichever answers first wins.
+# LLM_HEDGE: "off", a delay in milliseconds, or "auto" (p95 of recent router calls)
+LLM_HEDGE = os.getenv("LLM_HEDGE", "off")
+# At most this share of calls may send a second request
+LLM_HEDGE_MAX_RATIO = float(os.getenv("LLM_HEDGE_MAX_RATIO", "0.1"))
+_HEDGE_MIN_SAMPLES = 20
+# Threads for hedged attempts: a primary and a backup for every turn worker by default.
+# Attempts never queue for a thread; when all are busy the call runs unhedged in the caller.
+LLM_HEDGE_WORKERS = int(os.getenv("LLM_HEDGE_WORKERS", str(2 * int(os.getenv("TURN_WORKERS", "8")))))
+
+_clients = {}
+_clients_lock = threading.Lock()
+_hedge_pool = ThreadPoolExecutor(max_workers=LLM_HEDGE_WORKERS, thread_name_prefix="llm-hedge")
+_hedge_slots = threading.BoundedSemaphore(LLM_HEDGE_WORKERS)
+
+def _transport_kwargs():
+    http2 = LLM_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            print("LLM_HTTP2=1 needs: pip install 'httpx[http2]'; using HTTP/1.1")
+            http2 = False
+    return {
+        "limits": httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_KEEPALIVE,
+                               keepalive_expiry=LLM_KEEPALIVE_EXPIRY),
+        "http2": http2
+    }
+
+class _LazyAsyncTransport(httpx.AsyncBaseTransport):
+    """
+    The pooled async transport, built on the first request. ChatOpenAI wants its async
+    client at construction (import time), but processes that never make an async call
+    (the Streamlit page) should not set up a connection pool and TLS context for it.
+    Pooled connections belong to the event loop that opened them, so every running loop
+    gets its own pool; a later asyncio.run() (main.py --async, benches) never reuses
+    connections of a closed loop.
+    """
+    def __init__(self, **kwargs):
+        self._kwargs = kwargs
+        self._transports = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _transport(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            # Connections of a closed loop can neither be used nor closed any more
+            for closed in [l for l in self._transports if l.is_closed()]:
+                del self._transports[closed]
+            transport = self._transports.get(loop)
+            if transport is None:
+                transport = self._transports[loop] = httpx.AsyncHTTPTransport(**self._kwargs)
+            return transport
+
+    async def handle_async_request(self, request):
+        return await self._transport().handle_async_request(request)
+
+    async def aclose(self):
+        with self._lock:
+            transport = self._transports.pop(asyncio.get_running_loop(), None)
+        if transport is not None:
+            await transport.aclose()
+
+def timeout():
+    return httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+
+def http_client():
+    """The shared sync httpx client."""
+    with _clients_lock:
+        if "sync" not in _clients:
+            _clients["sync"] = httpx.Client(timeout=timeout(), **_transport_kwargs())
+        return _clients["sync"]
+
+def http_async_client():
+    """The shared async httpx client, with one connection pool per event loop."""
+    with _clients_lock:
+        if "async" not in _clients:
+            _clients["async"] = httpx.AsyncClient(timeout=timeout(), transport=_LazyAsyncTransport(**_transport_kwargs()))
+        return _clients["async"]
+
+def chat_model(**kwargs):
+    """ChatOpenAI on the shared pooled clients with the configured timeouts and retries."""
+    kwargs.setdefault("timeout", timeout())
+    kwargs.setdefault("max_retries", LLM_MAX_RETRIES)
+    return ChatOpenAI(http_client=http_client(), http_async_client=http_async_client(), **kwargs)
+
+def hedge_delay():
+    """Seconds to wait before hedging, or None if hedging is off (or has no baseline yet)."""
+    if LLM_HEDGE == "off":
+        return None
+    if LLM_HEDGE == "auto":
+        stats = metrics.timer_stats("llm.router.seconds")
+        if not stats or stats["count"] < _HEDGE_MIN_SAMPLES:
+            return None
+        return stats["p95"]
+    return float(LLM_HEDGE) / 1000
+
+def _may_hedge():
+    return metrics.get("llm.hedge.fired") < LLM_HEDGE_MAX_RATIO * metrics.get("llm.hedge.calls")
+
+def _submit(fn):
+    """
+    Start `fn()` on an idle hedge thread, or return None when all are busy: time spent queued
+    for a thread would count toward the hedge delay. Each attempt gets its own copy of the
+    caller's context (spans, ...).
+    """
+    if not _hedge_slots.acquire(blocking=False):
+        return None
+    ctx = contextvars.copy_context()
+    def run():
+        try:
+            return ctx.run(fn)
+        finally:
+            _hedge_slots.release()
+    return _hedge_pool.submit(run)
+
+def call(fn):
+    """Run the blocking LLM call `fn()`, hedged if enabled."""
+    delay = hedge_delay()
+    if delay is None:
+        return fn()
+    primary = _submit(fn)
+    if primary is None:
+        metrics.incr("llm.hedge.saturated")
+        return fn()
+    metrics.incr("llm.hedge.calls")
+    try:
+        return primary.result(timeout=delay)
+    except FutureTimeout:
+        pass
+    if not _may_hedge():
+        return primary.result()
+    # A blocking HTTP call can't be interrupted; the slower attempt is left to finish and dropped
+    backup = _submit(fn)
+    if backup is None:
+        metrics.incr("llm.hedge.saturated")
+        return primary.result()
+    metrics.incr("llm.hedge.fired")
+    tracing.current().set("hedged", True)
+    winner = _first_success(wait([primary, backup], return_when=FIRST_COMPLETED).done, primary, backup)
+    if winner is backup:
+        metrics.incr("llm.hedge.won")
+    return winner.result()
+
+def _first_success(done, primary, backup):
+    # A cancelled attempt has no exception() to ask for, it raises CancelledError
+    succeeded = [f for f in done if not f.cancelled() and f.exception() is None]
+    if succeeded:
+        return succeeded[0]
+    # The first to finish failed, the other attempt decides
+    return backup if primary in done else primary
+
+async def acall(fn):
+    """Async variant of call(); `fn()` returns a coroutine. The slower attempt is cancelled."""
+    delay = hedge_delay()
+    if delay is None:
+        return await fn()
+    metrics.incr("llm.hedge.calls")
+    primary = asyncio.ensure_future(fn())
+    backup = None
+    try:
+        try:
+            return await asyncio.wait_for(asyncio.shield(primary), delay)
+        except asyncio.TimeoutError:
+            pass
+        if not _may_hedge():
+            return await primary
+        metrics.incr("llm.hedge.fired")
+        tracing.current().set("hedged", True)
+        backup = asyncio.ensure_future(fn())
+        done, _ = await asyncio.wait({primary, backup}, return_when=FIRST_COMPLETED)
+        winner = _first_success(done, primary, backup)
+        await asyncio.wait({winner})
+        if winner is backup:
+            metrics.incr("llm.hedge.won")
+        return winner.result()
+    finally:
+        primary.cancel()
+        if backup is not None:
+            backup.cancel()
@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.messages import SystemMessage, HumanMessage
+from checkpointer import connect_sqlite, CHECKPOINT_DB
+import metrics
+import tracing
+
+# Rolling long-term memory per elder.
+# Turns that fall out of clean_history's 20-message window are condensed by the LLM, in the
+# background, into one short record per thread stored next to the checkpoints. Agents get
+# it as a small system block, so continuity costs a bounded number of tokens per turn.
+# Opt-in: each update is an extra LLM call per thread.
+LONG_TERM_MEMORY = os.getenv("LONG_TERM_MEMORY", "0") == "1"
+LTM_DB = os.getenv("LTM_DB", CHECKPOINT_DB)
+# Summarize once this many evicted messages are pending (bounds LLM calls to ~1 per few turns)
+LTM_BATCH = int(os.getenv("LTM_BATCH", "6"))
+LTM_MAX_CHARS = int(os.getenv("LTM_MAX_CHARS", "400"))
+# Upper bound on messages folded in one call (threads that predate this feature)
+LTM_MAX_PENDING = int(os.getenv("LTM_MAX_PENDING", "60"))
+# Records kept in process memory (LRU); the rest are read back from LTM_DB on demand
+LTM_CACHE_SIZE = int(os.getenv("LTM_CACHE_SIZE", "1024"))
+# Ids of the newest folded messages stored per record, to find where folding stopped
+LTM_FOLDED_IDS = 64
+
+MEMORY_BLOCK_PREFIX = "【长期记忆】以下是你从更早的对话中记住的关于这位老人的信息，自然地运用，不要逐条复述："
+
+SUMMARY_PROMPT = f"""你负责维护一位老人的长期记忆档案。
+根据【已有记忆】和【新的对话片段】，输出更新后的记忆档案：
+- 只记录对以后陪伴有用的事实：称呼、家人和重要他人的名字与关系、家乡、职业经历、兴趣爱好、反复出现的情绪或困扰、健康情况、讲过的重要故事
+- 新信息与已有记忆冲突时以新信息为准
+- 用简短的要点列出，总长度不超过{LTM_MAX_CHARS}字
+- 只输出记忆档案本身，不要任何解释"""
+
+_lock = threading.Lock()
+_conn = None
+# thread_id -> (summary, ids of the newest folded messages)
+_summaries = OrderedDict()
+_in_flight = set()
+# One update per thread at a time, so background updates and compaction never fold the same turns
+# twice; an entry lives only while some caller holds or waits for it
+_thread_locks = {}
+_pool = ThreadPoolExecutor(max_workers=int(os.getenv("LTM_WORKERS", "2")), thread_name_prefix="long-term-memory")
+
+def _db():
+    global _conn
+    if _conn is None:
+        _conn = connect_sqlite(LTM_DB)
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS elder_memory (
+                thread_id TEXT PRIMARY KEY,
+                summary TEXT NOT NULL,
+                last_message_id TEXT,
+                updated_at REAL,
+                folded_ids TEXT
+            )
+        """)
+        columns = [row[1] for row in _conn.execute("PRAGMA table_info(elder_memory)")]
+        if "folded_ids" not in columns:
+            _conn.execute("ALTER TABLE elder_memory ADD COLUMN folded_ids TEXT")
+        _conn.commit()
+    return _conn
+
+def _remember(thread_id, record):
+    # Caller holds _lock
+    _summaries[thread_id] = record
+    _summaries.move_to_end(thread_id)
+    while len(_summaries) > LTM_CACHE_SIZE:
+        _summaries.popitem(last=False)
+
+def _load(thread_id):
+    with _lock:
+        if thread_id in _summaries:
+            _summaries.move_to_end(thread_id)
+            return _summaries[thread_id]
+        row = _db().execute("SELECT summary, last_message_id, folded_ids FROM elder_memory WHERE thread_id = ?", (thread_id,)).fetchone()
+        if row:
+            # Records written before folded_ids existed only know their last message
+            folded = json.loads(row[2]) if row[2] else [row[1]] if row[1] else []
+            record = (row[0], folded)
+        else:
+            record = ("", [])
+        _remember(thread_id, record)
+        return record
+
+def _save(thread_id, summary, folded):
+    folded = folded[-LTM_FOLDED_IDS:]
+    with _lock:
+        _db().execute(
+            "INSERT OR REPLACE INTO elder_memory (thread_id, summary, last_message_id, updated_at, folded_ids) VALUES (?, ?, ?, ?, ?)",
+            (thread_id, summary, folded[-1] if folded else None, time.time(), json.dumps(folded))
+        )
+        _db().commit()
+        _remember(thread_id, (summary, folded))
+
+def get_summary(thread_id):
+    if not LONG_TERM_MEMORY or not thread_id:
+        return ""
+    return _load(thread_id)[0]
+
+def memory_block(thread_id):
+    """SystemMessage to place right after the static prompt, or None if nothing is remembered yet."""
+    summary = get_summary(thread_id)
+    if not summary:
+        return None
+    return SystemMessage(content=f"{MEMORY_BLOCK_PREFIX}\n{summary}")
+
+def _pending(thread_id, evicted):
+    """Evicted (id, message) pairs not yet folded into the stored summary."""
+    _, folded = _load(thread_id)
+    folded = set(folded)
+    # Folding always takes the oldest pending messages, so everything up to the newest folded
+    # id in the list is folded, whatever slice of the thread the caller passes in (compaction
+    # keeps COMPACT_KEEP_MESSAGES, background updates HISTORY_WINDOW)
+    for i in range(len(evicted) - 1, -1, -1):
+        if evicted[i][0] in folded:
+            return evicted[i + 1:]
+    # No folded message is left (compacted away) or none was folded yet: compaction only
+    # removes the oldest messages, so everything still in the thread is newer than them
+    return evicted
+
+def _format(messages):
+    lines = []
+    for msg in messages:
+        speaker = "老人" if isinstance(msg, HumanMessage) else "陪伴者"
+        lines.append(f"{speaker}：{str(msg.content).strip()}")
+    return "\n".join(lines)
+
+@contextmanager
+def _thread_lock(thread_id):
+    with _lock:
+        entry = _thread_locks.setdefault(thread_id, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _thread_locks[thread_id]
+
+def summarize(llm, thread_id, evicted, extra_summary=""):
+    """Fold pending evicted messages into the thread's memory record (blocking LLM call)."""
+    with _thread_lock(thread_id):
+        return _summarize(llm, thread_id, evicted, extra_summary)
+
+def _summarize(llm, thread_id, evicted, extra_summary):
+    pending = _pending(thread_id, evicted)[-LTM_MAX_PENDING:]
+    if not pending and not extra_summary:
+        return get_summary(thread_id)
+    summary, folded = _load(thread_id)
+    existing = "\n".join(part for part in [summary, extra_summary] if part) or "（暂无）"
+    start = time.time()
+    with tracing.span("llm.summary", thread_id=thread_id, messages=len(pending)) as span:
+        response = llm.invoke([
+            SystemMessage(content=SUMMARY_PROMPT),
+            HumanMessage(content=f"【已有记忆】\n{existing}\n\n【新的对话片段】\n{_format([m for _, m in pending]) or '（无）'}")
+        ], config={"callbacks": []})
+        usage = getattr(response, "usage_metadata", None) or {}
+        span.set("prompt_tokens", usage.get("input_tokens", 0))
+        span.set("output_tokens", usage.get("output_tokens", 0))
+    new_summary = str(response.content).strip()[:LTM_MAX_CHARS * 2]
+    _save(thread_id, new_summary, folded + [msg_id for msg_id, _ in pending])
+    metrics.incr("long_term_memory.updates")
+    metrics.incr("long_term_memory.update_ms", int((time.time() - start) * 1000))
+    return new_summary
+
+def _run(llm, thread_id, evicted):
+    try:
+        summarize(llm, thread_id, evicted)
+    except Exception as e:
+        print(f"Long-term memory update error ({thread_id}): {e}")
+        metrics.incr("long_term_memory.errors")
+    finally:
+        with _lock:
+            _in_flight.discard(thread_id)
+
+def schedule_update(llm, thread_id, evicted):
+    """
+    Queue a background update if enough evicted messages are pending.
+    Never blocks the turn; at most one update per thread is in flight.
+    """
+    if not LONG_TERM_MEMORY or not thread_id or not evicted:
+        return
+    if len(_pending(thread_id, evicted)) < LTM_BATCH:
+        return
+    with _lock:
+        if thread_id in _in_flight:
+            return
+        _in_flight.add(thread_id)
+    _pool.submit(_run, llm, thread_id, list(evicted))
@@ -1,12 +1,19 @@
 import os
 import sys
-from langchain_core.messages import HumanMessage
-from graph import app_wanqing, app_xinjing, app_xingzhe, app_router
+import asyncio
+from langchain_core.messages import HumanMessage, AIMessage
+from graph import app_wanqing, app_xinjing, app_xingzhe, app_router, open_async_apps
+from compaction import maybe_compact, amaybe_compact
+import tracing
 from dotenv import load_dotenv
 
 load_dotenv()
 
 def main():
+    # --async runs the graph on the asyncio variant (ainvoke nodes + AsyncSqliteSaver)
+    use_async = "--async" in sys.argv
+    argv = [arg for arg in sys.argv if arg != "--async"]
+
     print("Elderly Care Agents Initialized. Type 'quit' to exit.")
     print("Note: Ensure you have set OPENAI_API_KEY and OPENAI_API_BASE in .env")
     print("------------------------------------------------")
@@ -25,9 +32,9 @@ def main():
 
     # Ask for name to establish long-term memory
     user_name = ""
-    # sys.argv[1] is now user_name (since agent_choice is fixed)
-    if len(sys.argv) > 1:
-        user_name = sys.argv[1]
+    # argv[1] is now user_name (since agent_choice is fixed)
+    if len(argv) > 1:
+        user_name = argv[1]
         
     if not user_name:
         user_name = input("请输入老人的名字 (这将用于加载专属记忆): ").strip()
@@ -46,18 +53,44 @@ def main():
     config = {"configurable": {"thread_id": thread_id}}
     
     initial_message = ""
-    # sys.argv[2] is now initial_message
-    if len(sys.argv) > 2:
-        initial_message = sys.argv[2]
+    # argv[2] is now initial_message
+    if len(argv) > 2:
+        initial_message = argv[2]
         print(f"User (Auto): {initial_message}")
 
+    if use_async:
+        asyncio.run(chat_loop_async(config, initial_message))
+    else:
+        chat_loop(app, config, initial_message)
+
+def print_update(event):
+    for key, value in event.items():
+        # With SPECULATIVE_ROUTING a hit is answered by the router node itself
+        if key == "router" and value and value["messages"] and isinstance(value["messages"][-1], AIMessage):
+            key = value["next"]
+        if key in ["wan_qing", "xin_jing", "xing_zhe"]:
+            last_msg = value["messages"][-1]
+            
+            speaker = "晚晴"
+            if key == "xin_jing":
+                speaker = "心镜"
+            elif key == "xing_zhe":
+                speaker = "行者"
+                
+            print(f"\n{speaker}: {last_msg.content}")
+            print("------------------------------------------------")
+
+def read_input(initial_message):
+    if initial_message:
+        return initial_message
+    return input("User: ")
+
+def chat_loop(app, config, initial_message):
+
     while True:
         try:
-            if initial_message:
-                user_input = initial_message
-                initial_message = "" # Clear after first use
-            else:
-                user_input = input("User: ")
+            user_input = read_input(initial_message)
+            initial_message = "" # Clear after first use
                 
             if user_input.lower() in ["quit", "exit"]:
                 break
@@ -74,24 +107,46 @@ def main():
             
             # Stream the graph execution
             # We look for the final output from the agent
-            for event in app.stream(inputs, config=config):
-                for key, value in event.items():
-                    if key in ["wan_qing", "xin_jing", "xing_zhe"]:
-                        last_msg = value["messages"][-1]
-                        
-                        speaker = "晚晴"
-                        if key == "xin_jing":
-                            speaker = "心镜"
-                        elif key == "xing_zhe":
-                            speaker = "行者"
-                            
-                        print(f"\n{speaker}: {last_msg.content}")
-                        print("------------------------------------------------")
+            with tracing.span("turn", thread_id=config["configurable"]["thread_id"], input_chars=len(user_input)):
+                for event in app.stream(inputs, config=config):
+                    print_update(event)
+
+            # Keep the stored thread bounded (summary + recent messages)
+            maybe_compact(app, config)
                         
         except KeyboardInterrupt:
             break
         except Exception as e:
             print(f"\nAn error occurred: {e}")
 
+async def chat_loop_async(config, initial_message):
+    async with open_async_apps() as apps:
+        app = apps["router"]
+        while True:
+            try:
+                # input() blocks, keep it off the event loop
+                user_input = await asyncio.to_thread(read_input, initial_message)
+                initial_message = ""
+
+                if user_input.lower() in ["quit", "exit"]:
+                    break
+
+                if not user_input.strip():
+                    continue
+
+                inputs = {"messages": [HumanMessage(content=user_input)]}
+                print("Router Agent is thinking...", end="\r")
+
+                with tracing.span("turn", thread_id=config["configurable"]["thread_id"], input_chars=len(user_input)):
+                    async for event in app.astream(inputs, config=config):
+                        print_update(event)
+
+                await amaybe_compact(app, config)
+
+            except KeyboardInterrupt:
+                break
+            except Exception as e:
+                print(f"\nAn error occurred: {e}")
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,81 @@
+import time
+import threading
+from contextlib import contextmanager
+from collections import defaultdict, deque
+
+# Process-wide counters shared by the graph nodes and the UI.
+# Streamlit reruns re-execute web_app.py but imported modules stay loaded,
+# so these counters accumulate across all sessions of one server process.
+_lock = threading.Lock()
+_counters = defaultdict(int)
+# Latency samples (seconds) per timer, newest last; bounded so a long-running server
+# reports on its recent traffic
+TIMER_SAMPLES = 10000
+_timers = defaultdict(lambda: deque(maxlen=TIMER_SAMPLES))
+
+def incr(name, value=1):
+    with _lock:
+        _counters[name] += value
+
+def get(name):
+    with _lock:
+        return _counters.get(name, 0)
+
+def rate(hit_name, miss_name):
+    """Return hit / (hit + miss), or None if nothing was counted yet."""
+    with _lock:
+        hits = _counters.get(hit_name, 0)
+        misses = _counters.get(miss_name, 0)
+    if hits + misses == 0:
+        return None
+    return hits / (hits + misses)
+
+def observe(name, seconds):
+    with _lock:
+        _timers[name].append(seconds)
+
+@contextmanager
+def timer(name):
+    """Record the duration of the with-block under `name`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+def percentile(samples, p):
+    """p-th percentile (0-100) of a list of samples, nearest rank."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+def timer_stats(name):
+    """count / mean / p50 / p95 / p99 / max of a timer in seconds, or None if never observed."""
+    with _lock:
+        samples = list(_timers.get(name, ()))
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "p50": percentile(ordered, 50),
+        "p95": percentile(ordered, 95),
+        "p99": percentile(ordered, 99),
+        "max": ordered[-1]
+    }
+
+def timers_snapshot():
+    with _lock:
+        names = sorted(_timers)
+    return {name: timer_stats(name) for name in names}
+
+def snapshot():
+    with _lock:
+        return dict(sorted(_counters.items()))
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _timers.clear()
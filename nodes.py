@@ -1,11 +1,27 @@
 import os
 import re
 import json
-from langchain_openai import ChatOpenAI
+import time
+import random
+import asyncio
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+from langchain_core.runnables import RunnableConfig
 from state import AgentState
-from prompts import WAN_QING_SYSTEM_PROMPT, XIN_JING_SYSTEM_PROMPT, XING_ZHE_SYSTEM_PROMPT, ROUTER_SYSTEM_PROMPT
+from prompts import WAN_QING_SYSTEM_PROMPT, XIN_JING_SYSTEM_PROMPT, XING_ZHE_SYSTEM_PROMPT
 from dotenv import load_dotenv
+import metrics
+import intent_classifier
+import prompt_cache
+import long_term_memory
+import retrieval
+import tracing
+import response_cache
+import router_cache
+import llm_client
 
 load_dotenv()
 
@@ -13,61 +29,216 @@ load_dotenv()
 # Using ChatOpenAI compatible client for Doubao (Volcengine)
 # The user needs to set OPENAI_API_KEY and OPENAI_API_BASE in .env
 # Defaulting to Volcengine endpoint if not set, but key is required.
-llm = ChatOpenAI(
+# Pooled keep-alive transport, timeouts and retries come from llm_client.py
+llm = llm_client.chat_model(
     model=os.getenv("MODEL_NAME", "doubao-pro-32k"),
     temperature=0.7,
     openai_api_base=os.getenv("OPENAI_API_BASE", "https://ark.cn-beijing.volces.com/api/v3"),
     openai_api_key=os.getenv("OPENAI_API_KEY"),
+    # Ask for usage on streamed replies too, so cached prompt tokens can be tracked
+    stream_usage=True,
 )
 
+# How the LLM router returns its decision:
+#   "function_calling" / "json_schema" / "json_mode" - schema-constrained output with only the
+#       fields the graph uses (ROUTER_SCHEMA), prompted by ROUTER_STRUCTURED_SYSTEM_PROMPT
+#   "text" - the original free-form JSON reply to ROUTER_SYSTEM_PROMPT, parsed by hand
+ROUTER_OUTPUT_MODE = os.getenv("ROUTER_OUTPUT_MODE", "function_calling")
+
+# Which router prompt to use:
+#   "compact" - ROUTER_COMPACT_SYSTEM_PROMPT, generated from the agent descriptors in prompts.py
+#   "full"    - the full theory prompt (ROUTER_SYSTEM_PROMPT / ROUTER_STRUCTURED_SYSTEM_PROMPT)
+#   "tiered"  - compact first, the full prompt only for ambiguous turns (see is_ambiguous)
+ROUTER_PROMPT = os.getenv("ROUTER_PROMPT", "tiered")
+
+ROUTER_SCHEMA = {
+    "title": "route_decision",
+    "description": "把老人的这句话分发给最合适的Agent",
+    "type": "object",
+    "properties": {
+        "分发目标": {"type": "string", "enum": ["晚晴", "心镜", "行者"]},
+        "建议话术": {"type": "string", "description": "给下游Agent的开场建议（一句话）"},
+        "决策依据": {"type": "string", "description": "引用了哪条规则（15字内，可省略）"},
+        "置信度": {"type": "string", "enum": ["高", "中", "低"]}
+    },
+    "required": ["分发目标", "建议话术"]
+}
+
+# Fraction of locally routed turns re-checked by the LLM router in the background
+LOCAL_ROUTER_AUDIT_RATE = float(os.getenv("LOCAL_ROUTER_AUDIT_RATE", "0.1"))
+# Audits waiting for the single audit worker; when the backlog is full new audits are dropped
+LOCAL_ROUTER_AUDIT_QUEUE = int(os.getenv("LOCAL_ROUTER_AUDIT_QUEUE", "16"))
+_audit_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="router-audit")
+_audit_slots = threading.BoundedSemaphore(max(LOCAL_ROUTER_AUDIT_QUEUE, 1))
+
+# Number of cleaned messages (User + AI pairs = 10 turns) the models get to see
+HISTORY_WINDOW = 20
+
+# Older turns rolled up by compaction.py live in one SystemMessage at the start of the thread
+MEMORY_SUMMARY_PREFIX = "【较早对话摘要】"
+
+THOUGHT_PATTERNS = [
+    re.compile(r'<inner_thought>.*?</inner_thought>', re.DOTALL),
+    re.compile(r'<inner_monologue>.*?</inner_monologue>', re.DOTALL)
+]
+
+# Cleaned form of each message, keyed by (message id, content length). Messages in the
+# checkpoint never change once written, so each one is cleaned only once per process.
+_DROPPED = object()
+_CLEAN_CACHE_SIZE = int(os.getenv("CLEAN_CACHE_SIZE", "20000"))
+_clean_cache = OrderedDict()
+# Last windows handed out, keyed by the id of their newest message: the router and the
+# agent of one turn see the same window (the router's own SystemMessage is dropped).
+_window_cache = OrderedDict()
+_clean_lock = threading.Lock()
+
+def clean_message(msg):
+    """
+    Cleaned form of one message, or None if it should not be shown to the model:
+    1. Router's internal SystemMessages (ROUTER_JSON_START) are dropped
+    2. <inner_thought> and <inner_monologue> blocks are removed from AIMessages
+    """
+    # 1. Skip Router internal messages
+    if isinstance(msg, SystemMessage) and "ROUTER_JSON_START" in str(msg.content):
+        return None
+
+    # 2. Clean AIMessages
+    if isinstance(msg, AIMessage):
+        content = msg.content
+        for pattern in THOUGHT_PATTERNS:
+            content = pattern.sub('', content)
+        
+        content = content.strip()
+        # If empty after cleaning (e.g. only had thought), skip it to avoid confusing the model
+        if not content:
+            return None
+            
+        return AIMessage(content=content)
+    return msg
+
+def is_memory_summary(msg):
+    return isinstance(msg, SystemMessage) and str(msg.content).startswith(MEMORY_SUMMARY_PREFIX)
+
+def _cached_clean(msg):
+    if not msg.id:
+        return clean_message(msg)
+    key = (msg.id, len(str(msg.content)))
+    with _clean_lock:
+        cleaned = _clean_cache.get(key)
+        if cleaned is not None:
+            _clean_cache.move_to_end(key)
+            return None if cleaned is _DROPPED else cleaned
+    cleaned = clean_message(msg)
+    with _clean_lock:
+        _clean_cache[key] = _DROPPED if cleaned is None else cleaned
+        if len(_clean_cache) > _CLEAN_CACHE_SIZE:
+            _clean_cache.popitem(last=False)
+    return cleaned
+
 def clean_history(messages):
     """
     Clean the message history for context consistency:
     1. Remove Router's internal SystemMessages (ROUTER_JSON_START)
     2. Remove <inner_thought> and <inner_monologue> blocks from AIMessages
     3. Keep only the last 20 messages (approx 10 turns) to focus on recent context
+
+    Scans from the end and stops once the window is full, so the cost per turn
+    does not grow with the thread's total history. A compaction summary at the start
+    of the thread is always kept in front of the window.
     """
+    with tracing.span("clean_history", messages=len(messages)) as span:
+        cleaned = _clean_history(messages)
+        span.set("window", len(cleaned))
+        return cleaned
+
+def _clean_history(messages):
     cleaned = []
+    newest_key = None
+    summary = messages[0] if messages and is_memory_summary(messages[0]) else None
+    for msg in reversed(messages):
+        if msg is summary:
+            break
+        item = _cached_clean(msg)
+        if item is None:
+            continue
+        if newest_key is None and msg.id:
+            newest_key = (msg.id, len(messages))
+            with _clean_lock:
+                window = _window_cache.get(newest_key)
+            if window is not None:
+                return list(window)
+        cleaned.append(item)
+        # 3. We prioritize keeping the most recent interactions
+        if len(cleaned) >= HISTORY_WINDOW:
+            break
+    cleaned.reverse()
+    if summary is not None:
+        cleaned.insert(0, summary)
+
+    if newest_key is not None:
+        with _clean_lock:
+            _window_cache[newest_key] = cleaned
+            # The agent of the same turn sees this list plus the router's (dropped) SystemMessage
+            _window_cache[(newest_key[0], newest_key[1] + 1)] = cleaned
+            while len(_window_cache) > 256:
+                _window_cache.popitem(last=False)
+    return list(cleaned)
+
+def evicted_messages(messages):
+    """(id, cleaned message) pairs of the thread that have fallen out of clean_history's window."""
+    if len(messages) <= HISTORY_WINDOW:
+        return []
+    kept = []
     for msg in messages:
-        # 1. Skip Router internal messages
-        if isinstance(msg, SystemMessage) and "ROUTER_JSON_START" in str(msg.content):
+        if is_memory_summary(msg):
             continue
-            
-        # 2. Clean AIMessages
-        if isinstance(msg, AIMessage):
-            content = msg.content
-            # Remove <inner_thought>
-            content = re.sub(r'<inner_thought>.*?</inner_thought>', '', content, flags=re.DOTALL)
-            # Remove <inner_monologue>
-            content = re.sub(r'<inner_monologue>.*?</inner_monologue>', '', content, flags=re.DOTALL)
-            
-            content = content.strip()
-            # If empty after cleaning (e.g. only had thought), skip it to avoid confusing the model
-            if not content:
-                continue 
-                
-            cleaned.append(AIMessage(content=content))
-        else:
-            cleaned.append(msg)
-            
-    # 3. Slice to keep last 20 messages (User + AI pairs = 10 turns)
-    # We prioritize keeping the most recent interactions
-    if len(cleaned) > 20:
-        cleaned = cleaned[-20:]
-        
-    return cleaned
+        item = _cached_clean(msg)
+        if item is not None and msg.id:
+            kept.append((msg.id, item))
+    return kept[:-HISTORY_WINDOW]
 
-def router_node(state: AgentState):
-    messages = state["messages"]
-    
-    # Use clean history for context so Router sees the conversation flow
-    clean_msgs = clean_history(messages)
-    
-    # Construct the input for the router
-    router_input = [SystemMessage(content=ROUTER_SYSTEM_PROMPT)] + clean_msgs
-    
-    response = llm.invoke(router_input)
-    content = response.content.strip()
+AGENT_NAMES = {
+    "wan_qing": "晚晴",
+    "xin_jing": "心镜",
+    "xing_zhe": "行者"
+}
+
+# 建议话术 of a local routing decision, which has no LLM to write one
+LOCAL_SUGGESTIONS = {
+    "wan_qing": "先接住老人的感受，顺着他说的现实回应，不纠正",
+    "xin_jing": "顺着老人的话往下聊，问一个开放的美丽问题",
+    "xing_zhe": "请老人给出建议或讲讲经验，让他感到被需要"
+}
+
+def router_update(analysis, target):
+    """Graph update for a routing decision; the analysis JSON rides along for the UI."""
+    analysis_json_str = json.dumps(analysis, ensure_ascii=False)
+    return {"messages": [SystemMessage(content=f"ROUTER_JSON_START{analysis_json_str}ROUTER_JSON_END\nRouter Decision: {target}. Suggestion: {analysis.get('建议话术')}")], "next": target}
+
+def normalize_target(name):
+    """Map an agent display name from the router to its node name (晚晴 when unknown)."""
+    if "晚晴" in name:
+        return "wan_qing"
+    elif "心镜" in name:
+        return "xin_jing"
+    elif "行者" in name:
+        return "xing_zhe"
+    return "wan_qing" # Default fallback
+
+def log_route(analysis):
+    span = tracing.current()
+    span.set("target", str(analysis.get("分发目标", "")))
+    span.set("confidence", str(analysis.get("置信度", "")))
+    print("\n[Router Analysis JSON]")
+    print(json.dumps(analysis, ensure_ascii=False, indent=2))
+    print("-" * 40)
+
+def parse_route(content):
+    """
+    Parse the LLM router's reply.
+    Returns (analysis, target) or None if the reply could not be parsed.
+    """
+    content = content.strip()
     
     # Clean up markdown code blocks if present
     if content.startswith("```json"):
@@ -87,43 +258,434 @@ def router_node(state: AgentState):
             target = analysis.get("分发决策", {}).get("目标Agent", "晚晴")
             
         # Normalize target name
-        if "晚晴" in target:
-            target = "wan_qing"
-        elif "心镜" in target:
-            target = "xin_jing"
-        elif "行者" in target:
-            target = "xing_zhe"
-        else:
-            target = "wan_qing" # Default fallback
+        target = normalize_target(target)
             
-        print("\n[Router Analysis JSON]")
-        print(json.dumps(analysis, ensure_ascii=False, indent=2))
-        print("-" * 40)
-        
-        # Pass the analysis JSON string in the SystemMessage so the UI can extract it
-        analysis_json_str = json.dumps(analysis, ensure_ascii=False)
-        return {"messages": [SystemMessage(content=f"ROUTER_JSON_START{analysis_json_str}ROUTER_JSON_END\nRouter Decision: {target}. Suggestion: {analysis.get('建议话术')}")], "next": target}
+        log_route(analysis)
+        return analysis, target
     except Exception as e:
         print(f"Router parsing error: {e}")
+        metrics.incr("router.parse_failure")
+        return None
+
+def structured_router(model):
+    return model.with_structured_output(ROUTER_SCHEMA, method=ROUTER_OUTPUT_MODE, include_raw=True)
+
+def parse_structured_route(response):
+    """
+    Decision from a structured router call ({"raw", "parsed", "parsing_error"}).
+    Falls back to parsing the raw text if the provider ignored the schema.
+    """
+    parsed = response.get("parsed")
+    if isinstance(parsed, dict) and parsed.get("分发目标"):
+        metrics.incr("router.structured")
+        log_route(parsed)
+        return parsed, normalize_target(parsed["分发目标"])
+
+    raw = response.get("raw")
+    if raw is not None and str(raw.content).strip():
+        metrics.incr("router.structured_fallback")
+        return parse_route(str(raw.content))
+    print(f"Router structured output error: {response.get('parsing_error')}")
+    metrics.incr("router.parse_failure")
+    return None
+
+def full_router_prompt():
+    return "router" if ROUTER_OUTPUT_MODE == "text" else "router_structured"
+
+def is_ambiguous(decision, messages):
+    """
+    Whether a compact-prompt decision should be re-checked with the full prompt:
+    no usable decision, the router itself is unsure, or the keyword classifier saw
+    signals for several agents and prefers a different one.
+    """
+    if not decision:
+        return True
+    analysis, target = decision
+    if analysis.get("置信度") == "低":
+        return True
+    guess = intent_classifier.classify(messages)
+    if not guess or not guess["target"]:
+        return False
+    mixed = sum(1 for score in guess["scores"].values() if score) > 1
+    return mixed and guess["target"] != target
+
+def route_with(name, clean_msgs):
+    # Static router prompt first (byte-stable for prefix caching), then the conversation
+    if ROUTER_OUTPUT_MODE == "text":
+        response = prompt_cache.invoke(llm, name, clean_msgs)
+        return parse_route(response.content)
+    response = prompt_cache.invoke(llm, name, clean_msgs, bind=structured_router)
+    return parse_structured_route(response)
+
+async def aroute_with(name, clean_msgs):
+    if ROUTER_OUTPUT_MODE == "text":
+        response = await prompt_cache.ainvoke(llm, name, clean_msgs)
+        return parse_route(response.content)
+    response = await prompt_cache.ainvoke(llm, name, clean_msgs, bind=structured_router)
+    return parse_structured_route(response)
+
+# Settings that change what the LLM router decides, part of every router_cache key
+ROUTER_CACHE_SCOPE = f"{llm.model_name}|{ROUTER_PROMPT}|{ROUTER_OUTPUT_MODE}"
+
+def cached_route(clean_msgs):
+    """(cache key, memoized decision or None) for this exact routing input, see router_cache.py."""
+    key = router_cache.key(clean_msgs, ROUTER_CACHE_SCOPE)
+    decision = router_cache.get(key)
+    if decision:
+        tracing.current().set("source", "router_cache")
+    return key, decision
+
+def llm_route(messages):
+    # Use clean history for context so Router sees the conversation flow
+    clean_msgs = clean_history(messages)
+    key, decision = cached_route(clean_msgs)
+    if decision:
+        return decision
+    decision = _llm_route(messages, clean_msgs)
+    router_cache.put(key, decision)
+    return decision
+
+def _llm_route(messages, clean_msgs):
+    if ROUTER_PROMPT == "full":
+        return route_with(full_router_prompt(), clean_msgs)
+
+    decision = route_with("router_compact", clean_msgs)
+    if ROUTER_PROMPT == "tiered" and is_ambiguous(decision, messages):
+        metrics.incr("router.escalated")
+        return route_with(full_router_prompt(), clean_msgs) or decision
+    metrics.incr("router.compact")
+    return decision
+
+async def allm_route(messages):
+    clean_msgs = clean_history(messages)
+    key, decision = cached_route(clean_msgs)
+    if decision:
+        return decision
+    decision = await _allm_route(messages, clean_msgs)
+    router_cache.put(key, decision)
+    return decision
+
+async def _allm_route(messages, clean_msgs):
+    if ROUTER_PROMPT == "full":
+        return await aroute_with(full_router_prompt(), clean_msgs)
+
+    decision = await aroute_with("router_compact", clean_msgs)
+    if ROUTER_PROMPT == "tiered" and is_ambiguous(decision, messages):
+        metrics.incr("router.escalated")
+        return await aroute_with(full_router_prompt(), clean_msgs) or decision
+    metrics.incr("router.compact")
+    return decision
+
+def record_agreement(guess, target):
+    """Track how often the local classifier agrees with the LLM router."""
+    if not guess or not guess["target"]:
+        return
+    prefix = "local_router.confident" if guess["confident"] else "local_router.unsure"
+    metrics.incr(f"{prefix}.agree" if guess["target"] == target else f"{prefix}.disagree")
+
+def audit_local_route(messages, guess):
+    # Runs off the critical path on a sample of locally routed turns
+    try:
+        decision = llm_route(messages)
+        if decision:
+            record_agreement(guess, decision[1])
+    except Exception as e:
+        print(f"Local router audit error: {e}")
+    finally:
+        _audit_slots.release()
+
+def schedule_audit(messages, guess):
+    """Queue a background audit unless the audit backlog is full; under load audits are dropped."""
+    if not _audit_slots.acquire(blocking=False):
+        metrics.incr("local_router.audit_dropped")
+        return
+    _audit_pool.submit(audit_local_route, messages, guess)
+
+def confidence_level(confidence):
+    """Map the classifier's 0..1 confidence onto the router's 高/中/低."""
+    if confidence >= 0.9:
+        return "高"
+    if confidence >= intent_classifier.LOCAL_ROUTER_THRESHOLD:
+        return "中"
+    return "低"
+
+def local_route(messages):
+    """
+    Local keyword tier: clear-cut turns never reach the LLM router.
+    Returns (update, guess); update is None when the LLM router has to decide.
+    """
+    if intent_classifier.LOCAL_ROUTER_MODE == "off":
+        return None, None
+
+    guess = intent_classifier.classify(messages)
+    if intent_classifier.LOCAL_ROUTER_MODE != "on":
+        return None, guess
+
+    if guess and guess["confident"]:
+        metrics.incr("local_router.hit")
+        if random.random() < LOCAL_ROUTER_AUDIT_RATE:
+            schedule_audit(messages, guess)
+        span = tracing.current()
+        span.set("local_confidence", round(guess["confidence"], 2))
+        span.set("matched", "、".join(guess["matched"]))
+        # Same fields as an LLM router decision (ROUTER_SCHEMA)
+        analysis = {
+            "分发目标": AGENT_NAMES[guess["target"]],
+            "建议话术": LOCAL_SUGGESTIONS[guess["target"]],
+            "决策依据": "本地关键词分类",
+            "置信度": confidence_level(guess["confidence"])
+        }
+        return router_update(analysis, guess["target"]), guess
+
+    metrics.incr("local_router.fallback")
+    return None, guess
+
+def finish_route(decision, guess):
+    if not decision:
         return {"messages": [], "next": "wan_qing"} # Fallback to safety
 
-def wan_qing_node(state: AgentState):
+    analysis, target = decision
+    record_agreement(guess, target)
+    return router_update(analysis, target)
+
+def cached_reply(state: AgentState, config):
+    """
+    RESPONSE_CACHE=serve: a repeat of an utterance the current agent already answered gets
+    the stored reply, as a router update that carries the reply (like a speculative hit).
+    """
+    if response_cache.RESPONSE_CACHE != "serve":
+        return None
+    thread_id, target = thread_id_of(config), state.get("next")
+    if not thread_id or target not in AGENT_NAMES:
+        return None
+    entry = response_cache.lookup(thread_id, target, state["messages"])
+    if entry is None:
+        return None
+    response_cache.record_served(entry)
+    analysis = {
+        "分发目标": AGENT_NAMES[target],
+        "决策依据": "重复话语，复用上次的回复",
+        "相似度": round(entry["similarity"], 2)
+    }
+    update = router_update(analysis, target)
+    return {"messages": update["messages"] + [AIMessage(content=entry["content"])], "next": target}
+
+def router_node(state: AgentState, config: RunnableConfig = None):
     messages = state["messages"]
-    clean_msgs = clean_history(messages)
-    full_messages = [SystemMessage(content=WAN_QING_SYSTEM_PROMPT)] + clean_msgs
-    response = llm.invoke(full_messages)
-    return {"messages": [response]}
+    with tracing.span("router") as span:
+        cached = cached_reply(state, config)
+        if cached:
+            span.set("source", "response_cache")
+            return cached
+        update, guess = local_route(messages)
+        if update:
+            span.set("source", "local")
+            return update
+        return finish_route(llm_route(messages), guess)
 
-def xin_jing_node(state: AgentState):
+async def arouter_node(state: AgentState, config: RunnableConfig = None):
     messages = state["messages"]
-    clean_msgs = clean_history(messages)
-    full_messages = [SystemMessage(content=XIN_JING_SYSTEM_PROMPT)] + clean_msgs
-    response = llm.invoke(full_messages)
-    return {"messages": [response]}
+    with tracing.span("router") as span:
+        cached = cached_reply(state, config)
+        if cached:
+            span.set("source", "response_cache")
+            return cached
+        update, guess = local_route(messages)
+        if update:
+            span.set("source", "local")
+            return update
+        return finish_route(await allm_route(messages), guess)
 
-def xing_zhe_node(state: AgentState):
+AGENT_PROMPTS = {
+    "wan_qing": WAN_QING_SYSTEM_PROMPT,
+    "xin_jing": XIN_JING_SYSTEM_PROMPT,
+    "xing_zhe": XING_ZHE_SYSTEM_PROMPT
+}
+
+# Speculative agent calls run with their own (empty) callbacks so a speculative answer
+# is never streamed to the UI before the router has confirmed it.
+DETACHED_CONFIG = {"callbacks": []}
+
+def thread_id_of(config):
+    return ((config or {}).get("configurable") or {}).get("thread_id")
+
+def agent_context(state: AgentState, thread_id, agent=None):
+    """
+    Window the agent sees: the long-term memory block, past utterances retrieved for the
+    current message (if any), a cached earlier reply in RESPONSE_CACHE=draft mode and the
+    cleaned history.
+    """
     messages = state["messages"]
     clean_msgs = clean_history(messages)
-    full_messages = [SystemMessage(content=XING_ZHE_SYSTEM_PROMPT)] + clean_msgs
-    response = llm.invoke(full_messages)
+    if not thread_id:
+        return clean_msgs
+    blocks = []
+    if long_term_memory.LONG_TERM_MEMORY:
+        blocks.append(long_term_memory.memory_block(thread_id))
+    if retrieval.RETRIEVAL:
+        query = next((m for m in reversed(messages) if isinstance(m, HumanMessage)), None)
+        if query is not None:
+            # Messages still in the window are already visible, don't retrieve them twice
+            visible = [m.id for m in clean_msgs if m.id]
+            blocks.append(retrieval.memory_block(thread_id, str(query.content), visible))
+    if agent:
+        blocks.append(response_cache.draft_block(thread_id, agent, messages))
+    # Right after the static prompt, so the cached prefix stays intact
+    return [block for block in blocks if block is not None] + clean_msgs
+
+def commit_reply(agent, state: AgentState, thread_id, response, seconds):
+    """
+    Side effects of a reply the elder actually gets: background memory update and
+    indexing for this turn, and the reply cache. Not run for a discarded speculative reply.
+    """
+    if not thread_id:
+        return
+    messages = state["messages"]
+    if long_term_memory.LONG_TERM_MEMORY:
+        long_term_memory.schedule_update(llm, thread_id, evicted_messages(messages))
+    if retrieval.RETRIEVAL:
+        retrieval.schedule_index(thread_id, messages)
+    response_cache.store(thread_id, agent, messages, response.content, seconds)
+
+def run_agent(agent, state: AgentState, config=None, thread_id=None, commit=True):
+    """The agent's reply; commit=False leaves commit_reply() to the caller."""
+    thread_id = thread_id or thread_id_of(config)
+    with tracing.span("agent", agent=agent):
+        start = time.perf_counter()
+        clean_msgs = agent_context(state, thread_id, agent)
+        response = prompt_cache.invoke(llm, agent, clean_msgs, config=config)
+        if commit:
+            commit_reply(agent, state, thread_id, response, time.perf_counter() - start)
+        return response
+
+async def arun_agent(agent, state: AgentState, config=None, thread_id=None, commit=True):
+    thread_id = thread_id or thread_id_of(config)
+    with tracing.span("agent", agent=agent):
+        start = time.perf_counter()
+        clean_msgs = agent_context(state, thread_id, agent)
+        response = await prompt_cache.ainvoke(llm, agent, clean_msgs, config=config)
+        if commit:
+            commit_reply(agent, state, thread_id, response, time.perf_counter() - start)
+        return response
+
+def wan_qing_node(state: AgentState, config: RunnableConfig):
+    response = run_agent("wan_qing", state, config)
+    return {"messages": [response]}
+
+def xin_jing_node(state: AgentState, config: RunnableConfig):
+    response = run_agent("xin_jing", state, config)
+    return {"messages": [response]}
+
+def xing_zhe_node(state: AgentState, config: RunnableConfig):
+    response = run_agent("xing_zhe", state, config)
+    return {"messages": [response]}
+
+async def awan_qing_node(state: AgentState, config: RunnableConfig):
+    response = await arun_agent("wan_qing", state, config)
+    return {"messages": [response]}
+
+async def axin_jing_node(state: AgentState, config: RunnableConfig):
+    response = await arun_agent("xin_jing", state, config)
+    return {"messages": [response]}
+
+async def axing_zhe_node(state: AgentState, config: RunnableConfig):
+    response = await arun_agent("xing_zhe", state, config)
     return {"messages": [response]}
+
+# Speculative routing: run the agent the thread used last time in parallel with the router.
+_speculation_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("SPECULATIVE_WORKERS", "4")),
+    thread_name_prefix="speculative-agent"
+)
+
+def predict_agent(state: AgentState):
+    """Cheap guess for the next agent: most consecutive turns stay with the previous one."""
+    previous = state.get("next")
+    if previous in AGENT_PROMPTS:
+        return previous
+    # No history yet: take the local classifier's best guess, even if it is not confident
+    guess = intent_classifier.classify(state["messages"])
+    if guess and guess["target"]:
+        return guess["target"]
+    return None
+
+def speculate(agent, state: AgentState, thread_id):
+    """Uncommitted speculative reply and its duration."""
+    start = time.perf_counter()
+    response = run_agent(agent, state, DETACHED_CONFIG, thread_id, commit=False)
+    return response, time.perf_counter() - start
+
+async def aspeculate(agent, state: AgentState, thread_id):
+    start = time.perf_counter()
+    response = await arun_agent(agent, state, DETACHED_CONFIG, thread_id, commit=False)
+    return response, time.perf_counter() - start
+
+def speculation_result(decision, predicted, state, thread_id, result):
+    # Confirmed by the router: only now does the reply count
+    response, seconds = result
+    commit_reply(predicted, state, thread_id, response, seconds)
+    metrics.incr("speculative.hit")
+    return {"messages": decision["messages"] + [response], "next": predicted}
+
+def speculative_router_node(state: AgentState, config: RunnableConfig):
+    cached = cached_reply(state, config)
+    if cached:
+        # Nothing left to speculate on
+        return cached
+    predicted = predict_agent(state)
+    if not predicted:
+        # First turn of a thread, nothing to speculate on
+        metrics.incr("speculative.skipped")
+        return router_node(state)
+
+    thread_id = thread_id_of(config)
+    # Copy the context so the speculative agent's spans stay under this turn
+    future = _speculation_pool.submit(contextvars.copy_context().run, speculate, predicted, state, thread_id)
+    decision = router_node(state)
+
+    if decision["next"] == predicted:
+        try:
+            result = future.result()
+        except Exception as e:
+            # Speculation failed, let the graph run the agent normally
+            print(f"Speculative agent error: {e}")
+            metrics.incr("speculative.error")
+            return decision
+        return speculation_result(decision, predicted, state, thread_id, result)
+
+    # Router disagreed: drop the speculative call (cancelled if it has not started yet,
+    # otherwise its result is simply discarded since a blocking HTTP call can't be interrupted)
+    future.cancel()
+    metrics.incr("speculative.miss")
+    return decision
+
+async def aspeculative_router_node(state: AgentState, config: RunnableConfig):
+    cached = cached_reply(state, config)
+    if cached:
+        return cached
+    predicted = predict_agent(state)
+    if not predicted:
+        metrics.incr("speculative.skipped")
+        return await arouter_node(state)
+
+    thread_id = thread_id_of(config)
+    task = asyncio.create_task(aspeculate(predicted, state, thread_id))
+    try:
+        decision = await arouter_node(state)
+    except BaseException:
+        task.cancel()
+        raise
+
+    if decision["next"] == predicted:
+        try:
+            result = await task
+        except Exception as e:
+            print(f"Speculative agent error: {e}")
+            metrics.incr("speculative.error")
+            return decision
+        return speculation_result(decision, predicted, state, thread_id, result)
+
+    # Router disagreed: cancelling the task aborts the in-flight request
+    task.cancel()
+    metrics.incr("speculative.miss")
+    return decision
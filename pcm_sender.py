@@ -0,0 +1,74 @@
+import os
+import time
+import metrics
+import tracing
+
+# Upload of recorded PCM to the ASR service. The buffer is walked with a memoryview, so
+# no chunk is copied before it reaches the socket, and pacing is a token bucket instead of
+# a fixed sleep per chunk: the first ASR_SEND_BURST_SECONDS of audio go out at once, the
+# rest at ASR_SEND_SPEED times real time. ASR_SEND_SPEED=0 sends as fast as the socket takes it.
+ASR_CHUNK_BYTES = int(os.getenv("ASR_CHUNK_BYTES", "3200"))
+ASR_SEND_SPEED = float(os.getenv("ASR_SEND_SPEED", "20"))
+ASR_SEND_BURST_SECONDS = float(os.getenv("ASR_SEND_BURST_SECONDS", "4"))
+# 16 kHz, 16 bit, mono
+PCM_BYTES_PER_SECOND = 32000
+
+class TokenBucket:
+    """`rate` bytes per second with room for `burst` bytes; rate 0 means unlimited."""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.perf_counter()
+
+    def take(self, n):
+        """Blocks until `n` bytes may be sent; returns the seconds slept."""
+        if not self.rate:
+            return 0.0
+        now = time.perf_counter()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= n
+        if self.tokens >= 0:
+            return 0.0
+        wait = -self.tokens / self.rate
+        time.sleep(wait)
+        return wait
+
+def send_pcm(send, pcm, chunk_size=None, speed=None, burst_seconds=None):
+    """
+    Feeds `pcm` (bytes-like) to `send(chunk)` in chunk_size slices, paced by a token bucket.
+    Returns {bytes, chunks, seconds, paced_seconds, bytes_per_second, realtime_factor} and
+    puts the same numbers on the current span.
+    """
+    chunk_size = chunk_size or ASR_CHUNK_BYTES
+    speed = ASR_SEND_SPEED if speed is None else speed
+    burst_seconds = ASR_SEND_BURST_SECONDS if burst_seconds is None else burst_seconds
+    bucket = TokenBucket(speed * PCM_BYTES_PER_SECOND, max(chunk_size, burst_seconds * PCM_BYTES_PER_SECOND))
+
+    view = memoryview(pcm).cast("B")
+    chunks = 0
+    paced = 0.0
+    start = time.perf_counter()
+    for offset in range(0, len(view), chunk_size):
+        chunk = view[offset:offset + chunk_size]
+        paced += bucket.take(len(chunk))
+        send(chunk)
+        chunks += 1
+    seconds = time.perf_counter() - start
+
+    stats = {
+        "bytes": len(view),
+        "chunks": chunks,
+        "seconds": round(seconds, 4),
+        "paced_seconds": round(paced, 4),
+        "bytes_per_second": round(len(view) / seconds) if seconds > 0 else None,
+        # Seconds of audio uploaded per second of wall time
+        "realtime_factor": round(len(view) / PCM_BYTES_PER_SECOND / seconds, 1) if seconds > 0 else None
+    }
+    span = tracing.current()
+    for k, v in stats.items():
+        span.set(k, v)
+    metrics.incr("asr.upload.bytes", len(view))
+    metrics.observe("asr.upload.seconds", seconds)
+    return stats
@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from collections import deque
+from langchain_core.messages import SystemMessage
+from prompts import (WAN_QING_SYSTEM_PROMPT, XIN_JING_SYSTEM_PROMPT, XING_ZHE_SYSTEM_PROMPT, ROUTER_SYSTEM_PROMPT,
+                     ROUTER_STRUCTURED_SYSTEM_PROMPT, ROUTER_COMPACT_SYSTEM_PROMPT)
+import metrics
+import tracing
+import llm_client
+
+# Prompt prefix caching for the large static system prompts.
+# PROMPT_CACHE_MODE:
+#   "implicit"    - keep the prefix byte-stable so the provider's automatic prefix cache
+#                   (OpenAI-compatible prompt caching) can hit, and track cached tokens
+#   "ark_context" - register each prompt once with the Volcengine Ark context cache
+#                   (/context/create, mode=common_prefix) and only send the history
+#   "off"         - no tracking
+PROMPT_CACHE_MODE = os.getenv("PROMPT_CACHE_MODE", "implicit")
+PROMPT_CACHE_TTL = int(os.getenv("PROMPT_CACHE_TTL", "3600"))
+
+# One SystemMessage per prompt, built once at import. Every call reuses the exact same
+# content, and anything per-turn must be placed AFTER this prefix, never inside it.
+STATIC_PREFIXES = {
+    "router": SystemMessage(content=ROUTER_SYSTEM_PROMPT),
+    "router_structured": SystemMessage(content=ROUTER_STRUCTURED_SYSTEM_PROMPT),
+    "router_compact": SystemMessage(content=ROUTER_COMPACT_SYSTEM_PROMPT),
+    "wan_qing": SystemMessage(content=WAN_QING_SYSTEM_PROMPT),
+    "xin_jing": SystemMessage(content=XIN_JING_SYSTEM_PROMPT),
+    "xing_zhe": SystemMessage(content=XING_ZHE_SYSTEM_PROMPT)
+}
+
+# UTF-8 size of each static prefix, for the request_bytes of LLM spans
+PREFIX_BYTES = {name: len(message.content.encode("utf-8")) for name, message in STATIC_PREFIXES.items()}
+
+_recent_usage = deque(maxlen=200)
+
+def prefix_message(name):
+    return STATIC_PREFIXES[name]
+
+def record_usage(name, response):
+    """Record cached vs uncached prompt tokens for one LLM call."""
+    if isinstance(response, dict):
+        # Structured output with include_raw=True
+        response = response.get("raw")
+    usage = getattr(response, "usage_metadata", None)
+    if not usage:
+        metrics.incr(f"prompt_cache.{name}.no_usage")
+        return None
+    prompt_tokens = usage.get("input_tokens", 0)
+    cached_tokens = (usage.get("input_token_details") or {}).get("cache_read", 0) or 0
+    record = {
+        "prompt": name,
+        "prompt_tokens": prompt_tokens,
+        "cached_tokens": cached_tokens,
+        "uncached_tokens": prompt_tokens - cached_tokens,
+        "output_tokens": usage.get("output_tokens", 0),
+        "time": time.time()
+    }
+    _recent_usage.append(record)
+    metrics.incr(f"prompt_cache.{name}.calls")
+    metrics.incr("prompt_cache.prompt_tokens", prompt_tokens)
+    metrics.incr("prompt_cache.cached_tokens", cached_tokens)
+    return record
+
+def recent_usage():
+    return list(_recent_usage)
+
+def cached_ratio():
+    prompt_tokens = metrics.get("prompt_cache.prompt_tokens")
+    if not prompt_tokens:
+        return None
+    return metrics.get("prompt_cache.cached_tokens") / prompt_tokens
+
+class ArkContextCache:
+    """
+    Keeps one Ark context (common_prefix mode) per static prompt and refreshes it before it expires.
+    Chat calls then go to {base}/context/chat/completions with only the history.
+    """
+    def __init__(self, llm, ttl=PROMPT_CACHE_TTL):
+        self.base_url = llm.openai_api_base.rstrip("/")
+        self.api_key = llm.openai_api_key.get_secret_value() if llm.openai_api_key else ""
+        self.model = llm.model_name
+        self.ttl = ttl
+        self._contexts = {}
+        self._lock = threading.Lock()
+        self.llm = llm_client.chat_model(
+            model=llm.model_name,
+            temperature=llm.temperature,
+            openai_api_base=f"{self.base_url}/context",
+            openai_api_key=self.api_key,
+            stream_usage=True,
+        )
+
+    def _create(self, name):
+        response = llm_client.http_client().post(
+            f"{self.base_url}/context/create",
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            json={
+                "model": self.model,
+                "mode": "common_prefix",
+                "messages": [{"role": "system", "content": STATIC_PREFIXES[name].content}],
+                "ttl": self.ttl
+            },
+            timeout=30
+        )
+        response.raise_for_status()
+        metrics.incr("prompt_cache.ark_context.created")
+        return response.json()["id"]
+
+    def context_id(self, name):
+        with self._lock:
+            context_id, expires_at = self._contexts.get(name, (None, 0))
+            # Refresh a minute early so a call never races the expiry
+            if not context_id or time.time() > expires_at - 60:
+                context_id = self._create(name)
+                self._contexts[name] = (context_id, time.time() + self.ttl)
+            return context_id
+
+    def with_context(self, name, context_id=None):
+        """
+        Chat model bound to the context of `name`. The context id is a model field rather
+        than a call argument, so wrappers like with_structured_output keep it.
+        """
+        context_id = context_id or self.context_id(name)
+        return self.llm.model_copy(update={"extra_body": {"context_id": context_id}})
+
+    def invalidate(self, name):
+        with self._lock:
+            self._contexts.pop(name, None)
+
+_ark_cache = None
+_ark_lock = threading.Lock()
+
+def _get_ark_cache(llm):
+    global _ark_cache
+    with _ark_lock:
+        if _ark_cache is None:
+            _ark_cache = ArkContextCache(llm)
+        return _ark_cache
+
+def _bound(model, bind):
+    return bind(model) if bind else model
+
+def _content_bytes(messages):
+    return sum(len(str(m.content).encode("utf-8")) for m in messages)
+
+def _llm_span(name, history):
+    kind = "router" if name.startswith("router") else "agent"
+    return tracing.span(f"llm.{kind}", prompt=name, mode=PROMPT_CACHE_MODE,
+                        request_bytes=PREFIX_BYTES[name] + _content_bytes(history))
+
+def _trace_response(span, response, record):
+    raw = response.get("raw") if isinstance(response, dict) else response
+    if raw is not None:
+        payload = str(raw.content) + "".join(json.dumps(c.get("args", {}), ensure_ascii=False)
+                                             for c in getattr(raw, "tool_calls", None) or [])
+        span.set("response_bytes", len(payload.encode("utf-8")))
+    if record:
+        for key in ["prompt_tokens", "cached_tokens", "output_tokens"]:
+            span.set(key, record[key])
+
+def _call(model, messages, config):
+    if config is None:
+        # A single answer nobody streams (router): may be hedged, see llm_client.py
+        return llm_client.call(lambda: model.invoke(messages))
+    return model.invoke(messages, config=config)
+
+async def _acall(model, messages, config):
+    if config is None:
+        return await llm_client.acall(lambda: model.ainvoke(messages))
+    return await model.ainvoke(messages, config=config)
+
+def invoke(llm, name, history, config=None, bind=None):
+    """
+    Call the LLM with the static prompt `name` followed by `history`,
+    using the configured cache mode and recording prompt token usage.
+    `bind` wraps the chat model actually used (e.g. with structured output).
+    """
+    with _llm_span(name, history) as span:
+        if PROMPT_CACHE_MODE == "ark_context":
+            try:
+                ark_cache = _get_ark_cache(llm)
+                response = _call(_bound(ark_cache.with_context(name), bind), history, config)
+                _trace_response(span, response, record_usage(name, response))
+                return response
+            except Exception as e:
+                _ark_failed(name, e)
+
+        response = _call(_bound(llm, bind), [prefix_message(name)] + history, config)
+        _trace_response(span, response, record_usage(name, response) if PROMPT_CACHE_MODE != "off" else None)
+        return response
+
+async def ainvoke(llm, name, history, config=None, bind=None):
+    """Async variant of invoke()."""
+    with _llm_span(name, history) as span:
+        if PROMPT_CACHE_MODE == "ark_context":
+            try:
+                ark_cache = _get_ark_cache(llm)
+                # Context creation is a rare blocking HTTP call, keep it off the event loop
+                context_id = await asyncio.to_thread(ark_cache.context_id, name)
+                response = await _acall(_bound(ark_cache.with_context(name, context_id), bind), history, config)
+                _trace_response(span, response, record_usage(name, response))
+                return response
+            except Exception as e:
+                _ark_failed(name, e)
+
+        response = await _acall(_bound(llm, bind), [prefix_message(name)] + history, config)
+        _trace_response(span, response, record_usage(name, response) if PROMPT_CACHE_MODE != "off" else None)
+        return response
+
+def _ark_failed(name, error):
+    # Expired or unsupported context: drop it and fall back to the plain request
+    print(f"Ark context cache error ({name}): {error}")
+    metrics.incr("prompt_cache.ark_context.error")
+    if _ark_cache is not None:
+        _ark_cache.invalidate(name)
@@ -1,3 +1,5 @@
+import hashlib
+
 _ROUTER_SYSTEM_PROMPT_DEPRECATED = """
 # 老年对话意图分析与分发Agent提示词
 
@@ -738,6 +740,87 @@ IMPORTANT:
 - 严格遵循 <inner_thought> XML 格式。
 """
 
+# Routing knowledge as data: the 识别关键词 of both router prompts and the local keyword
+# classifier (intent_classifier.py) are generated from these descriptors.
+# "keywords" are phrases an elder actually says, matched literally by the classifier;
+# "signals" describe patterns only the LLM can judge and appear in the prompts only
+# (the classifier detects a repeated utterance itself); a category with only signals keeps
+# an empty keyword list so the groups stay in prompt order. "notes" annotate a keyword.
+ROUTER_AGENTS = [
+    {
+        "key": "wan_qing",
+        "name": "晚晴",
+        "role": "认可与接纳：进入老人的主观现实，容纳情绪，降低认知负荷，绝不纠正事实",
+        "scenarios": [
+            "时空混淆：要回家、找妈妈、不知道这是哪里",
+            "认知障碍症状：重复提问、幻觉、妄想、认不出亲人",
+            "强烈情绪：愤怒、恐慌、大哭、被抛弃感"
+        ],
+        "keywords": {
+            "混淆类": ["回家", "找妈妈", "这是哪里", "你是谁", "他们是谁"],
+            "重复类": [],
+            "情绪类": ["骂人", "生气", "害怕", "不安", "被抛弃"],
+            "症状类": ["糊涂", "忘记", "认不出", "看见了", "他们要害我"]
+        },
+        "signals": {
+            "重复类": ["反复问同一问题", "说同样的话"]
+        },
+        "notes": {"看见了": "幻觉", "他们要害我": "妄想"}
+    },
+    {
+        "key": "xin_jing",
+        "name": "心镜",
+        "role": "即兴共创：Yes And 接住老人的话，用开放的美丽问题一起回忆和想象",
+        "scenarios": [
+            "意识清晰，想要陪伴、聊天、被倾听",
+            "主动讲故事、回忆往事",
+            "表达孤独：没人说话、一个人太闷",
+            "谈论假设、梦想、想象"
+        ],
+        "keywords": {
+            "陪伴类": ["聊天", "说话", "陪我", "听我说"],
+            "回忆类": ["以前", "那时候", "记得", "想起来了"],
+            "孤独类": ["一个人", "没人", "寂寞", "闷"],
+            "想象类": ["如果", "假如", "梦见", "想象"],
+            "故事类": ["讲讲", "说说", "当年", "那个时候"]
+        }
+    },
+    {
+        "key": "xing_zhe",
+        "name": "行者",
+        "role": "叙事重构：把老人从被照顾者变成给建议的长者，激发被需要感",
+        "scenarios": [
+            "价值危机：我没用了、活着是累赘、不想活了",
+            "衰退故事：我老了、什么都做不了",
+            "寻求建议：健康、养生、生活上怎么办",
+            "无助感：不知道怎么办、没人需要我"
+        ],
+        "keywords": {
+            "无用类": ["没用", "不中用", "累赘", "拖累", "废人", "活够了"],
+            "消极类": ["想死", "不想活", "没意思", "没希望"],
+            "求助类": ["怎么办", "怎么做", "给个建议", "教教我"],
+            "健康类": ["养生", "锻炼", "吃什么好", "身体不舒服"],
+            "价值类": ["有用吗", "能干什么", "还能做什么", "没人需要", "没人要我", "没人爱听"]
+        }
+    }
+]
+
+def keyword_groups(agent):
+    """(category, [phrase, ...]) pairs of an agent's 识别关键词, in prompt order."""
+    notes = agent.get("notes", {})
+    groups = {category: [f"{word}（{notes[word]}）" if word in notes else word for word in words]
+              for category, words in agent["keywords"].items()}
+    for category, descriptions in agent.get("signals", {}).items():
+        groups.setdefault(category, []).extend(descriptions)
+    return list(groups.items())
+
+def _with_keywords(prompt, agents=ROUTER_AGENTS):
+    # Fills the {KEYWORDS:<key>} slots of the full router prompt
+    for agent in agents:
+        lines = "\n".join(f"- **{category}**：{'、'.join(words)}" for category, words in keyword_groups(agent))
+        prompt = prompt.replace(f"{{KEYWORDS:{agent['key']}}}", lines)
+    return prompt
+
 ROUTER_SYSTEM_PROMPT = """
 你是一个智能路由助手，负责分析老年用户的输入，并将其分发给最合适的专业Agent。
 你不需要直接回答用户的问题，而是输出一个JSON格式的决策分析。
@@ -773,10 +856,7 @@ ROUTER_SYSTEM_PROMPT = """
 - 认知障碍患者的非语言同步能显著降低焦虑，增加眼神接触时长
 
 **识别关键词**：
-- **混淆类**：回家、找妈妈、这是哪里、你是谁、他们是谁
-- **重复类**：反复问同一问题、说同样的话
-- **情绪类**：骂人、生气、害怕、不安、被抛弃
-- **症状类**：糊涂、忘记、认不出、看见了（幻觉）、他们要害我（妄想）
+{KEYWORDS:wan_qing}
 
 **禁忌操作**：
 - 纠正现实："你妈妈已经去世了"→ 立即终止对话，引发羞愧
@@ -828,11 +908,7 @@ ROUTER_SYSTEM_PROMPT = """
 - 对话者成为维持积极自我认同的"脚手架"
 
 **识别关键词**：
-- **陪伴类**：聊天、说话、陪我、听我说
-- **回忆类**：以前、那时候、记得、想起来了
-- **孤独类**：一个人、没人、寂寞、闷
-- **想象类**：如果、假如、梦见、想象
-- **故事类**：讲讲、说说、当年、那个时候
+{KEYWORDS:xin_jing}
 
 **成功标志**：
 - 对话像"搭积木"一样无限延展
@@ -884,11 +960,7 @@ ROUTER_SYSTEM_PROMPT = """
 - 恢复"长者智慧"模式，重建自我价值
 
 **识别关键词**：
-- **无用类**：没用、累赘、拖累、废人、活够了
-- **消极类**：想死、不想活、没意思、没希望
-- **求助类**：怎么办、怎么做、给个建议、教教我
-- **健康类**：养生、锻炼、吃什么好、身体不舒服
-- **价值类**：有用吗、能干什么、还能做什么
+{KEYWORDS:xing_zhe}
 
 **成功标志**：
 - 老人从"被照顾者"转变为"导师/智者"
@@ -1276,3 +1348,65 @@ ROUTER_SYSTEM_PROMPT = """
   "建议话术": "给下游Agent的开场建议（一句话）"
 }
 """
+
+# Router prompt for schema-constrained output (nodes.ROUTER_OUTPUT_MODE): same analysis
+# rules, but the model is asked only for the fields the graph consumes instead of the
+# verbose analysis and the long JSON examples.
+ROUTER_STRUCTURED_OUTPUT_FORMAT = """## 输出格式要求
+
+只输出分发决策，不要输出分析过程：
+- 分发目标：晚晴/心镜/行者（必填）
+- 建议话术：给下游Agent的开场建议，一句话（必填）
+- 决策依据：引用了哪条规则，15字内（选填）
+"""
+
+ROUTER_SYSTEM_PROMPT = _with_keywords(ROUTER_SYSTEM_PROMPT)
+
+# SHA-1 of the generated full router prompt. Editing ROUTER_AGENTS changes the default-path
+# prompt (and every cached prefix of it); update the digest only for an intended change.
+ROUTER_SYSTEM_PROMPT_SHA1 = "736a6b4246b73cc3e46a6ba251e2ed9b505df950"
+assert hashlib.sha1(ROUTER_SYSTEM_PROMPT.encode("utf-8")).hexdigest() == ROUTER_SYSTEM_PROMPT_SHA1, \
+    "ROUTER_SYSTEM_PROMPT differs from its pinned text, see ROUTER_SYSTEM_PROMPT_SHA1"
+
+ROUTER_STRUCTURED_SYSTEM_PROMPT = ROUTER_SYSTEM_PROMPT.split("## 输出格式要求")[0] + ROUTER_STRUCTURED_OUTPUT_FORMAT
+
+# In priority order, condensed from the 路由决策规则 of ROUTER_SYSTEM_PROMPT
+ROUTER_RULES = [
+    "认知障碍症状或情绪风暴（恐慌、愤怒、妄想）→ 晚晴，最高优先",
+    "存在价值危机（没用、累赘、想死）或明确求助 → 行者",
+    "意识清晰地寻求陪伴、讲故事、表达孤独或想象 → 心镜",
+    "认知混淆 + 价值危机 → 晚晴；讲故事 + 自我贬低 → 行者；清晰意识 + 轻微消极 → 心镜",
+    "健康咨询：语气恐慌、反复问 → 晚晴；平静描述 → 心镜；明确求助 → 行者",
+    "沉默或单字回应 → 心镜"
+]
+
+ROUTER_COMPACT_OUTPUT_FORMAT = """## 输出格式要求
+
+只输出一个JSON对象，不要输出分析过程：
+- 分发目标：晚晴/心镜/行者（必填）
+- 建议话术：给下游Agent的开场建议，一句话（必填）
+- 置信度：高/中/低，信号混杂或拿不准时填“低”（必填）
+例如：{"分发目标": "心镜", "建议话术": "您说的那棵槐树，夏天是不是特别凉快？", "置信度": "高"}
+"""
+
+def build_router_prompt(agents=ROUTER_AGENTS, rules=ROUTER_RULES, output_format=ROUTER_COMPACT_OUTPUT_FORMAT):
+    """Compact routing prompt generated from the agent descriptors."""
+    lines = [
+        "你是一个路由助手，只负责把老年用户最新的一句话分发给最合适的Agent，不直接回答用户。",
+        "",
+        "## 下游Agent"
+    ]
+    for agent in agents:
+        lines.append(f"### {agent['name']}")
+        lines.append(f"职责：{agent['role']}")
+        lines.append(f"适用场景：{'；'.join(agent['scenarios'])}")
+        keywords = "；".join(f"{category}：{'、'.join(words)}" for category, words in keyword_groups(agent))
+        lines.append(f"识别关键词：{keywords}")
+        lines.append("")
+    lines.append("## 路由规则（按顺序判断）")
+    for i, rule in enumerate(rules, 1):
+        lines.append(f"{i}. {rule}")
+    lines.append("")
+    return "\n".join(lines) + "\n" + output_format
+
+ROUTER_COMPACT_SYSTEM_PROMPT = build_router_prompt()
@@ -0,0 +1,146 @@
+import os
+import time
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from langchain_core.messages import SystemMessage, HumanMessage
+import metrics
+from streaming import split_thoughts
+
+# Reply cache for utterances an elder repeats many times a day ("我要回家", "妈妈在哪里").
+# An entry is keyed by the elder (thread_id), the agent the conversation is with, a
+# fingerprint of the previous utterances and the normalized text; near-duplicates
+# ("我要回家！我要回家") match by character-bigram overlap. Process memory only, TTL + LRU.
+# RESPONSE_CACHE:
+#   "off"   - default, nothing is stored or looked up
+#   "serve" - a repeated utterance gets the stored reply right away, no router or agent call
+#   "draft" - the stored reply is handed to the agent as a reference, the agent still answers
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "off")
+RESPONSE_CACHE_AGENTS = set(os.getenv("RESPONSE_CACHE_AGENTS", "wan_qing").split(","))
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "1800"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "5000"))
+# Bigram Jaccard similarity above which two utterances count as the same
+# ("我要回家啊我要回家" vs "我要回家" is 0.6, "我要回家" vs "我要回去" is 0.5)
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.6"))
+# Previous user utterances that must also match after normalization. 0 = the utterance
+# alone decides: repetition loops rarely repeat the preceding utterance exactly.
+RESPONSE_CACHE_CONTEXT = int(os.getenv("RESPONSE_CACHE_CONTEXT", "0"))
+
+DRAFT_BLOCK_PREFIX = "【参考回复】老人刚才说过同样的话，你上次是这样回应的。保持同样的安抚方向，可以换个说法："
+
+_entries = OrderedDict()
+# (thread_id, target, context) -> keys of its entries, for the near-duplicate scan
+_buckets = {}
+_lock = threading.Lock()
+
+def normalize(text):
+    """NFKC, lower case, no whitespace, punctuation or symbols."""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return "".join(ch for ch in text if unicodedata.category(ch)[0] not in "PSZC")
+
+def bigrams(text):
+    return {text[i:i + 2] for i in range(len(text) - 1)} or {text}
+
+def similarity(a, b):
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+def _utterances(messages):
+    return [normalize(str(m.content)) for m in messages if isinstance(m, HumanMessage)]
+
+def fingerprint(previous):
+    if RESPONSE_CACHE_CONTEXT <= 0:
+        return ""
+    recent = previous[-RESPONSE_CACHE_CONTEXT:]
+    return hashlib.sha1("\n".join(recent).encode("utf-8")).hexdigest()[:12]
+
+def _split(messages):
+    """(current utterance, context fingerprint) of the turn, or (None, None)."""
+    utterances = _utterances(messages)
+    if not utterances or not utterances[-1]:
+        return None, None
+    return utterances[-1], fingerprint(utterances[:-1])
+
+def _evict(key):
+    _entries.pop(key, None)
+    bucket = _buckets.get(key[:3])
+    if bucket is not None:
+        bucket.discard(key)
+        if not bucket:
+            del _buckets[key[:3]]
+
+def lookup(thread_id, target, messages):
+    """
+    Stored reply for the current utterance of `messages` with agent `target`, or None.
+    Returns a dict with content, similarity and the agent seconds the reply originally took.
+    """
+    if RESPONSE_CACHE == "off" or target not in RESPONSE_CACHE_AGENTS:
+        return None
+    text, context = _split(messages)
+    if text is None:
+        return None
+    now = time.time()
+    with _lock:
+        key = (thread_id, target, context, text)
+        best = _entries.get(key)
+        score = 1.0 if best is not None else 0.0
+        if best is None:
+            grams = bigrams(text)
+            for other in list(_buckets.get(key[:3], ())):
+                entry = _entries[other]
+                if now - entry["created"] > RESPONSE_CACHE_TTL:
+                    _evict(other)
+                    continue
+                value = similarity(grams, entry["grams"])
+                if value >= RESPONSE_CACHE_SIMILARITY and value > score:
+                    best, score, key = entry, value, other
+        if best is not None and now - best["created"] > RESPONSE_CACHE_TTL:
+            _evict(key)
+            best = None
+        if best is None:
+            metrics.incr("response_cache.miss")
+            return None
+        _entries.move_to_end(key)
+        best["hits"] += 1
+    metrics.incr("response_cache.hit")
+    if score < 1.0:
+        metrics.incr("response_cache.near_hit")
+    return {"content": best["content"], "similarity": score, "seconds": best["seconds"]}
+
+def store(thread_id, target, messages, content, seconds):
+    """Remember the reply `target` gave to the current utterance (took `seconds`)."""
+    if RESPONSE_CACHE == "off" or target not in RESPONSE_CACHE_AGENTS or not content:
+        return
+    text, context = _split(messages)
+    if text is None:
+        return
+    key = (thread_id, target, context, text)
+    with _lock:
+        _entries[key] = {"content": content, "grams": bigrams(text), "created": time.time(),
+                         "seconds": seconds, "hits": 0}
+        _entries.move_to_end(key)
+        _buckets.setdefault(key[:3], set()).add(key)
+        while len(_entries) > RESPONSE_CACHE_SIZE:
+            _evict(next(iter(_entries)))
+
+def record_served(entry):
+    """Count the agent time a served hit saved."""
+    metrics.incr("response_cache.served")
+    metrics.incr("response_cache.saved_ms", int(entry["seconds"] * 1000))
+
+def draft_block(thread_id, target, messages):
+    """Draft mode: the stored reply as a reference for the agent, or None."""
+    if RESPONSE_CACHE != "draft":
+        return None
+    entry = lookup(thread_id, target, messages)
+    if entry is None:
+        return None
+    metrics.incr("response_cache.drafted")
+    visible, _ = split_thoughts(entry["content"])
+    return SystemMessage(content=f"{DRAFT_BLOCK_PREFIX}\n{visible}")
+
+def clear(thread_id=None):
+    """Drop all entries, or only those of one elder."""
+    with _lock:
+        for key in [k for k in _entries if thread_id is None or k[0] == thread_id]:
+            _evict(key)
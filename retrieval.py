@@ -0,0 +1,249 @@
+import os
+import re
+import json
+import zlib
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from langchain_core.messages import SystemMessage, HumanMessage
+import metrics
+
+try:
+    import jieba
+except ImportError:
+    jieba = None
+
+# Local retrieval over everything an elder has said, so agents can recall a spouse's name
+# or a hometown mentioned months ago without widening the 20-message window.
+# Each utterance becomes a vector of BM25 term weights over hashed character n-grams (no
+# model, no network); one float32 matrix per elder lives in a memory-mapped file and a
+# query is one mat-vec against the IDF-weighted query terms.
+# Opt-in: it writes an index under RETRIEVAL_DIR.
+RETRIEVAL = os.getenv("RETRIEVAL", "0") == "1"
+RETRIEVAL_DIR = os.getenv("RETRIEVAL_DIR", "retrieval_index")
+RETRIEVAL_DIM = int(os.getenv("RETRIEVAL_DIM", "512"))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "3"))
+# Elder indexes kept open in process (LRU); an evicted one is flushed and reopened from disk
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "256"))
+# Share of the query's IDF mass an utterance must match to be used
+RETRIEVAL_MIN_SCORE = float(os.getenv("RETRIEVAL_MIN_SCORE", "0.2"))
+# Word features from jieba on top of character n-grams, if jieba is installed
+RETRIEVAL_JIEBA = os.getenv("RETRIEVAL_JIEBA", "1") == "1" and jieba is not None
+
+MEMORY_BLOCK_PREFIX = "【相关往事】老人以前说过下面这些话，和当前话题有关时可以自然地提起："
+
+# Function words that would otherwise make every utterance look alike
+STOP_CHARS = set("的了是我你他她它们在有和就也都很吗呢吧啊呀哦嗯这那个不没还要会说去来到着过")
+STOP_BIGRAMS = {"时候", "什么", "怎么", "我们", "你们", "他们", "一个", "这个", "那个", "没有", "就是",
+                "还是", "觉得", "知道", "现在", "自己", "可以", "已经"}
+_TOKEN_RE = re.compile(r"[一-鿿]+|[A-Za-z]+|\d+")
+_MIN_INDEX_CHARS = 4
+_INITIAL_CAPACITY = 256
+# BM25 parameters; utterance length is normalized against a fixed typical length so stored
+# rows never need rewriting as the corpus grows
+BM25_K1 = 1.2
+BM25_B = 0.75
+BM25_AVG_LENGTH = 16.0
+
+def _features(text):
+    for run in _TOKEN_RE.findall(text.lower()):
+        if not "一" <= run[0] <= "鿿":
+            yield run, 1.0
+            continue
+        if len(run) == 1:
+            if run not in STOP_CHARS:
+                yield run, 1.0
+            continue
+        # Character bigrams: single characters match far too much unrelated text
+        for i in range(len(run) - 1):
+            if run[i:i + 2] not in STOP_BIGRAMS:
+                yield run[i:i + 2], 1.0
+    if RETRIEVAL_JIEBA:
+        for word in jieba.lcut(text):
+            if len(word) > 1 and _TOKEN_RE.fullmatch(word):
+                yield "w:" + word, 1.5
+
+def term_counts(text, dim=RETRIEVAL_DIM):
+    """Weighted feature counts of a text, hashed into `dim` buckets (crc32)."""
+    counts = np.zeros(dim, dtype=np.float32)
+    for feature, weight in _features(text):
+        counts[zlib.crc32(feature.encode("utf-8")) % dim] += weight
+    return counts
+
+def document_vector(text, dim=RETRIEVAL_DIM):
+    """BM25 term weights of one utterance (the tf part; IDF is applied on the query side)."""
+    counts = term_counts(text, dim)
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * counts.sum() / BM25_AVG_LENGTH)
+    return counts * (BM25_K1 + 1) / (counts + norm)
+
+class ElderIndex:
+    """
+    Append-only index of one thread's utterances:
+    <key>.vec   float32 weights, memory-mapped, bucket-major (dim x capacity): a query only
+                reads the rows of the buckets it contains; capacity doubles when full
+    <key>.jsonl one {"id", "text"} line per utterance; its line count is the column count
+    """
+    def __init__(self, thread_id, directory=RETRIEVAL_DIR, dim=RETRIEVAL_DIM):
+        os.makedirs(directory, exist_ok=True)
+        key = hashlib.sha1(thread_id.encode("utf-8")).hexdigest()[:16]
+        self.dim = dim
+        self.vec_path = os.path.join(directory, f"{key}.vec")
+        self.meta_path = os.path.join(directory, f"{key}.jsonl")
+        self.lock = threading.Lock()
+        self.ids = []
+        self.texts = []
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, encoding="utf-8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self.ids.append(entry["id"])
+                    self.texts.append(entry["text"])
+        self.known = set(self.ids)
+        if os.path.exists(self.vec_path):
+            self.capacity = os.path.getsize(self.vec_path) // (4 * dim)
+            self.vectors = np.memmap(self.vec_path, dtype=np.float32, mode="r+", shape=(dim, self.capacity))
+        else:
+            self.capacity = _INITIAL_CAPACITY
+            self.vectors = np.memmap(self.vec_path, dtype=np.float32, mode="w+", shape=(dim, self.capacity))
+        # A crash between the two appends can leave a line without its column
+        del self.ids[self.capacity:], self.texts[self.capacity:]
+        # Utterances per hash bucket, for IDF weighting of the query
+        self.df = (self.vectors[:, :len(self.ids)] > 0).sum(axis=1).astype(np.float32)
+
+    def _grow(self):
+        tmp_path = self.vec_path + ".tmp"
+        grown = np.memmap(tmp_path, dtype=np.float32, mode="w+", shape=(self.dim, self.capacity * 2))
+        grown[:, :self.capacity] = self.vectors
+        grown.flush()
+        del self.vectors, grown
+        os.replace(tmp_path, self.vec_path)
+        self.capacity *= 2
+        self.vectors = np.memmap(self.vec_path, dtype=np.float32, mode="r+", shape=(self.dim, self.capacity))
+
+    def add(self, msg_id, text):
+        """True if added, False if already indexed, None if the index was closed meanwhile."""
+        with self.lock:
+            if self.vectors is None:
+                return None
+            if msg_id in self.known:
+                return False
+            if len(self.ids) == self.capacity:
+                self._grow()
+            # Vector first: a crash in between leaves an unused column, never a line without one
+            vec = document_vector(text, self.dim)
+            self.vectors[:, len(self.ids)] = vec
+            self.df += vec > 0
+            with open(self.meta_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"id": msg_id, "text": text}, ensure_ascii=False) + "\n")
+            self.ids.append(msg_id)
+            self.texts.append(text)
+            self.known.add(msg_id)
+            return True
+
+    def search(self, query, k=RETRIEVAL_TOP_K, exclude=(), min_score=RETRIEVAL_MIN_SCORE):
+        """Top-k (score, text) pairs, best first, skipping ids in `exclude`."""
+        with self.lock:
+            count = len(self.ids)
+            if count == 0 or self.vectors is None:
+                return []
+            # Buckets that occur in most utterances ("今天", "我们") say little about relevance;
+            # buckets no utterance has can't match anything and are left out of the total
+            idf = np.log1p((count - self.df + 0.5) / (self.df + 0.5))
+            query_vec = np.minimum(term_counts(query, self.dim), 1.0) * idf
+            buckets = np.flatnonzero(query_vec)
+            if len(buckets) == 0:
+                return []
+            # Normalized so a score is roughly the share of the query's IDF mass matched
+            weights = query_vec[buckets] / query_vec[buckets].sum()
+            scores = weights @ self.vectors[buckets, :count]
+            ids = self.ids
+            texts = self.texts
+        # Over-fetch a little so excluded (still visible) messages don't starve the result
+        fetch = min(count, k + len(exclude))
+        top = np.argpartition(-scores, fetch - 1)[:fetch]
+        results = []
+        for i in top[np.argsort(-scores[top])]:
+            if scores[i] < min_score:
+                break
+            if ids[i] in exclude:
+                continue
+            results.append((float(scores[i]), texts[i]))
+            if len(results) == k:
+                break
+        return results
+
+    def flush(self):
+        with self.lock:
+            if self.vectors is not None:
+                self.vectors.flush()
+
+    def close(self):
+        """Flush and unmap; waits for an add or search in progress."""
+        with self.lock:
+            if self.vectors is not None:
+                self.vectors.flush()
+                self.vectors = None
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+# One worker: writes to an index stay in order and never compete with each other
+_index_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="retrieval-index")
+
+def get_index(thread_id):
+    with _indexes_lock:
+        index = _indexes.get(thread_id)
+        if index is not None:
+            _indexes.move_to_end(thread_id)
+            return index
+        index = _indexes[thread_id] = ElderIndex(thread_id)
+        while len(_indexes) > RETRIEVAL_CACHE_SIZE:
+            # Closed before the lock is released, so a reopened index never sees a half-done add
+            _, evicted = _indexes.popitem(last=False)
+            evicted.close()
+        return index
+
+def _index_messages(thread_id, pairs):
+    try:
+        added = 0
+        for msg_id, text in pairs:
+            result = get_index(thread_id).add(msg_id, text)
+            if result is None:
+                # Evicted between lookup and add
+                result = get_index(thread_id).add(msg_id, text)
+            added += bool(result)
+        metrics.incr("retrieval.indexed", added)
+    except Exception as e:
+        print(f"Retrieval index error ({thread_id}): {e}")
+        metrics.incr("retrieval.errors")
+
+def schedule_index(thread_id, messages):
+    """Index the elder's new utterances in the background (only ones not indexed yet)."""
+    if not RETRIEVAL or not thread_id:
+        return
+    index = get_index(thread_id)
+    pairs = []
+    # New messages are at the end; stop at the first one that is already indexed
+    for msg in reversed(messages):
+        if not isinstance(msg, HumanMessage) or not msg.id:
+            continue
+        if msg.id in index.known:
+            break
+        text = str(msg.content).strip()
+        if len(text) >= _MIN_INDEX_CHARS:
+            pairs.append((msg.id, text))
+    if pairs:
+        pairs.reverse()
+        _index_pool.submit(_index_messages, thread_id, pairs)
+
+def memory_block(thread_id, query, visible_ids=()):
+    """SystemMessage with the top-k past utterances relevant to `query`, or None."""
+    if not RETRIEVAL or not thread_id or not query:
+        return None
+    results = get_index(thread_id).search(query, exclude=set(visible_ids))
+    metrics.incr("retrieval.hit" if results else "retrieval.miss")
+    if not results:
+        return None
+    lines = "\n".join(f"- {text}" for _, text in results)
+    return SystemMessage(content=f"{MEMORY_BLOCK_PREFIX}\n{lines}")
@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import metrics
+import prompt_cache
+from checkpointer import connect_sqlite
+
+# Memo of LLM router decisions keyed by a hash of exactly what the router would see: the
+# cleaned history, the router prompts and the model/output settings. Retries, Streamlit
+# reruns and duplicate submissions then reuse the decision instead of another LLM call.
+# An in-process LRU, optionally backed by a SQLite table (ROUTER_CACHE_DB) that survives
+# restarts and is shared by processes on the same machine.
+ROUTER_CACHE = os.getenv("ROUTER_CACHE", "1") == "1"
+ROUTER_CACHE_SIZE = int(os.getenv("ROUTER_CACHE_SIZE", "2048"))
+ROUTER_CACHE_DB = os.getenv("ROUTER_CACHE_DB", "")
+ROUTER_CACHE_TTL = int(os.getenv("ROUTER_CACHE_TTL", "86400"))
+
+_memory = OrderedDict()
+_lock = threading.Lock()
+_conn = None
+_db_lock = threading.Lock()
+
+def _prompts_digest():
+    # Editing a router prompt invalidates decisions stored on disk
+    h = hashlib.sha1()
+    for name in ["router", "router_structured", "router_compact"]:
+        h.update(prompt_cache.prefix_message(name).content.encode("utf-8"))
+    return h.digest()
+
+_PROMPTS_DIGEST = _prompts_digest()
+
+def key(clean_msgs, scope=""):
+    """
+    Fingerprint of the routing input (message types and contents, no ids).
+    `scope` carries the settings that change decisions (model, prompt tier, output mode).
+    """
+    h = hashlib.sha1(_PROMPTS_DIGEST)
+    h.update(scope.encode("utf-8"))
+    for msg in clean_msgs:
+        h.update(f"\x1e{msg.type}\x1f{msg.content}".encode("utf-8"))
+    return h.hexdigest()
+
+def _db():
+    global _conn
+    if _conn is None:
+        _conn = connect_sqlite(ROUTER_CACHE_DB)
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS router_decisions (
+                key TEXT PRIMARY KEY,
+                analysis TEXT NOT NULL,
+                target TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        _conn.commit()
+    return _conn
+
+def _remember(k, decision):
+    with _lock:
+        _memory[k] = decision
+        _memory.move_to_end(k)
+        while len(_memory) > ROUTER_CACHE_SIZE:
+            _memory.popitem(last=False)
+
+def get(k):
+    """Cached (analysis, target) for routing key `k`, or None."""
+    if not ROUTER_CACHE:
+        return None
+    with _lock:
+        decision = _memory.get(k)
+        if decision is not None:
+            _memory.move_to_end(k)
+    if decision is None and ROUTER_CACHE_DB:
+        with _db_lock:
+            row = _db().execute(
+                "SELECT analysis, target FROM router_decisions WHERE key = ? AND created_at > ?",
+                (k, time.time() - ROUTER_CACHE_TTL)
+            ).fetchone()
+        if row:
+            decision = (json.loads(row[0]), row[1])
+            _remember(k, decision)
+            metrics.incr("router_cache.disk_hit")
+    if decision is None:
+        metrics.incr("router_cache.miss")
+        return None
+    metrics.incr("router_cache.hit")
+    analysis, target = decision
+    # Callers may annotate the analysis, keep the stored one intact
+    return dict(analysis), target
+
+def put(k, decision):
+    if not ROUTER_CACHE or not decision:
+        return
+    analysis, target = decision
+    decision = (dict(analysis), target)
+    _remember(k, decision)
+    if ROUTER_CACHE_DB:
+        with _db_lock:
+            conn = _db()
+            conn.execute(
+                "INSERT OR REPLACE INTO router_decisions (key, analysis, target, created_at) VALUES (?, ?, ?, ?)",
+                (k, json.dumps(analysis, ensure_ascii=False), target, time.time())
+            )
+            conn.commit()
+
+def clear():
+    with _lock:
+        _memory.clear()
+    if ROUTER_CACHE_DB:
+        with _db_lock:
+            conn = _db()
+            conn.execute("DELETE FROM router_decisions")
+            conn.commit()
@@ -0,0 +1,204 @@
+import re
+import json
+from langchain_core.messages import AIMessage
+
+AGENT_NODES = ["wan_qing", "xin_jing", "xing_zhe"]
+
+AGENT_DISPLAY_NAMES = {
+    "wan_qing": "晚晴",
+    "xin_jing": "心镜",
+    "xing_zhe": "行者"
+}
+
+# Hidden reasoning blocks emitted by the agents (see prompts.py)
+THOUGHT_TAGS = ["inner_thought", "inner_monologue"]
+
+def parse_router_message(content):
+    """
+    Extract the Router analysis JSON embedded between ROUTER_JSON_START/ROUTER_JSON_END.
+    Returns None if the content does not carry a router analysis.
+    """
+    if "ROUTER_JSON_START" not in content or "ROUTER_JSON_END" not in content:
+        return None
+    try:
+        start_idx = content.find("ROUTER_JSON_START") + len("ROUTER_JSON_START")
+        end_idx = content.find("ROUTER_JSON_END")
+        return json.loads(content[start_idx:end_idx])
+    except Exception as e:
+        print(f"Error parsing router JSON: {e}")
+        return None
+
+def split_thoughts(content):
+    """
+    Split a complete agent reply into (visible_text, thought_content).
+    Same rules as the UI always used: strip markdown fences, pull out
+    <inner_thought> and <inner_monologue> blocks (monologue wins if both exist).
+    """
+    thought_content = None
+
+    # Clean up Markdown code blocks if present
+    content = re.sub(r'^```\w*\s*', '', content)
+    content = re.sub(r'\s*```$', '', content)
+
+    for tag in THOUGHT_TAGS:
+        pattern = re.compile(rf'<{tag}>(.*?)</{tag}>', re.DOTALL)
+        match = pattern.search(content)
+        if match:
+            thought_content = match.group(1).strip()
+            content = pattern.sub('', content).strip()
+
+    return content, thought_content
+
+class ThoughtStreamSplitter:
+    """
+    Incremental version of split_thoughts for token streams.
+
+    feed() takes raw LLM chunks and returns only the text that is safe to show.
+    Anything that might still turn into an opening tag (e.g. a trailing "<inner_th")
+    is held back until the next chunk decides it, so hidden reasoning never
+    reaches the screen, not even for one frame.
+    """
+    def __init__(self):
+        self.thoughts = []
+        self._buffer = ""
+        self._in_tag = None
+        self._started = False
+        self._held = ""
+
+    def feed(self, chunk):
+        self._buffer += chunk
+        visible = ""
+        while self._buffer:
+            if self._in_tag:
+                close_tag = f"</{self._in_tag}>"
+                idx = self._buffer.find(close_tag)
+                if idx == -1:
+                    # Keep a possible partial closing tag in the buffer
+                    keep = len(close_tag) - 1
+                    if len(self._buffer) > keep:
+                        self.thoughts[-1] += self._buffer[:-keep]
+                        self._buffer = self._buffer[-keep:]
+                    break
+                self.thoughts[-1] += self._buffer[:idx]
+                self._buffer = self._buffer[idx + len(close_tag):]
+                self._in_tag = None
+                continue
+
+            idx = self._buffer.find("<")
+            if idx == -1:
+                visible += self._buffer
+                self._buffer = ""
+                break
+
+            visible += self._buffer[:idx]
+            rest = self._buffer[idx:]
+            opened = None
+            partial = False
+            for tag in THOUGHT_TAGS:
+                open_tag = f"<{tag}>"
+                if rest.startswith(open_tag):
+                    opened = tag
+                    break
+                if open_tag.startswith(rest):
+                    partial = True
+            if opened:
+                self._in_tag = opened
+                self.thoughts.append("")
+                self._buffer = rest[len(f"<{opened}>"):]
+            elif partial:
+                self._buffer = rest
+                break
+            else:
+                visible += "<"
+                self._buffer = rest[1:]
+        return self._emit(visible)
+
+    def _emit(self, text):
+        text = self._held + text
+        self._held = ""
+        if not self._started:
+            # Drop leading whitespace and an opening ```lang fence
+            text = text.lstrip()
+            if not text:
+                return ""
+            if "```".startswith(text) or (text.startswith("```") and "\n" not in text):
+                self._held = text
+                return ""
+            text = re.sub(r'^```\w*\s*', '', text)
+            if not text:
+                return ""
+            self._started = True
+        # Hold back trailing backticks/whitespace, they may be the closing fence
+        stripped = text.rstrip("`\n\r\t ")
+        self._held = text[len(stripped):]
+        return stripped
+
+    def flush(self):
+        """Return any remaining visible text at the end of the stream."""
+        tail = "" if self._in_tag else self._buffer
+        self._buffer = ""
+        text = self._emit(tail)
+        held = re.sub(r'\s*```$', '', self._held).rstrip()
+        self._held = ""
+        return text + held
+
+    @property
+    def thought_content(self):
+        if not self.thoughts:
+            return None
+        return self.thoughts[-1].strip()
+
+def stream_turn(app, inputs, config, stream_tokens=True):
+    """
+    Run one conversation turn and yield UI events as they happen:
+    - {"type": "router", "analysis": dict}
+    - {"type": "token", "agent": node, "text": str}   (only visible text)
+    - {"type": "final", "agent": node, "content": str, "thought": str|None}
+
+    With stream_tokens the graph is streamed with stream_mode="messages" so agent
+    tokens arrive as the LLM produces them; the final event always carries the
+    fully cleaned reply from the node update.
+    """
+    stream_mode = ["messages", "updates"] if stream_tokens else ["updates"]
+    splitters = {}
+    for mode, payload in app.stream(inputs, config=config, stream_mode=stream_mode):
+        yield from _turn_events(mode, payload, splitters)
+
+async def astream_turn(app, inputs, config, stream_tokens=True):
+    """Async variant of stream_turn() for graphs from graph.open_async_apps()."""
+    stream_mode = ["messages", "updates"] if stream_tokens else ["updates"]
+    splitters = {}
+    async for mode, payload in app.astream(inputs, config=config, stream_mode=stream_mode):
+        for event in _turn_events(mode, payload, splitters):
+            yield event
+
+def _turn_events(mode, payload, splitters):
+    if mode == "messages":
+        chunk, metadata = payload
+        node = metadata.get("langgraph_node")
+        # Router tokens are JSON, only agent tokens are user-facing
+        if node not in AGENT_NODES or not isinstance(chunk.content, str) or not chunk.content:
+            return
+        splitter = splitters.setdefault(node, ThoughtStreamSplitter())
+        text = splitter.feed(chunk.content)
+        if text:
+            yield {"type": "token", "agent": node, "text": text}
+        return
+
+    for key, value in payload.items():
+        if not value or not value.get("messages"):
+            continue
+        for msg in value["messages"]:
+            analysis = parse_router_message(_text(msg))
+            if analysis is not None:
+                yield {"type": "router", "analysis": analysis}
+
+        last_msg = value["messages"][-1]
+        # On a speculative hit the router update already carries the agent's reply
+        agent = key if key in AGENT_NODES else value.get("next")
+        if agent in AGENT_NODES and isinstance(last_msg, AIMessage):
+            visible, thought = split_thoughts(_text(last_msg))
+            yield {"type": "final", "agent": agent, "content": visible, "thought": thought}
+
+def _text(msg):
+    return msg.content if isinstance(msg.content, str) else str(msg.content)
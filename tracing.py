@@ -0,0 +1,244 @@
+import os
+import json
+import hashlib
+import time
+import queue
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import deque, defaultdict
+import metrics
+
+# Lightweight tracing: nested spans per turn (ASR, clean_history, router and agent LLM
+# calls, checkpoint reads/writes, UI render) with token counts and byte sizes.
+# Finished spans go to an in-memory ring buffer for the sidebar and, if TRACE_FILE is set,
+# to a JSONL file (OpenTelemetry span field names, one span per line) written by a
+# background thread. Exported spans carry a hash of the thread id, not the elder's name.
+# Span durations are also recorded as metrics timers "<span name>.seconds", even with
+# TRACING=0, so benchmarks keep working without the exporter.
+TRACING = os.getenv("TRACING", "1") == "1"
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(50 * 1024 * 1024)))
+RECENT_SPANS = int(os.getenv("TRACE_RECENT_SPANS", "5000"))
+
+_current = contextvars.ContextVar("tracing_current_span", default=None)
+_recent = deque(maxlen=RECENT_SPANS)
+_recent_lock = threading.Lock()
+_export_queue = queue.SimpleQueue()
+_writer = None
+_writer_lock = threading.Lock()
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.error = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def add(self, key, value):
+        """Accumulate a numeric attribute (bytes, tokens) over several calls."""
+        self.attributes[key] = self.attributes.get(key, 0) + value
+
+    @property
+    def duration_ms(self):
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def to_dict(self):
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id,
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "durationMs": round(self.duration_ms, 3),
+            "attributes": _exported(self.attributes),
+            "status": {"code": "ERROR", "message": self.error} if self.error else {"code": "OK"}
+        }
+
+def _exported(attributes):
+    thread_id = attributes.get("thread_id")
+    if thread_id is None:
+        return attributes
+    # Same hash as the retrieval index file names, so spans can still be joined per thread
+    hashed = hashlib.sha1(str(thread_id).encode("utf-8")).hexdigest()[:16]
+    return {**attributes, "thread_id": hashed}
+
+class _NoopSpan:
+    def set(self, key, value):
+        pass
+
+    def add(self, key, value):
+        pass
+
+NOOP_SPAN = _NoopSpan()
+
+def current():
+    """The innermost open span of this context (a no-op span if there is none)."""
+    return _current.get() or NOOP_SPAN
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Trace the with-block as a child of the current span:
+
+        with tracing.span("router.llm", prompt="router") as s:
+            ...
+            s.set("output_tokens", 12)
+    """
+    start = time.perf_counter()
+    if not TRACING:
+        try:
+            yield NOOP_SPAN
+        finally:
+            metrics.observe(f"{name}.seconds", time.perf_counter() - start)
+        return
+
+    s = Span(name, _current.get(), attributes)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current.reset(token)
+        s.end_ns = time.time_ns()
+        metrics.observe(f"{name}.seconds", time.perf_counter() - start)
+        _finish(s)
+
+def record(name, seconds, **attributes):
+    """Add an already measured span (e.g. summed UI render time) ending now under the current span."""
+    metrics.observe(f"{name}.seconds", seconds)
+    if not TRACING:
+        return
+    s = Span(name, _current.get(), attributes)
+    s.end_ns = time.time_ns()
+    s.start_ns = s.end_ns - int(seconds * 1e9)
+    _finish(s)
+
+def _finish(s):
+    with _recent_lock:
+        _recent.append(s)
+    if TRACE_FILE:
+        _ensure_writer()
+        _export_queue.put(s)
+
+def _ensure_writer():
+    global _writer
+    if _writer is not None:
+        return
+    with _writer_lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_write_loop, daemon=True, name="trace-exporter")
+            _writer.start()
+
+def _write_loop():
+    while True:
+        batch = [_export_queue.get()]
+        # Drain whatever else is queued so a busy turn costs one write
+        while True:
+            try:
+                batch.append(_export_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            if os.path.exists(TRACE_FILE) and os.path.getsize(TRACE_FILE) > TRACE_MAX_BYTES:
+                os.replace(TRACE_FILE, TRACE_FILE + ".1")
+            with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                for s in batch:
+                    f.write(json.dumps(s.to_dict(), ensure_ascii=False, default=str) + "\n")
+        except Exception as e:
+            print(f"Trace export error: {e}")
+
+def recent_spans():
+    with _recent_lock:
+        return list(_recent)
+
+def summary():
+    """Per span name: count, mean/p50/p95 ms and the mean of numeric attributes."""
+    groups = defaultdict(list)
+    for s in recent_spans():
+        groups[s.name].append(s)
+    rows = []
+    for name, spans in sorted(groups.items()):
+        durations = sorted(s.duration_ms for s in spans)
+        row = {
+            "span": name,
+            "count": len(spans),
+            "mean_ms": round(sum(durations) / len(durations), 2),
+            "p50_ms": round(metrics.percentile(durations, 50), 2),
+            "p95_ms": round(metrics.percentile(durations, 95), 2)
+        }
+        numeric = defaultdict(list)
+        for s in spans:
+            for key, value in s.attributes.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    numeric[key].append(value)
+        for key, values in sorted(numeric.items()):
+            row[f"avg_{key}"] = round(sum(values) / len(values), 1)
+        rows.append(row)
+    return rows
+
+def last_trace(root="turn"):
+    """Spans of the most recent trace whose root span is `root`, ordered by start time."""
+    spans = recent_spans()
+    roots = [s for s in spans if s.name == root and s.parent_id is None]
+    if not roots:
+        return []
+    trace_id = roots[-1].trace_id
+    return sorted((s for s in spans if s.trace_id == trace_id), key=lambda s: s.start_ns)
+
+class TracedSerde:
+    """Serializer wrapper that adds serialized sizes to the current span."""
+    def __init__(self, serde):
+        self._serde = serde
+
+    def dumps_typed(self, obj):
+        result = self._serde.dumps_typed(obj)
+        current().add("bytes", len(result[1]) if result[1] else 0)
+        return result
+
+    def loads_typed(self, data):
+        current().add("bytes", len(data[1]) if data[1] else 0)
+        return self._serde.loads_typed(data)
+
+    def __getattr__(self, name):
+        return getattr(self._serde, name)
+
+def _checkpoint_attributes(method, args):
+    if method.endswith("put"):
+        return {"op": "put"}
+    if method.endswith("put_writes"):
+        return {"op": "put_writes", "writes": len(args[1]) if len(args) > 1 else 0}
+    return {"op": "get_tuple"}
+
+def instrument_checkpointer(saver):
+    """Trace reads ("checkpoint.read") and writes ("checkpoint.write") of a checkpoint saver in place."""
+    if isinstance(saver.serde, TracedSerde):
+        return saver
+    saver.serde = TracedSerde(saver.serde)
+    for method in ["get_tuple", "put", "put_writes"]:
+        original = getattr(saver, method)
+        name = "checkpoint.read" if method == "get_tuple" else "checkpoint.write"
+        def wrapper(*args, _original=original, _method=method, _name=name, **kwargs):
+            with span(_name, **_checkpoint_attributes(_method, args)):
+                return _original(*args, **kwargs)
+        setattr(saver, method, wrapper)
+    for method in ["aget_tuple", "aput", "aput_writes"]:
+        original = getattr(saver, method)
+        name = "checkpoint.read" if method == "aget_tuple" else "checkpoint.write"
+        async def awrapper(*args, _original=original, _method=method, _name=name, **kwargs):
+            with span(_name, **_checkpoint_attributes(_method, args)):
+                return await _original(*args, **kwargs)
+        setattr(saver, method, awrapper)
+    return saver
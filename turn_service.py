@@ -0,0 +1,117 @@
+import os
+import time
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from idempotency import EventLog
+import metrics
+
+# Runs turns on a bounded worker pool instead of the caller's thread (the Streamlit script
+# run, a request handler). Turns of one elder run one at a time in submission order; turns
+# of different elders run in parallel up to TURN_WORKERS. Admission control keeps the
+# backlog bounded: past TURN_MAX_PENDING turns in total, or TURN_MAX_PER_THREAD for one
+# elder, submit() raises Overloaded right away instead of queueing work nobody will wait for.
+TURN_WORKERS = int(os.getenv("TURN_WORKERS", "8"))
+TURN_MAX_PENDING = int(os.getenv("TURN_MAX_PENDING", "64"))
+TURN_MAX_PER_THREAD = int(os.getenv("TURN_MAX_PER_THREAD", "3"))
+
+class Overloaded(Exception):
+    """The service is at its admission limit; the caller should retry later."""
+
+class TurnHandle(EventLog):
+    """
+    A submitted turn. Read its events with replay() (blocking, from the start, any number
+    of times, e.g. again after a Streamlit rerun) or poll(start) (non-blocking).
+    """
+    def __init__(self, thread_id, key=None):
+        super().__init__()
+        self.thread_id = thread_id
+        self.key = key
+        self.submitted_at = time.time()
+        self.started_at = None
+
+class TurnService:
+    def __init__(self, workers=TURN_WORKERS, max_pending=TURN_MAX_PENDING, max_per_thread=TURN_MAX_PER_THREAD):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_per_thread = max_per_thread
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="turn-worker")
+        self._waiting = {}
+        self._running = set()
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, thread_id, start, key=None):
+        """
+        Queue a turn; `start()` returns its event iterator and runs on a worker.
+        `key` is free for the caller (e.g. the user input, to re-attach after a rerun).
+        """
+        with self._lock:
+            queued = len(self._waiting.get(thread_id, ())) + (thread_id in self._running)
+            if self._pending >= self.max_pending or queued >= self.max_per_thread:
+                metrics.incr("turn_service.rejected")
+                raise Overloaded(f"{self._pending} turns pending, {queued} for {thread_id}")
+            handle = TurnHandle(thread_id, key)
+            # Spans opened by the caller (e.g. the UI's turn span) stay the parents
+            job = (handle, start, contextvars.copy_context())
+            self._pending += 1
+            if thread_id in self._running:
+                self._waiting.setdefault(thread_id, deque()).append(job)
+            else:
+                self._running.add(thread_id)
+                self._pool.submit(self._run, job)
+        metrics.incr("turn_service.submitted")
+        return handle
+
+    def _run(self, job):
+        handle, start, ctx = job
+        handle.started_at = time.time()
+        metrics.observe("turn_service.wait.seconds", handle.started_at - handle.submitted_at)
+        try:
+            ctx.run(self._execute, handle, start)
+        finally:
+            with self._lock:
+                self._pending -= 1
+                waiting = self._waiting.get(handle.thread_id)
+                if waiting:
+                    self._pool.submit(self._run, waiting.popleft())
+                    if not waiting:
+                        del self._waiting[handle.thread_id]
+                else:
+                    self._running.discard(handle.thread_id)
+
+    def _execute(self, handle, start):
+        try:
+            for event in start():
+                handle.publish(event)
+        except Exception as e:
+            metrics.incr("turn_service.errors")
+            handle.finish(e)
+        else:
+            handle.finish()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "running": len(self._running),
+                "queued": self._pending - len(self._running),
+                "max_pending": self.max_pending
+            }
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_service():
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = TurnService()
+        return _service
+
+def submit(thread_id, start, key=None):
+    return get_service().submit(thread_id, start, key)
+
+def stats():
+    return get_service().stats()
@@ -1,6 +1,8 @@
 import streamlit as st
 import os
 import sys
+import time
+import uuid
 import numpy as np
 
 # Load secrets into environment variables for Streamlit Cloud
@@ -31,14 +33,25 @@ except Exception as e:
 
 from langchain_core.messages import HumanMessage, AIMessage
 from dotenv import load_dotenv
-import re
-import json
 
 # Load environment variables (for local dev)
 load_dotenv()
 
 # Import graph AFTER loading secrets/env vars
 from graph import app_router
+from streaming import stream_turn, AGENT_DISPLAY_NAMES
+import metrics
+import tracing
+import idempotency
+import turn_service
+from compaction import maybe_compact
+import prompt_cache
+
+# Stream agent tokens into the chat bubble (set STREAM_RESPONSES=0 to wait for the full reply)
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "1") != "0"
+# Live ASR endpoint of api_server.py as the browser reaches it (e.g. wss://host/v1/asr).
+# Set: speech is recognized while the button is held. Empty: WAV upload after release.
+ASR_STREAM_URL = os.getenv("ASR_STREAM_URL", "")
 
 # Page Config
 st.set_page_config(page_title="老年陪伴 Agent", page_icon="👴", initial_sidebar_state="expanded")
@@ -165,6 +178,64 @@ with st.sidebar:
     st.markdown("**说明**：")
     st.markdown("1. 支持文字输入")
     st.markdown("2. 系统会自动选择最合适的陪伴模式 (晚晴/心镜/行者)")
+    
+    # Runtime metrics (speculative routing hit rate etc.), shared by all sessions of this process
+    metrics_snapshot = metrics.snapshot()
+    if metrics_snapshot:
+        with st.expander("📊 运行指标", expanded=False):
+            hit_rate = metrics.rate("speculative.hit", "speculative.miss")
+            if hit_rate is not None:
+                st.metric("预测路由命中率", f"{hit_rate:.0%}")
+            local_rate = metrics.rate("local_router.hit", "local_router.fallback")
+            if local_rate is not None:
+                st.metric("本地路由直达率", f"{local_rate:.0%}")
+            agree_rate = metrics.rate("local_router.confident.agree", "local_router.confident.disagree")
+            if agree_rate is not None:
+                st.metric("本地路由与LLM一致率", f"{agree_rate:.0%}")
+            service = turn_service.stats()
+            st.metric("进行中/排队的对话", f"{service['running']} / {service['queued']}")
+            if metrics.get("turn_service.rejected"):
+                st.metric("因繁忙被拒绝的对话", metrics.get("turn_service.rejected"))
+            if metrics.get("idempotency.coalesced"):
+                st.metric("合并的重复提交", metrics.get("idempotency.coalesced"))
+            router_cache_rate = metrics.rate("router_cache.hit", "router_cache.miss")
+            if router_cache_rate is not None:
+                st.metric("路由决策缓存命中率", f"{router_cache_rate:.0%}")
+            cache_ratio = prompt_cache.cached_ratio()
+            if cache_ratio is not None:
+                st.metric("提示词缓存命中Token占比", f"{cache_ratio:.0%}")
+            parse_failures = metrics.get("router.parse_failure")
+            if parse_failures:
+                st.metric("路由解析失败次数", parse_failures)
+            reply_rate = metrics.rate("response_cache.hit", "response_cache.miss")
+            if reply_rate is not None:
+                st.metric("回复缓存命中率", f"{reply_rate:.0%}")
+                if metrics.get("response_cache.saved_ms"):
+                    st.metric("回复缓存节省耗时", f"{metrics.get('response_cache.saved_ms') / 1000:.1f} s")
+            if metrics.get("long_term_memory.updates"):
+                st.metric("长期记忆更新次数", metrics.get("long_term_memory.updates"))
+            st.json(metrics_snapshot)
+
+    # Where the time of a turn goes, from the spans of recent turns (see tracing.py)
+    trace_summary = tracing.summary()
+    if trace_summary:
+        with st.expander("⏱️ 链路追踪", expanded=False):
+            last_turn = tracing.last_trace("turn")
+            if last_turn:
+                st.caption(f"最近一轮耗时 {last_turn[0].duration_ms:.0f} ms")
+                st.dataframe([
+                    {
+                        "span": s.name,
+                        "start_ms": round((s.start_ns - last_turn[0].start_ns) / 1e6, 1),
+                        "ms": round(s.duration_ms, 1),
+                        **{k: v for k, v in s.attributes.items() if k.endswith(("tokens", "bytes"))}
+                    }
+                    for s in last_turn
+                ], hide_index=True)
+            st.caption("各阶段统计（最近的span）")
+            st.dataframe(trace_summary, hide_index=True)
+            if tracing.TRACE_FILE:
+                st.caption(f"完整记录：{tracing.TRACE_FILE}")
 
 # Initialize Session State
 if "messages" not in st.session_state:
@@ -175,6 +246,8 @@ if "processing_input" not in st.session_state:
     st.session_state.processing_input = False
 if "last_audio_bytes" not in st.session_state:
     st.session_state.last_audio_bytes = None
+if "active_turn" not in st.session_state:
+    st.session_state.active_turn = None
 
 # Update thread_id if user_name changes
 current_thread_id = f"Router:{user_name}"
@@ -203,87 +276,97 @@ for msg in st.session_state.messages:
             st.markdown(msg.content)
 
 # Logic to generate response
-def generate_response(user_input):
-    # Process with Agent
+def generate_response(user_message):
+    # Process with Agent; the message shown in the UI is the one checkpointed (same id)
+    user_input = user_message.content
     config = {"configurable": {"thread_id": st.session_state.thread_id}}
-    inputs = {"messages": [HumanMessage(content=user_input)]}
+    inputs = {"messages": [user_message]}
     
     with st.chat_message("assistant"):
+        # Placeholders in the same order as the history view: analysis, thought, reply
+        analysis_placeholder = st.empty()
+        thought_placeholder = st.empty()
         message_placeholder = st.empty()
         full_response = ""
         router_analysis = None
         thought_content = None
         agent_name_for_history = "Agent"
-        
-        # Show "Thinking..." indicator
-        with st.spinner("Agent正在思考中..."):
+
+        def handle_event(event):
+            nonlocal full_response, router_analysis, thought_content, agent_name_for_history
+            if event["type"] == "router":
+                router_analysis = event["analysis"]
+                # Display Router Analysis Expander as soon as the decision is known
+                with analysis_placeholder.container():
+                    with st.expander("🔍 Router 意图分析 (点击展开)", expanded=False):
+                        st.json(router_analysis)
+            elif event["type"] == "token":
+                # Only visible text reaches here, thought blocks are split off on the fly
+                full_response += event["text"]
+                message_placeholder.markdown(full_response + "▌")
+            elif event["type"] == "final":
+                full_response = event["content"]
+                thought_content = event["thought"]
+                agent_name = AGENT_DISPLAY_NAMES.get(event["agent"], event["agent"])
+                agent_name_for_history = agent_name
+                
+                # Display Agent Thought Expander
+                with thought_placeholder.container():
+                    with st.expander(f"💭 {agent_name} Agent 思考过程 (点击展开)", expanded=False):
+                        st.markdown(thought_content if thought_content else "（本次无返回或模型未生成）")
+                
+                message_placeholder.markdown(full_response)
+
+        # Time spent updating placeholders, reported as one ui.render span per turn
+        render = {"seconds": 0.0, "events": 0}
+
+        def render_event(event):
+            start = time.perf_counter()
+            handle_event(event)
+            render["seconds"] += time.perf_counter() - start
+            render["events"] += 1
+
+        thread_id = st.session_state.thread_id
+        with tracing.span("turn", thread_id=thread_id, input_chars=len(user_input)) as turn_span:
+            turn_start = time.perf_counter()
+            # The turn runs on a worker (see turn_service.py); after a rerun the same
+            # handle is picked up again and replayed from the start
+            handle = st.session_state.active_turn
+            if handle is None or handle.key != user_message.id:
+                try:
+                    handle = turn_service.submit(
+                        thread_id,
+                        # The same text sent again right away (a second tab, a double submit)
+                        # shares one execution
+                        lambda: idempotency.stream(
+                            thread_id, user_input,
+                            lambda: stream_turn(app_router, inputs, config, stream_tokens=STREAM_RESPONSES)
+                        ),
+                        key=user_message.id
+                    )
+                except turn_service.Overloaded:
+                    message_placeholder.warning("现在使用的人比较多，请稍等一会儿再说一次。")
+                    return
+                st.session_state.active_turn = handle
             try:
-                # Use stream to get real-time response
-                for event in app_router.stream(inputs, config=config):
-                    for key, value in event.items():
-                        # Capture Router Analysis if available
-                        if "messages" in value:
-                            messages = value["messages"]
-                            if messages:
-                                last_msg_content = messages[-1].content
-                                # Check for hidden Router JSON
-                                if "ROUTER_JSON_START" in last_msg_content and "ROUTER_JSON_END" in last_msg_content:
-                                    try:
-                                        start_idx = last_msg_content.find("ROUTER_JSON_START") + 17
-                                        end_idx = last_msg_content.find("ROUTER_JSON_END")
-                                        json_str = last_msg_content[start_idx:end_idx]
-                                        router_analysis = json.loads(json_str)
-                                    except Exception as e:
-                                        print(f"Error parsing router JSON in web app: {e}")
-
-                        # We are looking for the final response from one of the agents
-                        if "messages" in value:
-                            messages = value["messages"]
-                            if messages and isinstance(messages[-1], (AIMessage, HumanMessage)): # Usually AIMessage from agent
-                                content = messages[-1].content
-                                
-                                # If the key is one of our agents, it's likely the final response
-                                if key in ["wan_qing", "xin_jing", "xing_zhe"]:
-                                    full_response = content
-                                    
-                                    # Clean up Markdown code blocks if present
-                                    full_response = re.sub(r'^```\w*\s*', '', full_response)
-                                    full_response = re.sub(r'\s*```$', '', full_response)
-                                    
-                                    # Extract inner_thought
-                                    thought_pattern = re.compile(r'<inner_thought>(.*?)</inner_thought>', re.DOTALL)
-                                    match = thought_pattern.search(full_response)
-                                    if match:
-                                        thought_content = match.group(1).strip()
-                                        full_response = thought_pattern.sub('', full_response).strip()
-                                    
-                                    monologue_pattern = re.compile(r'<inner_monologue>(.*?)</inner_monologue>', re.DOTALL)
-                                    match = monologue_pattern.search(full_response)
-                                    if match:
-                                        thought_content = match.group(1).strip()
-                                        full_response = monologue_pattern.sub('', full_response).strip()
-                                    
-                                    # Display Router Analysis Expander if available
-                                    if router_analysis:
-                                        with st.expander("🔍 Router 意图分析 (点击展开)", expanded=False):
-                                            st.json(router_analysis)
-                                    
-                                    # Display Agent Thought Expander if available
-                                    agent_display_names = {
-                                        "wan_qing": "晚晴",
-                                        "xin_jing": "心镜",
-                                        "xing_zhe": "行者"
-                                    }
-                                    agent_name = agent_display_names.get(key, key)
-                                    agent_name_for_history = agent_name
-                                    
-                                    with st.expander(f"💭 {agent_name} Agent 思考过程 (点击展开)", expanded=False):
-                                        st.markdown(thought_content if thought_content else "（本次无返回或模型未生成）")
-                                    
-                                    message_placeholder.markdown(full_response)
+                events = handle.replay()
+                # Show "Thinking..." indicator only until the first visible token
+                with st.spinner("Agent正在思考中..."):
+                    for event in events:
+                        render_event(event)
+                        if event["type"] in ["token", "final"]:
+                            turn_span.set("first_token_ms", round((time.perf_counter() - turn_start) * 1000, 1))
+                            break
+                for event in events:
+                    render_event(event)
             except Exception as e:
+                st.session_state.active_turn = None
                 st.error(f"发生错误: {e}")
                 return
+            finally:
+                tracing.record("ui.render", render["seconds"], events=render["events"],
+                               bytes=len(full_response.encode("utf-8")))
+        st.session_state.active_turn = None
 
         # If we got a response, save it
         if full_response:
@@ -297,17 +380,32 @@ def generate_response(user_input):
             )
             st.session_state.messages.append(ai_msg)
 
+        # Keep the stored thread bounded (summary + recent messages); the reply is already on screen.
+        # Compaction is queued on the thread's FIFO like a turn, so it never overlaps a turn of
+        # this elder and its summary LLM call (long-term memory) stays off the script thread
+        try:
+            turn_service.submit(thread_id, lambda: compaction_events(config))
+        except turn_service.Overloaded:
+            # The thread is busy; the next turn compacts it
+            pass
+
+def compaction_events(config):
+    # A turn_service job without events
+    maybe_compact(app_router, config)
+    return iter(())
+
 
 # Input Area
 # Add Audio Input
 from aliyun_asr_short import recognize_short_speech
-from audio_recorder_ptt import audio_recorder_ptt
+from audio_recorder_ptt import audio_recorder_ptt, Transcript
 
 # Callback to handle text input
 def handle_text_input():
     if st.session_state.user_input_text:
         # Just update state, don't write to UI
-        st.session_state.messages.append(HumanMessage(content=st.session_state.user_input_text))
+        # One id per submission, the turn handle key and kept in the checkpoint
+        st.session_state.messages.append(HumanMessage(content=st.session_state.user_input_text, id=str(uuid.uuid4())))
         st.session_state.processing_input = True
         st.session_state.user_input_text = ""
 
@@ -336,7 +434,8 @@ with col2:
             neutral_color="#07C160",
             icon_name="microphone",
             icon_size="2x",
-            key="ptt_recorder_component_v5" 
+            key="ptt_recorder_component_v5",
+            stream_url=ASR_STREAM_URL or None
         )
     except Exception as e:
         st.error(f"加载失败: {e}")
@@ -348,12 +447,16 @@ if audio_bytes and audio_bytes != st.session_state.last_audio_bytes and not st.s
     # Mark as processed to prevent loops
     st.session_state.last_audio_bytes = audio_bytes
     
-    st.info("接收到语音数据，正在识别...")
-    text = recognize_short_speech(audio_bytes)
+    if isinstance(audio_bytes, Transcript):
+        # Already recognized while the button was held
+        text = audio_bytes.text
+    else:
+        st.info("接收到语音数据，正在识别...")
+        text = idempotency.call(st.session_state.thread_id, audio_bytes, lambda: recognize_short_speech(audio_bytes))
     
     if text and not text.startswith("ASR Error") and not text.startswith("ASR Exception"):
         # st.success(f"识别结果: {text}") # Optional feedback
-        st.session_state.messages.append(HumanMessage(content=text))
+        st.session_state.messages.append(HumanMessage(content=text, id=str(uuid.uuid4())))
         st.session_state.processing_input = True
         st.rerun() # Rerun to update UI with new message and trigger processing
     elif text:
@@ -362,10 +465,11 @@ if audio_bytes and audio_bytes != st.session_state.last_audio_bytes and not st.s
         st.warning("未识别到有效的语音内容，请说话声音大一点或检查麦克风。")
 
 # 2. Handle Processing (Text or Audio Transcribed)
-if st.session_state.processing_input:
+# A turn still running from before a rerun is picked up again as well
+if st.session_state.processing_input or st.session_state.active_turn is not None:
     # Get the last message (which is the user input)
     if st.session_state.messages and isinstance(st.session_state.messages[-1], HumanMessage):
-        last_user_input = st.session_state.messages[-1].content
+        last_user_input = st.session_state.messages[-1]
         # We need to rerun to show the user message FIRST? 
         # No, we already appended it to messages list.
         # And the loop at the top has already displayed it (if we rerun).
@@ -379,3 +483,5 @@ if st.session_state.processing_input:
         st.session_state.processing_input = False # Reset flag
         generate_response(last_user_input)
         st.rerun() # Rerun to show the final result and update state cleanly
+    else:
+        st.session_state.active_turn = None